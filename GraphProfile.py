@@ -118,7 +118,11 @@ class _GraphProfile:
         if prop == "Path":
             if obj.getPropertyByName(prop):
                 from Utils import PVPlantUtils
-                profile = PVPlantUtils.FlattenWire(PVPlantUtils.makeProfileFromTerrain(obj.Path))
+                profile = PVPlantUtils.makeProfileFromTerrain(obj.Path)
+                if profile is None:
+                    obj.Points = []
+                    return
+                profile = PVPlantUtils.FlattenWire(profile)
                 obj.Points = PVPlantUtils.getPointsFromVertexes(profile.Vertexes)
             else:
                 obj.Points.clear()
@@ -46,7 +46,6 @@ except AttributeError:
 import openpyxl
 from openpyxl.styles import Alignment, Border, Side, PatternFill, GradientFill, Font
 import PVPlantResources
-import PVPlantSite
 
 # Estilos:
 thin = Side(border_style="thin", color="7DA4B8")
@@ -138,7 +137,8 @@ def spreadsheetBOQFrames(sheet, sel):
                     alignment=Alignment(horizontal="center", vertical="center"))
 
 def spreadsheetBOQPoles(sheet, sel):
-    import MeshPart as mp
+    import math
+    from Utils.terrainSampler import getSampler
     # Headers:
     sheet['A1'] = 'Frame'
     sheet['B1'] = 'Pole'
@@ -169,18 +169,22 @@ def spreadsheetBOQPoles(sheet, sel):
     sheet.row_dimensions[2].height = 5
 
     # Data:
-    terrain = PVPlantSite.get().Terrain.Mesh #Shape
-    terrain = FreeCAD.ActiveDocument.Mesh002.Mesh
+    # Terrain height under every pole in one query:
+    frame_poles = [Part.getShape(frame).SubShapes[1].SubShapes for frame in sel]
+    centers = [pole.BoundBox.Center for poles in frame_poles for pole in poles]
+    sampler = getSampler()
+    heights = sampler.heights(centers).tolist() if sampler else [float("nan")] * len(centers)
+    cnt = 0
+
     row = 3
     for frame_ind, frame in enumerate(sel):
-        poles = frame.Shape.SubShapes[1].SubShapes
+        poles = frame_poles[frame_ind]
         group_from = row
         #frame_line = Part.LineSegment(poles[0].BoundBox.Center, poles[-1].BoundBox.Center)
         #frame_line_projection = terrain.makeParallelProjection(frame_line.toShape(), FreeCAD.Vector(0,0,1))
 
         for pole_ind, pole in enumerate(poles):
             zattach = .0
-            center = pole.BoundBox.Center
 
             '''down = FreeCAD.Vector(center.x, center.y, terrain.BoundBox.ZMin)
             top = FreeCAD.Vector(center.x, center.y, terrain.BoundBox.ZMax)
@@ -192,11 +196,10 @@ def spreadsheetBOQPoles(sheet, sel):
                     zattach = result[0].Z
                     break'''
 
-            pp = mp.projectPointsOnMesh([center], terrain, FreeCAD.Vector(0, 0, 1))
-            if len(pp) == 0:
+            zattach = heights[cnt]
+            cnt += 1
+            if math.isnan(zattach):
                 zattach = -999
-            else:
-                zattach = pp[0].z
 
             sheet['B{0}'.format(row)] = pole_ind + 1
             sheet['C{0}'.format(row)] = pole.Placement.Base.x * scale
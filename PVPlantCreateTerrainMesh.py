@@ -47,49 +47,12 @@ class _TaskPanel:
             self.obj = sel[0]
             self.form.editCloud.setText(self.obj.Label)
 
-    def MaxLength(self, P1, P2, P3, MaxlengthLE):
-        """
-        Calculation of the 2D length between triangle edges
-        """
-
-        p1 = FreeCAD.Vector(P1[0], P1[1], 0)
-        p2 = FreeCAD.Vector(P2[0], P2[1], 0)
-        p3 = FreeCAD.Vector(P3[0], P3[1], 0)
-
-        List = [[p1, p2], [p2, p3], [p3, p1]]
-        for i, j in List:
-            vec = i.sub(j)
-            if vec.Length > MaxlengthLE:
-                return False
-
-        return True
-
-    def MaxAngle(self, P1, P2, P3, MaxAngleLE):
-        """
-        Calculation of the 2D angle between triangle edges
-        """
-
-        p1 = FreeCAD.Vector(P1[0], P1[1], 0)
-        p2 = FreeCAD.Vector(P2[0], P2[1], 0)
-        p3 = FreeCAD.Vector(P3[0], P3[1], 0)
-
-        List = [[p1, p2, p3], [p2, p3, p1], [p3, p1, p2]]
-        for j, k, l in List:
-            vec1 = j.sub(k)
-            vec2 = l.sub(k)
-            radian = vec1.getAngle(vec2)
-            if radian > MaxAngleLE:
-                return False
-
-        return True
-
     def accept(self):
         from datetime import datetime
         starttime = datetime.now()       
 
         import Part
         import numpy as np
-        from scipy.spatial import Delaunay
 
         bnd = FreeCAD.ActiveDocument.Site.Terrain.CuttingBoundary.Shape
         if len(bnd.Faces) == 0:
@@ -133,22 +96,11 @@ class _TaskPanel:
 
         # TODO: si es muy grande, dividir el cálculo de la maya en varias etapas
         # Create delaunay triangulation
-        tri = Delaunay(Data[:, :2])
+        MeshObject = Triangulate(Data, MaxlengthLE, MaxAngleLE)
         print("tiempo delaunay:", datetime.now() - starttime)
-
-        faces = tri.simplices
-        from stl import mesh
-        wireframe = mesh.Mesh(np.zeros(faces.shape[0], dtype=mesh.Mesh.dtype))
-        for i, f in enumerate(faces):
-            if self.MaxLength(Data[f[0]], Data[f[1]], Data[f[2]], MaxlengthLE) and \
-               self.MaxAngle(Data[f[0]], Data[f[1]], Data[f[2]], MaxAngleLE):
-                for j in range(3):
-                    wireframe.vectors[i][j] = Data[f[j], :]
-
-        import Mesh
-        MeshObject = Mesh.Mesh(wireframe.vectors.tolist())
+        if MeshObject is None:
+            return
         MeshObject.Placement.move(nbase)
-        MeshObject.harmonizeNormals()
         Surface = FreeCAD.ActiveDocument.addObject("Mesh::Feature", self.form.SurfaceNameLE.text())
         Surface.Mesh = MeshObject
         Surface.Label = self.form.SurfaceNameLE.text()
@@ -240,60 +192,187 @@ def projectShapeOnMesh(shape, mesh):
     res = [i for n, i in enumerate(pts) if i not in pts[:n]]
     return res
 
+def filterTriangles(Points, faces, MaxlengthLE=8000, MaxAngleLE=math.pi / 2):
+    """
+    Vectorized test of the 2D edge lengths and interior angles of all the triangles.
+    Returns a boolean array with the faces to keep. None disables a test.
+    """
+    import numpy as np
+
+    tri = Points[faces][:, :, :2]                       # (n, 3, 2)
+    edges = np.roll(tri, -1, axis=1) - tri              # p2-p1, p3-p2, p1-p3
+    lengths = np.linalg.norm(edges, axis=2)
+    keep = np.ones(len(faces), dtype=bool)
+    if MaxlengthLE:
+        keep &= (lengths <= MaxlengthLE).all(axis=1)
+    if MaxAngleLE:
+        # angle at each vertex between the outgoing edge and the reversed incoming edge
+        incoming = -np.roll(edges, 1, axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cos = (edges * incoming).sum(axis=2) / (lengths * np.roll(lengths, 1, axis=1))
+        keep &= (np.arccos(np.clip(cos, -1, 1)) <= MaxAngleLE).all(axis=1)
+    return keep
+
+
+def meshFromArrays(points, faces, compact=True):
+    """
+    Build a Mesh.Mesh from a shared (n, 3) vertex array and an (m, 3) face index array.
+    With "compact" unused vertexes are removed first, so each vertex is sent to the kernel only once.
+    """
+    import numpy as np
+    import Mesh
+
+    if compact:
+        used, faces = np.unique(faces, return_inverse=True)
+        faces = faces.reshape(-1, 3)
+        points = points[used]
+    vertexes = [FreeCAD.Vector(*p) for p in points.tolist()]
+    mesh = Mesh.Mesh()
+    mesh.addFacets((vertexes, [tuple(f) for f in faces.tolist()]))
+    return mesh
+
+
+def orientFacesUp(points, faces):
+    """ Swap the vertex order of the triangles whose xy winding is clockwise (normal pointing down) """
+    tri = points[faces][:, :, :2]
+    area = (tri[:, 1, 0] - tri[:, 0, 0]) * (tri[:, 2, 1] - tri[:, 0, 1]) - \
+           (tri[:, 2, 0] - tri[:, 0, 0]) * (tri[:, 1, 1] - tri[:, 0, 1])
+    flip = area < 0
+    faces[flip] = faces[flip][:, ::-1]
+    return faces
+
+
 def Triangulate(Points, MaxlengthLE = 8000, MaxAngleLE = math.pi / 2):
     import numpy as np
     from scipy.spatial import Delaunay
-    from stl import mesh as stlmesh
-    import Mesh
 
+    Points = np.asarray(Points, dtype=float)
     tri = Delaunay(Points[:, :2])
     faces = tri.simplices
-    wireframe = stlmesh.Mesh(np.zeros(faces.shape[0], dtype=stlmesh.Mesh.dtype))
+    faces = faces[filterTriangles(Points, faces, MaxlengthLE, MaxAngleLE)]
+    if len(faces) == 0:
+        return None
+    return meshFromArrays(Points, orientFacesUp(Points, faces))
+
+
+def GridFaces(valid, ids=None):
+    """
+    Faces of a structured grid: two triangles per cell from index arithmetic, no Delaunay.
+    valid: (ny, nx) boolean array of the nodes that can be used (inside boundary and not nodata).
+    ids: (ny, nx) vertex number of every node. By default the valid nodes are numbered row by row.
+    A triangle is kept only if its three nodes are valid.
+    """
+    import numpy as np
+
+    if ids is None:
+        ids = np.cumsum(valid.ravel(), dtype=np.int64).reshape(valid.shape) - 1
+    ny, nx = valid.shape
+
+    def corner(array, dr, dc):
+        # value of the (r + dr, c + dc) node for every cell (r, c)
+        return array[dr:ny - 1 + dr, dc:nx - 1 + dc]
 
-    for i, f in enumerate(faces):
-        if MaxLength(Points[f[0]], Points[f[1]], Points[f[2]], MaxlengthLE) and \
-           MaxAngle(Points[f[0]], Points[f[1]], Points[f[2]], MaxAngleLE):
-            for j in range(3):
-                wireframe.vectors[i][j] = Points[f[j], :]
+    faces = []
+    for triangle in (((0, 0), (1, 0), (1, 1)), ((0, 0), (1, 1), (0, 1))):
+        ok = corner(valid, *triangle[0]) & corner(valid, *triangle[1]) & corner(valid, *triangle[2])
+        faces.append(np.column_stack([corner(ids, *node)[ok] for node in triangle]))
+    return np.vstack(faces)
+
+
+def _gridMesh(x, y, z, valid, faces):
+    """ Build the mesh of the valid nodes of a grid from the faces given by GridFaces """
+    import numpy as np
+
+    # (r, c), (r+1, c), (r+1, c+1) is counterclockwise when x grows and y decreases along the rows:
+    if (x[-1] - x[0]) * (y[-1] - y[0]) > 0:
+        faces = faces[:, ::-1]
+
+    xx, yy = np.meshgrid(x, y)
+    points = np.column_stack((xx[valid], yy[valid], z[valid]))
+    del xx, yy
+    return meshFromArrays(points, faces, compact=False)
+
+
+def GridToMesh(x, y, z, mask=None):
+    """
+    Mesh a regular grid (DEM) in linear time.
+    x: (nx,) columns, y: (ny,) rows, z: (ny, nx) heights with NaN for nodata.
+    mask: optional (ny, nx) boolean array, False for the nodes outside the boundary.
+    Returns a Mesh.Mesh or None if there are no valid cells.
+    """
+    import numpy as np
 
-    MeshObject = Mesh.Mesh(wireframe.vectors.tolist())
-    if len(MeshObject.Facets) == 0:
+    valid = ~np.isnan(z)
+    if mask is not None:
+        valid &= mask
+    faces = GridFaces(valid)
+    if len(faces) == 0:
         return None
-    MeshObject.harmonizeNormals()
-    if MeshObject.Facets[0].Normal.z < 0:
-        MeshObject.flipNormals()
-    return MeshObject
+    return _gridMesh(x, y, z, valid, faces)
+
 
-def MaxLength(P1, P2, P3, MaxlengthLE):
+def _gridTile(x, y, z, valid, ids, r0, r1, flip):
     """
-    Calculation of the 2D length between triangle edges
+    Vertex and face arrays of one band of a grid: the (n, 3) coordinates of the valid nodes of
+    the rows r0 .. r1 - 1 (the rows owned by the band) and the (m, 3) faces of the cells between
+    the rows r0 .. r1 (inclusive), in global vertex numbers. Only NumPy work, no Python objects.
     """
-    p1 = FreeCAD.Vector(P1[0], P1[1], 0)
-    p2 = FreeCAD.Vector(P2[0], P2[1], 0)
-    p3 = FreeCAD.Vector(P3[0], P3[1], 0)
-
-    List = [[p1, p2], [p2, p3], [p3, p1]]
-    for i, j in List:
-        vec = i.sub(j)
-        if vec.Length > MaxlengthLE:
-            return False
-    return True
-
-def MaxAngle(P1, P2, P3, MaxAngleLE):
+    import numpy as np
+
+    band = valid[r0:r1]
+    rows, cols = np.nonzero(band)
+    points = np.column_stack((x[cols], y[r0 + rows], z[r0:r1][band]))
+
+    faces = GridFaces(valid[r0:r1 + 1], ids[r0:r1 + 1])
+    if flip:
+        faces = faces[:, ::-1]
+    return points, faces
+
+
+def TiledGridToMesh(x, y, z, mask=None, tile_rows=256, workers=None):
     """
-    Calculation of the 2D angle between triangle edges
+    Banded version of GridToMesh for large DEMs.
+    The grid is split in bands of "tile_rows" node rows. Every band computes on a thread pool the
+    NumPy arrays of its own vertexes and of the faces of the cells down to the first row of the
+    next band, with the global node numbering, so the bands are welded without any search.
+    NumPy releases the GIL in this work. The arrays are joined in band order and the Mesh is built
+    once (meshFromArrays); that last step creates the Python objects and runs on one core.
     """
-    p1 = FreeCAD.Vector(P1[0], P1[1], 0)
-    p2 = FreeCAD.Vector(P2[0], P2[1], 0)
-    p3 = FreeCAD.Vector(P3[0], P3[1], 0)
-    List = [[p1, p2, p3], [p2, p3, p1], [p3, p1, p2]]
-    for j, k, l in List:
-        vec1 = j.sub(k)
-        vec2 = l.sub(k)
-        radian = vec1.getAngle(vec2)
-        if radian > MaxAngleLE:
-            return False
-    return True
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    valid = ~np.isnan(z)
+    if mask is not None:
+        valid &= mask
+    ids = np.cumsum(valid.ravel(), dtype=np.int64).reshape(valid.shape) - 1
+    # (r, c), (r+1, c), (r+1, c+1) is counterclockwise when x grows and y decreases along the rows:
+    flip = (x[-1] - x[0]) * (y[-1] - y[0]) > 0
+
+    ny = valid.shape[0]
+    starts = list(range(0, ny, tile_rows))
+    if workers is None:
+        workers = max((os.cpu_count() or 2) - 1, 1)
+
+    progress = FreeCAD.Base.ProgressIndicator()
+    progress.start("Meshing terrain...", len(starts))
+    tiles = [None] * len(starts)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            jobs = {pool.submit(_gridTile, x, y, z, valid, ids, r0, min(r0 + tile_rows, ny), flip): i
+                    for i, r0 in enumerate(starts)}
+            for job in as_completed(jobs):
+                tiles[jobs[job]] = job.result()
+                progress.next()
+    finally:
+        progress.stop()
+
+    points = np.vstack([tile[0] for tile in tiles])
+    faces = np.vstack([tile[1] for tile in tiles])
+    del tiles
+    if len(faces) == 0:
+        return None
+    return meshFromArrays(points, faces, compact=False)
+
 
 def Open3DTriangle(point_cloud):
     import numpy as np
@@ -148,7 +148,8 @@ def calculateEarthWorks2D(trackerPath, Terrain, offsetup=200, offsetdown=200):
     # TODO: hacer genérico terrainProfile no points3D
     points3D = list()
     if Terrain.isDerivedFrom("Part::Feature"):
-        tmp_pts = Terrain.Shape.makeParallelProjection(trackerPath.Shape.Wires[0], FreeCAD.Vector(0, 0, 1))
+        import PVPlantTerrain
+        tmp_pts = PVPlantTerrain.getShape(Terrain).makeParallelProjection(trackerPath.Shape.Wires[0], FreeCAD.Vector(0, 0, 1))
         points3D = VertexesToPoints(tmp_pts.Vertexes)
     elif Terrain.isDerivedFrom("Mesh::Feature"):
         import MeshPart as mp
@@ -199,58 +200,13 @@ def calculateEarthWorks2D(trackerPath, Terrain, offsetup=200, offsetdown=200):
 
 
 def makeMesh(Points, MaxlengthLE=10000):
-    def MaxLength(P1, P2, P3, MaxlengthLE):
-
-        new = False
-        if new:
-            tri = [[P1, P2], [P2, P3], [P3, P1]]
-            for i, j in tri:
-                vec = i.sub(j)
-
-                # Compare with input
-                if vec.Length > MaxlengthLE:
-                    return False
-            return True
-        else:
-            p1 = FreeCAD.Vector(P1[0], P1[1], 0)
-            p2 = FreeCAD.Vector(P2[0], P2[1], 0)
-            p3 = FreeCAD.Vector(P3[0], P3[1], 0)
-
-            # Calculate length between triangle vertices
-            List = [[p1, p2], [p2, p3], [p3, p1]]
-            for i, j in List:
-                vec = i.sub(j)
-
-                # Compare with input
-                if vec.Length > MaxlengthLE:
-                    return False
-            return True
-
     import numpy as np
-    from scipy.spatial import Delaunay
-
-    Data = np.array(Points)
-    tri = Delaunay(Data)
-
-    MeshList = []
-    for i in tri.vertices:
-        first = int(i[0])
-        second = int(i[1])
-        third = int(i[2])
-
-        # Test triangle
-        if MaxlengthLE == 0:
-            MeshList.append(Data[first])
-            MeshList.append(Data[second])
-            MeshList.append(Data[third])
-        elif MaxLength(Data[first], Data[second], Data[third], MaxlengthLE):  # \
-            # and self.MaxAngle(Data[first], Data[second], Data[third]):
-            MeshList.append(Data[first])
-            MeshList.append(Data[second])
-            MeshList.append(Data[third])
-
-    import Mesh
-    MeshObject = Mesh.Mesh(MeshList)
+    import PVPlantCreateTerrainMesh
+
+    # MaxlengthLE == 0: no filter
+    MeshObject = PVPlantCreateTerrainMesh.Triangulate(np.array(Points), MaxlengthLE, None)
+    if MeshObject is None:
+        return None
 
     #MeshObject.Placement.move(nbase)
     Surface = FreeCAD.ActiveDocument.addObject("Mesh::Feature")
@@ -283,7 +239,8 @@ class _EarthWorksTaskPanel:
             if PVPlantSite.get().Terrain.TypeId == 'Mesh::Feature':
                 terrain = PVPlantSite.get().Terrain.Mesh
             else:
-                terrain = PVPlantSite.get().Terrain.Shape
+                import PVPlantTerrain
+                terrain = PVPlantTerrain.getShape(PVPlantSite.get().Terrain)
                 type = 1
 
         sel = FreeCADGui.Selection.getSelection()
@@ -55,8 +55,9 @@ from PVPlantResources import DirIcons as DirIcons
 EAST = FreeCAD.Vector(1, 0, 0)
 
 def makeprojection(pathwire):
+    import PVPlantTerrain
     site = FreeCAD.ActiveDocument.Site
-    land = site.Terrain.Shape
+    land = PVPlantTerrain.getShape(site.Terrain)
     proj = land.makeParallelProjection(pathwire, FreeCAD.Vector(0, 0, 1))
     return proj
 
@@ -389,25 +390,17 @@ class _Fence(ArchComponent.Component):
 
         self.Posts = []
         self.Foundations = []
-        site = PVPlantSite.get()
-        if True:  # prueba
-            import MeshPart as mp
-            land = FreeCAD.ActiveDocument.Mesh002.Mesh
-            segments = mp.projectShapeOnMesh(pathwire, land, FreeCAD.Vector(0, 0, 1))
-            points=[]
-            for segment in segments:
-                points.extend(segment)
-            print(len(points),"\n",points)
-            pathwire = Part.makePolygon(points)
-        else:
-            if PVPlantSite.get().Terrain.TypeId == 'Mesh::Feature':
-                import MeshPart as mp
-                land = PVPlantSite.get().Terrain.Mesh
-                pathwire = mp.projectShapeOnMesh(pathwire, land, FreeCAD.Vector(0, 0, 1))
-
-            else:
-                land = site.Terrain.Shape
-                pathwire = land.makeParallelProjection(pathwire, FreeCAD.Vector(0, 0, 1))
+        # Drape the path on the terrain (batched height queries every meter):
+        from Utils.terrainSampler import getSampler
+        sampler = getSampler()
+        if sampler is None:
+            return
+        points = []
+        for section in sampler.drapeShape(pathwire, 1000):
+            points.extend(section)
+        if len(points) < 2:
+            return
+        pathwire = Part.makePolygon(points)
 
         if pathwire is None:
             return
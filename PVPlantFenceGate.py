@@ -170,8 +170,9 @@ class _FenceGate(ArchComponent.Component):
 
         self.Posts = []
         self.Foundations = []
+        import PVPlantTerrain
         site = PVPlantSite.get()
-        land = site.Terrain.Shape
+        land = PVPlantTerrain.getShape(site.Terrain)
 
         land_coppy = land.copy()
         land_coppy.Placement.Base -= site.Origin
@@ -21,7 +21,7 @@
 # ***********************************************************************
 
 import FreeCAD
-import utm
+from Utils import geoProjection
 
 if FreeCAD.GuiUp:
     import FreeCADGui
@@ -188,7 +188,7 @@ class MapWindow(QtGui.QWidget):
     def onMapMove(self, lat, lng):
         self.lat = lat
         self.lon = lng
-        x, y, zone_number, zone_letter = utm.from_latlon(lat, lng)
+        x, y, zone_number, zone_letter = geoProjection.fromLatLon(lat, lng)
         self.labelCoordinates.setText('Longitud: {:.5f}, Latitud: {:.5f}'.format(lng, lat) +
                                       '  |  UTM: ' + str(zone_number) + zone_letter +
                                       ', {:.5f}m E, {:.5f}m N'.format(x, y))
@@ -228,9 +228,8 @@ class MapWindow(QtGui.QWidget):
             # 2. if the feature is a Polygon:
             if item['geometry']['type'] == "Polygon":
                 count_polygons += 1
-                pts = []
-                for cords in item['geometry']['coordinates'][0]:
-                    pts.append(ImportElevation.getSinglePointElevationFromBing(cords[1], cords[0]))
+                cords = item['geometry']['coordinates'][0]
+                pts = ImportElevation.getPointsElevationFromBing([c[1] for c in cords], [c[0] for c in cords])
 
                 # Draw polygons/boundary:
                 Wire = Draft.makeWire(pts, closed=True, face=False)
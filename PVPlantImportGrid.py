@@ -61,83 +61,35 @@ def get_elevation(lat=None, long=None):
     return elevation
 
 def getSinglePointElevationFromBing(lat, lng):
-    #http://dev.virtualearth.net/REST/v1/Elevation/List?points={lat1,long1,lat2,long2,latN,longnN}&heights={heights}&key={BingMapsAPIKey}
-    source = "http://dev.virtualearth.net/REST/v1/Elevation/List?points="
-    source += str(lat) + "," + str(lng)
-    source += "&heights=sealevel"
-    source += "&key=AmsPZA-zRt2iuIdQgvXZIxme2gWcgLaz7igOUy7VPB8OKjjEd373eCnj1KFv2CqX"
-
-    import requests
-    response = requests.get(source)
-    ans = response.text
-
-    # +# to do: error handling  - wait and try again
-    s = json.loads(ans)
-    res = s['resourceSets'][0]['resources'][0]['elevations']
-    
-    import utm
-    for elevation in res:
-        c = utm.from_latlon(lat, lng)
-        v = FreeCAD.Vector(
-            round(c[0] * 1000, 4),
-            round(c[1] * 1000, 4),
-            round(elevation * 1000, 4))
-        return v
-
-def getGridElevationFromBing(polygon, lat, lng, resolution = 1000):
-    #http://dev.virtualearth.net/REST/v1/Elevation/Polyline?points=35.89431,-110.72522,35.89393,-110.72578,35.89374,-110.72606,35.89337,-110.72662
-    # &heights=ellipsoid&samples=10&key={BingMapsAPIKey}
-    import utm
-    import math
-    import requests
-    import requests
-
+    ''' UTM coordinates and elevation (mm) of a point '''
+    return getPointsElevationFromBing([lat], [lng])[0]
+
+def getPointsElevationFromBing(lat, lng, fetcher = None):
+    ''' UTM coordinates and elevation (mm) of a list of points, in batches of Bing requests '''
+    from Utils import geoProjection
+    from Utils.elevationFetcher import ElevationFetcher
+
+    if fetcher is None:
+        fetcher = ElevationFetcher()
+    elevations = fetcher.fetchPoints(lat, lng)
+    easting, northing, zone_number, zone_letter = geoProjection.fromLatLon(lat, lng)
+    return [FreeCAD.Vector(round(x * 1000, 4), round(y * 1000, 4), round(z * 1000, 4))
+            for x, y, z in zip(easting.tolist(), northing.tolist(), elevations.tolist())]
+
+def getGridElevationFromBing(polygon, lat, lng, resolution = 1000, offset = None, fetcher = None):
+    '''
+    Elevation grid over the boundbox of "polygon" (x, y, z in mm, see ElevationFetcher.fetchGrid).
+    "offset" is the Site.Origin of the polygon coordinates.
+    '''
+    from Utils import geoProjection
+    from Utils.elevationFetcher import ElevationFetcher
 
-    geo = utm.from_latlon(lat, lng)
+    geo = geoProjection.fromLatLon(lat, lng)
     # result = (679434.3578335291, 4294023.585627955, 30, 'S')
     # EASTING, NORTHING, ZONE NUMBER, ZONE LETTER
-
-    #StepsXX = int((polygon.Shape.BoundBox.XMax - polygon.Shape.BoundBox.XMin) / (resolution*1000))
-    points = []
-    yy = polygon.Shape.BoundBox.YMax
-    while yy > polygon.Shape.BoundBox.YMin:
-        xx = polygon.Shape.BoundBox.XMin
-        while xx < polygon.Shape.BoundBox.XMax:
-            StepsXX = int(math.ceil((polygon.Shape.BoundBox.XMax - xx) / resolution))
-
-            if StepsXX > 1000:
-                StepsXX = 1000
-                xx1 = xx + 1000 * resolution
-            else:
-                xx1 = xx + StepsXX * resolution
-
-            point1 = utm.to_latlon(xx / 1000, yy / 1000, geo[2], geo[3])
-            point2 = utm.to_latlon(xx1 / 1000, yy / 1000, geo[2], geo[3])
-
-            source = "http://dev.virtualearth.net/REST/v1/Elevation/Polyline?points="
-            source += "{lat1},{lng1}".format(lat1=point1[0], lng1=point1[1])
-            source += ","
-            source += "{lat2},{lng2}".format(lat2=point2[0], lng2=point2[1])
-            source += "&heights=sealevel"
-            source += "&samples={steps}".format(steps=StepsXX)
-            source += "&key=AmsPZA-zRt2iuIdQgvXZIxme2gWcgLaz7igOUy7VPB8OKjjEd373eCnj1KFv2CqX"
-
-            response = requests.get(source)
-            ans = response.text
-
-            # +# to do: error handling  - wait and try again
-            s = json.loads(ans)
-            res = s['resourceSets'][0]['resources'][0]['elevations']
-
-            i = 0
-            for elevation in res:
-                v = FreeCAD.Vector(xx + resolution * i, yy, round(elevation * 1000, 4))
-                points.append(v)
-                i += 1
-            xx = xx1 + resolution # para no repetir un mismo punto
-        yy -= resolution
-
-    return points
+    if fetcher is None:
+        fetcher = ElevationFetcher()
+    return fetcher.fetchGrid(polygon.Shape.BoundBox, resolution, geo[2], geo[3], offset)
 
 def getSinglePointElevation(lat, lon):
     source = "https://maps.googleapis.com/maps/api/elevation/json?locations="
@@ -233,12 +185,12 @@ def getSinglePointElevationUtm(lat, lon):
     res = s['results']
     print (res)
 
-    import utm
+    from Utils import geoProjection
     for r in res:
-        c = utm.from_latlon(r['location']['lat'], r['location']['lng'])
+        c = geoProjection.fromLatLon(r['location']['lat'], r['location']['lng'])
         v = FreeCAD.Vector(
-            round(c[0] * 1000, 4),
-            round(c[1] * 1000, 4),
+            round(float(c[0]) * 1000, 4),
+            round(float(c[1]) * 1000, 4),
             round(r['elevation'] * 1000, 2))
         print (v)
         return v
@@ -246,8 +198,8 @@ def getSinglePointElevationUtm(lat, lon):
 
 def getElevationUTM(polygon, lat, lng, resolution = 10000):
 
-    import utm
-    geo = utm.from_latlon(lat, lng)
+    from Utils import geoProjection
+    geo = geoProjection.fromLatLon(lat, lng)
     # result = (679434.3578335291, 4294023.585627955, 30, 'S')
     # EASTING, NORTHING, ZONE NUMBER, ZONE LETTER
 
@@ -257,8 +209,10 @@ def getElevationUTM(polygon, lat, lng, resolution = 10000):
     while yy > polygon.Shape.BoundBox.YMin:
         # utm.to_latlon(EASTING, NORTHING, ZONE NUMBER, ZONE LETTER).
         # result = (LATITUDE, LONGITUDE)
-        point1 = utm.to_latlon(polygon.Shape.BoundBox.XMin / 1000, yy / 1000, geo[2], geo[3])
-        point2 = utm.to_latlon(polygon.Shape.BoundBox.XMax / 1000, yy / 1000, geo[2], geo[3])
+        lats, lngs = geoProjection.toLatLon([polygon.Shape.BoundBox.XMin / 1000, polygon.Shape.BoundBox.XMax / 1000],
+                                            [yy / 1000, yy / 1000], geo[2], geo[3])
+        point1 = (lats[0], lngs[0])
+        point2 = (lats[1], lngs[1])
 
         source = "https://maps.googleapis.com/maps/api/elevation/json?path="
         source += "{a},{b}".format(a = point1[0], b = point1[1])
@@ -276,14 +230,11 @@ def getElevationUTM(polygon, lat, lng, resolution = 10000):
         res = s['results']
 
 
-        for r in res:
-            c = utm.from_latlon(r['location']['lat'], r['location']['lng'])
-            v = FreeCAD.Vector(
-                round(c[0] * 1000, 2),
-                round(c[1] * 1000, 2),
-                round(r['elevation'] * 1000, 2)
-            )
-            points.append(v)
+        if len(res) > 0:
+            easting, northing = geoProjection.getZone(geo[2], lat >= 0).fromLatLon(
+                [r['location']['lat'] for r in res], [r['location']['lng'] for r in res])
+            for x, y, r in zip(easting.tolist(), northing.tolist(), res):
+                points.append(FreeCAD.Vector(round(x * 1000, 2), round(y * 1000, 2), round(r['elevation'] * 1000, 2)))
         yy -= (resolution*1000)
 
     FreeCAD.activeDocument().recompute()
@@ -409,6 +360,13 @@ def getElevation(lat, lon, b=50.35, le=11.17, size=40):
     return FreeCAD.activeDocument().ActiveObject
 '''
 
+def addGridPoints(kernel, x, y, z, chunk=1000000):
+    ''' Add the valid nodes of a grid to a points kernel in blocks of contiguous arrays '''
+    import Utils.importDEM as openDEM
+    for block in openDEM.gridPoints(x, y, z, chunk):
+        kernel.addPoints(list(map(tuple, block.tolist())))
+
+
 class _ImportPointsTaskPanel:
 
     def __init__(self, obj = None):
@@ -467,7 +425,7 @@ class _ImportPointsTaskPanel:
             self.form2.editBoundary.setText(self.Boundary.Label)
 
     def openFileDEM(self):
-        filters = "Esri ASC (*.asc);;CSV (*.csv);;All files (*.*)"
+        filters = "Esri ASC (*.asc);;CSV (*.csv);;XYZ (*.xyz);;All files (*.*)"
         filename = QtGui.QFileDialog.getOpenFileName(None,
                                                     "Open DEM,",
                                                     "",
@@ -479,9 +437,11 @@ class _ImportPointsTaskPanel:
         if radiobox is self.form1.radio1:
             self.select = 0
             self.form1.gbLocalFile.setVisible(True)
+            self.form1.gbThinning.setVisible(False)
         elif radiobox is self.form1.radio2:
             self.select = 1
             self.form1.gbLocalFile.setVisible(True)
+            self.form1.gbThinning.setVisible(True)
 
     def accept(self):
         from datetime import datetime
@@ -505,8 +465,8 @@ class _ImportPointsTaskPanel:
                 #if self.groupbox.isChecked:break
             resol = FreeCAD.Units.Quantity(self.valueResolution.text()).Value
             Site = FreeCAD.ActiveDocument.Site
-            pts = getGridElevationFromBing(self.obj, Site.Latitude, Site.Longitude, resol)
-            PointObject.addPoints(pts)
+            x, y, z = getGridElevationFromBing(self.obj, Site.Latitude, Site.Longitude, resol, Site.Origin)
+            addGridPoints(PointObject, x, y, z)
             PointGroup.Points = PointObject
 
         else:
@@ -515,64 +475,19 @@ class _ImportPointsTaskPanel:
 
             import Utils.importDEM as openDEM
             if self.select == 1: # DEM.
-                import numpy as np
                 root, extension = os.path.splitext(self.filename)
                 if extension.lower() == ".asc":
-                    x, y, datavals, cellsize, nodata_value = openDEM.openEsri(self.filename)
-
+                    boundbox = None
                     if self.Boundary:
-                        inc_x = self.Boundary.Shape.BoundBox.XLength * 0.05
-                        inc_y = self.Boundary.Shape.BoundBox.YLength * 0.05
-
-                        min_x = 0
-                        max_x = 0
-
-                        comp = (self.Boundary.Shape.BoundBox.XMin - inc_x) / 1000
-                        for i in range(nx):
-                            if x[i] > comp:
-                                min_x = i - 1
-                                break
-                        comp = (self.Boundary.Shape.BoundBox.XMax + inc_x) / 1000
-                        for i in range(min_x, nx):
-                            if x[i] > comp:
-                                max_x = i
-                                break
-
-                        min_y = 0
-                        max_y = 0
-
-                        comp = (self.Boundary.Shape.BoundBox.YMax + inc_y) / 1000
-                        for i in range(ny):
-                            if y[i] < comp:
-                                max_y = i
-                                break
-                        comp = (self.Boundary.Shape.BoundBox.YMin - inc_y) / 1000
-                        for i in range(max_y, ny):
-                            if y[i] < comp:
-                                min_y = i
-                                break
-
-                        x = x[min_x:max_x]
-                        y = y[max_y:min_y]
-                        datavals = datavals[max_y:min_y, min_x:max_x]
+                        boundbox = FreeCAD.BoundBox(self.Boundary.Shape.BoundBox)
+                        boundbox.enlarge(max(boundbox.XLength, boundbox.YLength) * 0.05)
+                    # absolute (UTM) coordinates, as the points of this importer always were:
+                    x, y, datavals, cellsize, nodata_value = openDEM.openEsri(self.filename, boundbox)
 
                     pts = []
-                    if True: # faster but more memory 46s - 4,25 gb
-                        x, y = np.meshgrid(x, y)
-                        xx = x.flatten()
-                        yy = y.flatten()
-                        zz = datavals.flatten()
-                        x[:] = 0
-                        y[:] = 0
-                        datavals[:] = 0
-
-                        pts = []
-                        for i in range(0, len(xx)):
-                            pts.append(FreeCAD.Vector(xx[i], yy[i], zz[i]) * 1000)
-
-                        xx[:] = 0
-                        yy[:] = 0
-                        zz[:] = 0
+                    if True:
+                        addGridPoints(PointObject, x, y, datavals)
+                        del x, y, datavals
 
                     else:   # 51s 3,2 gb
                         createmesh = True
@@ -583,8 +498,8 @@ class _ImportPointsTaskPanel:
                             for j in range(len(y)):
                                 edges = []
                                 for i in range(0, len(x) - 1):
-                                    ed = Part.makeLine(FreeCAD.Vector(x[i], y[j], datavals[j][i]) * 1000,
-                                                       FreeCAD.Vector(x[i + 1], y[j], datavals[j][i + 1]) * 1000)
+                                    ed = Part.makeLine(FreeCAD.Vector(x[i], y[j], datavals[j][i]),
+                                                       FreeCAD.Vector(x[i + 1], y[j], datavals[j][i + 1]))
                                     edges.append(ed)
 
                                 #bspline = Draft.makeBSpline(pts)
@@ -603,12 +518,26 @@ class _ImportPointsTaskPanel:
 
                         else:
                             pts = []
-                            for j in range(ny):
-                                for i in range(nx):
-                                    pts.append(FreeCAD.Vector(x[i], y[j], datavals[j][i]) * 1000)
-
-                elif extension.lower() == ".csv" or extension.lower() == ".txt":  # x, y, z from gps
-                    pts = openDEM.interpolatePoints(openDEM.openCSV(self.filename))
+                            for j in range(len(y)):
+                                for i in range(len(x)):
+                                    pts.append(FreeCAD.Vector(x[i], y[j], datavals[j][i]))
+
+                elif extension.lower() in (".csv", ".txt", ".xyz"):  # x, y, z from gps, drone or LiDAR
+                    # optional thinning of dense clouds (LiDAR): none, voxel centroid or lowest point
+                    thinning = (None, "voxel", "minz")[self.form1.comboThinning.currentIndex()]
+                    cellsize = self.form1.editThinningSize.value()
+                    if extension.lower() == ".xyz":
+                        survey = openDEM.readXYZ(self.filename, thinning=thinning, cellsize=cellsize)
+                    else:
+                        survey = openDEM.readXYZ(self.filename, columns=(1, 2, 3), delimiter=",",
+                                                 thinning=thinning, cellsize=cellsize)
+                    x, y, z = openDEM.interpolatePoints(survey)
+                    x -= site.Origin.x
+                    y -= site.Origin.y
+                    if self.Boundary:
+                        x, y, z = openDEM.cropGrid(x, y, z, self.Boundary.Shape.BoundBox)
+                    addGridPoints(PointObject, x, y, z)
+                    pts = []
 
         PointObject.addPoints(pts)
         PointGroup.Points = PointObject
@@ -280,7 +280,9 @@ class _Pad(ArchComponent.Component):
         # 1. Terraplén (embankment / fill):
         fill = None
         fillcommon = None
-        if land.Shape.BoundBox.ZMin < pb.z:
+        import PVPlantTerrain
+        bb = PVPlantTerrain.getShape(land).BoundBox
+        if bb.ZMin < pb.z:
             print("- PAD: Calcalete fill solid:")
             fill = self.createSolid(obj, pad, land, -1)
             fill.Placement.Base += pb
@@ -293,7 +295,7 @@ class _Pad(ArchComponent.Component):
         # 2. Desmonte (cut):
         cut = None
         cutcommon = None
-        if land.Shape.BoundBox.ZMax > pb.z:
+        if bb.ZMax > pb.z:
             print("- PAD: Calcalete cut solid:")
             cut = self.createSolid(obj, pad, land, 1)
             cut.Placement.Base += pb
@@ -336,14 +338,16 @@ class _Pad(ArchComponent.Component):
         print(" -- Tiempo tardado:", total_time)
 
     def createSolid(self, obj, base, land, dir = -1):
+        import PVPlantTerrain
+        bb = PVPlantTerrain.getShape(land).BoundBox
         zz = .0
         angle = .0
         height = .0
         if dir == -1:
-            zz = land.Shape.BoundBox.ZMin
+            zz = bb.ZMin
             angle = obj.FillSlope.Value
         else:
-            zz = land.Shape.BoundBox.ZMax
+            zz = bb.ZMax
             angle = obj.CutSlope.Value
         height = abs(zz - obj.Placement.Base.z)
 
@@ -43,7 +43,7 @@ else:
 
 try:
     _fromUtf8 = QtCore.QString.fromUtf8
-except AttributeError:
+except (AttributeError, NameError):
     def _fromUtf8(s):
         return s
 
@@ -51,6 +51,8 @@ import PVPlantResources
 import Utils.PVPlantTrace as PVPlantTrace
 from PVPlantResources import DirIcons as DirIcons
 import PVPlantSite
+from Utils import PVPlantUtils
+from Utils import polygonKernel
 
 
 def makePlacement():
@@ -249,6 +251,311 @@ class _ViewProviderPlacement:
         return None
 
 
+class PlacementEngine:
+    '''
+    Placement of frames in a PV area, without GUI (it can run in FreeCADCmd).
+    - area: Part.Shape of the PV area. prohibited: list of Part.Shape to cut from it.
+    - length, width: size of the frame (Rack.Shape.BoundBox.XLength, YLength). The frames are turned
+      90º: the length goes north to south.
+    - gap_col: distance between columns. gap_row: distance between frames of a column.
+    - offsetX, offsetY: offset of the array from the reference edges.
+    - refh, refv: reference edges of the rows and the columns (the first edge of the area if None).
+    - corridor_count, corridor_width: a vertical corridor "corridor_width" wide every
+      "corridor_count" columns (0: no corridors).
+    - workers: number of processes for the aligned array of big plants (see alignedSlots).
+    - azimuth: rotation (degrees, counterclockwise) of the columns from north-south. The area is
+      turned around its centre and the frames are turned back.
+    All the distances in mm. run() returns the list of FreeCAD.Placement of the frames and
+    optimize() looks for the offsets (and azimuth) that fit more frames.
+    '''
+
+    def __init__(self, area, prohibited=None, length=0, width=0, gap_col=0, gap_row=0, offsetX=0, offsetY=0,
+                 refh=None, refv=None, corridor_count=0, corridor_width=0, workers=1, azimuth=0):
+        if isinstance(area, (list, tuple)):
+            area = Part.makeCompound(list(area))
+        self.PVArea = area
+        self.Prohibited = list(prohibited) if prohibited else []
+        self.length = length
+        self.width = width
+        self.gap_col = gap_col
+        self.gap_row = gap_row
+        self.offsetX = offsetX
+        self.offsetY = offsetY
+        self.refh = refh
+        self.refv = refv
+        self.corridor_count = corridor_count
+        self.corridor_width = corridor_width
+        self.workers = workers
+        self.azimuth = azimuth
+        self.Center = area.BoundBox.Center
+        self.Dir = FreeCAD.Vector(0, -1, 0)  # Norte a sur
+        self.Area = None
+        self.Polygons = None
+
+    def calculateWorkingArea(self):
+        self.Area = self.PVArea
+        if len(self.Prohibited) > 0:
+            self.Area = self.Area.cut(self.Prohibited)
+        self.Dir = self.getRotation().multVec(FreeCAD.Vector(0, -1, 0))  # Norte a sur
+        if self.azimuth:
+            self.Area = self.Area.copy()
+            self.Area.rotate(self.Center, FreeCAD.Vector(0, 0, 1), -self.azimuth)
+        # one list of rings per face: every area is a separate task of the placement. The faces that
+        # touch are fused first, otherwise a frame over their common edge would be rejected.
+        faces = self.Area.Faces if len(self.Area.Faces) > 0 else [self.Area]
+        if len(faces) > 1:
+            faces = faces[0].multiFuse(faces[1:]).removeSplitter().Faces
+        self.Polygons = [PVPlantUtils.getPolygonsFromShape(face) for face in faces]
+
+    def getRotation(self):
+        return FreeCAD.Rotation(FreeCAD.Vector(0, 0, 1), self.azimuth)
+
+    def getFrameRotation(self):
+        ''' Rotation of a frame on flat ground: its length along self.Dir (azimuth included), as in adjustToTerrain '''
+        return FreeCAD.Rotation(FreeCAD.Vector(-1, 0, 0), self.Dir.negative())
+
+    def getReferences(self):
+        refh, refv = self.refh, self.refv
+        if self.azimuth:
+            refs = []
+            for ref in (refh, refv):
+                if ref is not None:
+                    ref = ref.copy()
+                    ref.rotate(self.Center, FreeCAD.Vector(0, 0, 1), -self.azimuth)
+                refs.append(ref)
+            refh, refv = refs
+        if refh is None:
+            refh = self.Area.Edges[0]
+        if refv is None:
+            refv = refh
+        return refh, refv
+
+    def getAligments(self):
+        refh, refv = self.getReferences()
+        steps = int((refv.BoundBox.XMax - self.Area.BoundBox.XMin + self.offsetX) / self.gap_col)
+        startx = refv.BoundBox.XMax + self.offsetX - self.gap_col * steps
+        steps = int((refh.BoundBox.YMin - self.Area.BoundBox.YMax + self.offsetY) / self.gap_row)
+        starty = refh.BoundBox.YMin + self.offsetY + self.gap_row * steps
+
+        return np.arange(startx, self.Area.BoundBox.XMax, self.gap_col), \
+               np.arange(starty, self.Area.BoundBox.YMin, -self.gap_row)
+
+    def getCorridors(self, count):
+        ''' Offset of each one of "count" columns due to the vertical corridors '''
+        if self.corridor_count <= 0:
+            return np.zeros(count)
+        valcols = self.corridor_width - (self.gap_col - self.width)
+        return np.arange(count) // self.corridor_count * valcols
+
+    def adjustToTerrain(self, coordinates, width):
+        '''
+        coordinates: list of columns; each column a list with the frame centres (FreeCAD.Vector) or
+        0 for the empty slots.
+        Frames closer than "dist" are grouped; the ends of each frame are the mid points between
+        neighbours, and all these points get their height from the terrain sampler in one call.
+        '''
+        from Utils.terrainSampler import getSampler
+
+        placements = list()
+        dist = (self.gap_row - max(self.length, self.width)) * 1.50
+        vec1 = FreeCAD.Vector(self.Dir)
+        vec1.Length = (width / 2)
+
+        sampler = getSampler()
+        if sampler is None:
+            rot = self.getFrameRotation()
+            return [FreeCAD.Placement(point, rot) for col in coordinates
+                    for point in col if isinstance(point, FreeCAD.Vector)]
+
+        # 01. Grouping:
+        groups = list()
+        for col in coordinates:
+            frames = [point for point in col if isinstance(point, FreeCAD.Vector)]
+            if len(frames) == 0:
+                continue
+            groups.append([frames[0]])
+            for i in range(1, len(frames)):
+                group = groups[-1]
+                long = (frames[i].sub(group[-1])).Length
+                long -= width
+                if long <= dist:
+                    group.append(frames[i])
+                else:
+                    groups.append([frames[i]])
+
+        # 02. Points to project:
+        allpoints = list()
+        for group in groups:
+            allpoints.append(group[0].sub(vec1))
+            for ind in range(0, len(group) - 1):
+                allpoints.append((group[ind].sub(vec1) + group[ind + 1].add(vec1)) / 2)
+            allpoints.append(group[-1].add(vec1))
+        heights = sampler.heights(allpoints)
+
+        # 03. Placements:
+        cnt = 0
+        for group in groups:
+            points3D = list()
+            for ind in range(len(group) + 1):
+                point = allpoints[cnt + ind]
+                points3D.append(FreeCAD.Vector(point.x, point.y, heights[cnt + ind]))
+            cnt += len(group) + 1
+
+            for ind in range(0, len(points3D) - 1):
+                pl = FreeCAD.Placement()
+                pl.Base = FreeCAD.Vector(group[ind])
+                if np.isnan(points3D[ind].z) or np.isnan(points3D[ind + 1].z):
+                    pl.Rotation = self.getFrameRotation()
+                    placements.append(pl)
+                    continue
+                vec = points3D[ind] - points3D[ind + 1]
+                p = (points3D[ind] + points3D[ind + 1]) / 2
+                pl.Base.z = p.z
+                rot = FreeCAD.Rotation(FreeCAD.Vector(-1, 0, 0), vec)
+                pl.Rotation = FreeCAD.Rotation(rot.toEuler()[0], rot.toEuler()[1], 0)
+                placements.append(pl)
+        return placements
+
+    def calculateAlignedArray(self):
+        pointsx, pointsy = self.getAligments()
+        pointsx = pointsx + self.getCorridors(len(pointsx))
+        return alignedSlots(self.Polygons, pointsx, pointsy, self.length, self.width, workers=self.workers)
+
+    def calculateNonAlignedArray(self, validate=False):
+        '''
+        Same columns as the aligned array, but every run of free space of a column is packed on its
+        own from the north: the valid centres of the frames of each column are intervals
+        (polygonKernel.columnIntervals) and the frames of an interval go one every gap_row from its top.
+        With "validate" the frames are checked against the working area with one BRep cut at the end.
+        '''
+        centres = self.getColumns()[0]
+        col, start, end = self.getIntervals(centres)
+        # the ends of the intervals are frames touching the boundary: pull them in so that the
+        # rounding of the intersections does not leave those frames a hair outside
+        start = start + INTERVAL_MARGIN
+        end = end - INTERVAL_MARGIN
+
+        cols = []
+        order = np.lexsort((-end, col))
+        for i in np.split(order, np.flatnonzero(np.diff(col[order])) + 1):
+            if len(i) == 0:
+                continue
+            ys = []
+            top = np.inf
+            for ini, fin in zip(start[i], end[i]):
+                fin = min(fin, top)
+                if fin < ini:
+                    continue
+                ys.extend(fin - np.arange(int((fin - ini) // self.gap_row) + 1) * self.gap_row)
+                top = ys[-1] - self.gap_row
+            if len(ys) > 0:
+                cols.append([FreeCAD.Vector(centres[col[i[0]]], y, 0.0) for y in ys])
+
+        if validate:
+            cols = self.validate(cols)
+        return cols
+
+    def validate(self, cols):
+        ''' Remove the frames that are not inside the working area (one BRep cut for all of them) '''
+        points = [point for col in cols for point in col]
+        if len(points) == 0:
+            return cols
+        rec = Part.makePlane(self.width, self.length, FreeCAD.Vector(-self.width / 2, -self.length / 2, 0))
+        recs = []
+        for point in points:
+            cp = rec.copy()
+            cp.Placement.Base = point
+            recs.append(cp)
+        outside = Part.makeCompound(recs).cut(self.Area)
+
+        xy = np.array([[point.x, point.y] for point in points])
+        wrong = np.zeros(len(points), dtype=bool)
+        for face in outside.Faces:
+            if face.Area < 2 * (self.width + self.length):
+                continue  # slivers: the frames can touch the boundary (1 mm of tolerance)
+            center = face.BoundBox.Center
+            wrong |= (np.abs(xy[:, 0] - center.x) <= self.width / 2) & (np.abs(xy[:, 1] - center.y) <= self.length / 2)
+        if not wrong.any():
+            return cols
+
+        FreeCAD.Console.PrintWarning("{} frames out of the working area removed\n".format(int(wrong.sum())))
+        wrong = set(map(tuple, xy[wrong].tolist()))
+        cols = [[point for point in col if not (point.x, point.y) in wrong] for col in cols]
+        return [col for col in cols if len(col) > 0]
+
+    def getColumns(self):
+        ''' x of the centres of the columns (corridors included) and y of the centre of one row '''
+        pointsx, pointsy = self.getAligments()
+        pointsx = pointsx + self.getCorridors(len(pointsx)) + self.width / 2
+        refh, refv = self.getReferences()
+        return pointsx, refh.BoundBox.YMin + self.offsetY - self.length / 2
+
+    def getIntervals(self, centres):
+        ''' Valid centres of the frames in the columns "centres" (polygonKernel.columnIntervals) '''
+        cols, starts, ends = [], [], []
+        for rings in self.Polygons:
+            if len(rings) == 0:
+                continue
+            col, start, end = polygonKernel.columnIntervals(rings, centres, self.width / 2, self.length / 2)
+            cols.append(col)
+            starts.append(start)
+            ends.append(end)
+        if len(cols) == 0:
+            return np.empty(0, dtype=int), np.empty(0), np.empty(0)
+        return np.concatenate(cols), np.concatenate(starts), np.concatenate(ends)
+
+    def optimize(self, steps=(8, 8), azimuths=(0,), top=1):
+        '''
+        Sweep of the phase of the aligned array: "steps" offsets along the pitch of the columns and
+        along the pitch of the rows, added to offsetX / offsetY, for every azimuth (degrees) of
+        "azimuths". The valid centres of every column are computed once per offset x and the frames
+        of every offset y are counted with arithmetic on them (countSlots), so each candidate costs
+        milliseconds.
+        The candidates are ranked by number of frames and then by alignment (share of the frames
+        with a neighbour in the same row of the next or the previous column).
+        Returns the "top" best ones: dicts with offsetX, offsetY, azimuth, count and alignment. The
+        engine keeps its values: set them from a candidate and call run().
+        '''
+        initial = (self.offsetX, self.offsetY, self.azimuth)
+        candidates = []
+        try:
+            for azimuth in azimuths:
+                self.azimuth = azimuth
+                self.offsetX, self.offsetY = initial[:2]
+                self.calculateWorkingArea()
+                for dx in np.arange(steps[0]) * self.gap_col / steps[0]:
+                    self.offsetX = initial[0] + dx
+                    centres, phase = self.getColumns()
+                    col, start, end = self.getIntervals(centres)
+                    for dy in np.arange(steps[1]) * self.gap_row / steps[1]:
+                        count, alignment = countSlots(col, start, end, phase + dy, self.gap_row)
+                        candidates.append({"offsetX": self.offsetX,
+                                           "offsetY": initial[1] + dy,
+                                           "azimuth": azimuth,
+                                           "count": count,
+                                           "alignment": alignment})
+        finally:
+            self.offsetX, self.offsetY, self.azimuth = initial
+
+        candidates.sort(key=lambda c: (-c["count"], -c["alignment"], abs(c["azimuth"]), c["offsetX"], c["offsetY"]))
+        return candidates[:top]
+
+    def run(self, aligned=True, terrain=True):
+        self.calculateWorkingArea()
+        if aligned:
+            cols = self.calculateAlignedArray()
+        else:
+            cols = self.calculateNonAlignedArray()
+
+        if self.azimuth:
+            rot = self.getRotation()
+            cols = [[self.Center + rot.multVec(point - self.Center) for point in col] for col in cols]
+        if terrain:
+            return self.adjustToTerrain(cols, self.length)
+        rot = self.getFrameRotation()
+        return [FreeCAD.Placement(point, rot) for col in cols for point in col]
+
+
 class _PVPlantPlacementTaskPanel:
     '''The editmode TaskPanel for Schedules'''
 
@@ -256,12 +563,10 @@ class _PVPlantPlacementTaskPanel:
         self.Terrain = None
         self.Rack = None
         self.PVArea = None
-        self.Area = None
         self.gap_col = .0
         self.gap_row = .0
         self.offsetX = .0
         self.offsetY = .0
-        self.Dir = FreeCAD.Vector(0, -1, 0)  # Norte a sur
 
         # self.form:
         self.form = FreeCADGui.PySideUic.loadUi(os.path.join(PVPlantResources.__dir__, "PVPlantPlacement.ui"))
@@ -312,43 +617,21 @@ class _PVPlantPlacementTaskPanel:
 
     def createFrameFromPoints(self, placements, edges=None):
         import PVPlantRack
-        def createFrame(pl):
-            #newrack = FreeCAD.ActiveDocument.copyObject(self.Rack)
-            newrack = PVPlantRack.makeTracker()
-            newrack.Label = "Tracker"
-            newrack.Placement = pl
-            newrack.Visibility = True
-            MechanicalGroup.addObject(newrack)
-
-        try:
-            MechanicalGroup = FreeCAD.ActiveDocument.Frames
-        except:
-            MechanicalGroup = FreeCAD.ActiveDocument.addObject("App::DocumentObjectGroup", 'Frames')
-            MechanicalGroup.Label = "Frames"
-
-        if isinstance(placements, list):
-            for place in placements:
-                createFrame(place)
-        else:
-            createFrame(placements)
-
-        FreeCAD.ActiveDocument.Site.addObject(MechanicalGroup)
-
-    def calculateWorkingArea(self):
-        self.Area = self.PVArea.Shape
-        ProhibitedAreas = [FreeCAD.ActiveDocument.getObject(self.form.listProhivitedAreas.item(i).text()).Shape
-                           for i in range(self.form.listProhivitedAreas.count())]
-        if len(ProhibitedAreas) > 0:
-            self.Area = self.Area.cut(ProhibitedAreas)
-
-    def getAligments(self):
-        # TODO: revisar todo esto: -----------------------------------------------------------------
-        sel = FreeCADGui.Selection.getSelectionEx()[0]
+        if not isinstance(placements, list):
+            placements = [placements]
+        setup = self.Rack
+        if hasattr(self.Rack, "Setup") and self.Rack.Setup is not None:
+            setup = self.Rack.Setup
+        return PVPlantRack.makeTrackers(placements, setup)
+
+    def getReferences(self):
+        ''' Reference edges of the rows and the columns from the selection (None: the engine default) '''
         refh = None
         refv = None
-
-        if len(sel.SubObjects) == 0:
-            return
+        sel = FreeCADGui.Selection.getSelectionEx()
+        if len(sel) == 0 or len(sel[0].SubObjects) == 0:
+            return refh, refv
+        sel = sel[0]
 
         if len(sel.SubObjects) == 1:
             # Todo: chequear que sea un edge. Si es otra cosa coger el edge[0] de la forma
@@ -365,337 +648,7 @@ class _PVPlantPlacementTaskPanel:
                 refv = sel.SubObjects[0]
             else:
                 refv = sel.SubObjects[1]
-
-        steps = int((refv.BoundBox.XMax - self.Area.BoundBox.XMin + self.offsetX) / self.gap_col)
-        startx = refv.BoundBox.XMax + self.offsetX - self.gap_col * steps
-        steps = int((refh.BoundBox.YMin - self.Area.BoundBox.YMax + self.offsetY) / self.gap_row)
-        starty = refh.BoundBox.YMin + self.offsetY + self.gap_row * steps
-        # todo end ----------------------------------------------------------------------------------
-
-        return np.arange(startx, self.Area.BoundBox.XMax, self.gap_col), \
-               np.arange(starty, self.Area.BoundBox.YMin, -self.gap_row)
-
-    def adjustToTerrain(self, coordinates, width):
-        placements = list()
-        dist = FreeCAD.Units.Quantity(self.form.editGapRows.text()).Value * 1.50
-        vec1 = FreeCAD.Vector(self.Dir)
-        vec1.Length = (width / 2)
-        mode = 1
-        terrain = PVPlantSite.get().Terrain.Mesh
-        type = 0
-
-        #01. Grouping:
-        from skimage import measure
-        arr = np.array(coordinates, dtype=object)
-        labeled_im = measure.label(arr != 0)
-        for region in measure.regionprops(labeled_im):
-            label = region['label']
-            cols, rows = np.where(labeled_im == label)
-            tmpC = cols[0]
-            tmpR = rows[0]
-            for ind in range(len(cols)):
-                print(coordinates[cols[ind]][rows[ind]])
-
-
-        '''properties = ['label', 'area']
-        table = measure.regionprops_table(labeled_im, properties=properties)
-        print (table)
-        import pandas as pd
-        table = pd.DataFrame(table)
-        print(table)'''
-
-        def placeonregion(frames):
-            for colnum, col in enumerate(frames):
-                print (col)
-                groups = list()
-                groups.append([col[0]])
-                for i in range(1, len(col)):
-                    group = groups[-1]
-                    long = (col[i].sub(group[-1])).Length
-                    long -= width
-                    if long <= dist:
-                        group.append(col[i])
-                    else:
-                        groups.append([col[i]])
-
-                for group in groups:
-                    points = list()
-                    points.append(group[0].sub(vec1))
-                    for ind in range(0, len(group) - 1):
-                        points.append((group[ind].sub(vec1) + group[ind + 1].add(vec1)) / 2)
-                    points.append(group[-1].add(vec1))
-
-                    points3D = list()
-                    '''
-                    # v0
-                    for ind in range(len(points) - 1):
-                        line = Part.LineSegment(points[ind], points[ind + 1])
-                        tmp = terrain.makeParallelProjection(line.toShape(), FreeCAD.Vector(0, 0, 1))
-                        if len(tmp.Vertexes) > 0:
-                            if ind == 0:
-                                points3D.append(tmp.Vertexes[0].Point)
-                            points3D.append(tmp.Vertexes[-1].Point)
-                    '''
-                    # V1
-                    if type == 0:   # Mesh:
-                        import MeshPart as mp
-                        for point in points:
-                            point3D = mp.projectPointsOnMesh([point, ], terrain, FreeCAD.Vector(0, 0, 1))
-                            if len(point3D) > 0:
-                                points3D.append(point3D[0])
-
-                    else:           # Shape:
-                        line = Part.LineSegment(points[0], points[-1])
-                        tmp = terrain.makeParallelProjection(line.toShape(), FreeCAD.Vector(0, 0, 1))
-                        if len(tmp.Vertexes) > 0:
-                            tmppoints = [ver.Point for ver in tmp.Vertexes]
-                            if mode == 1:  # mode = normal
-                                for point in points:
-                                    '''# OPTION 1:
-                                    line = Part.Line(point, point + FreeCAD.Vector(0, 0, 10))
-                                    for i in range(len(tmppoints) - 1):
-                                        seg = Part.LineSegment(tmppoints[i], tmppoints[i + 1])
-                                        inter = line.intersect(seg)
-                                        print(inter)
-                                        if len(inter) > 0:
-                                            points3D.append(FreeCAD.Vector(inter[0].X, inter[0].Y, inter[0].Z))
-                                    '''
-                                    # OPTION 2:
-                                    plane = Part.Plane(point, self.Dir)
-                                    for i in range(len(tmppoints) - 1):
-                                        seg = Part.LineSegment(tmppoints[i], tmppoints[i + 1])
-                                        inter = plane.intersect(seg)
-                                        if len(inter) > 0:
-                                            if len(inter[0]):
-                                                inter = inter[0]
-                                                points3D.append(FreeCAD.Vector(inter[0].X, inter[0].Y, inter[0].Z))
-                                                break
-                            else:  # TODO: mode = Trend
-                                # TODO: check:
-                                from scipy import stats
-                                xx = list()
-                                yy = list()
-                                zz = list()
-
-                                for pts in tmppoints:
-                                    xx.append(pts.x)
-                                    yy.append(pts.y)
-                                    zz.append(pts.z)
-
-                                slope, intercept, r, p, std_err = stats.linregress(yy, zz)
-
-                                def myfunc(x):
-                                    return slope * x + intercept
-
-                                x = list()
-                                x.append(yy[0])
-                                x.append(yy[-1])
-                                newzz = list(map(myfunc, x))
-                                points3D.append(FreeCAD.Vector(xx[0], yy[0], newzz[0]))
-                                points3D.append(FreeCAD.Vector(xx[-1], yy[-1], newzz[1]))
-                    '''
-                    if len(points) != len(points3D):
-                        i = 0
-                        while i < len(points3D) - 1:
-                            vec = points3D[i + 1].sub(points3D[i])
-                            if (vec.x == 0) and (vec.y == 0):
-                                if vec.z >= 0:
-                                    points3D.pop(i)
-                                else:
-                                    points3D.pop(i + 1)
-                                continue
-                            i += 1
-                    '''
-                    '''
-                    if len(points3D) > 0:
-                        line = PVPlantTrace.makeTrace(points3D, "LineCol" + str(colnum))
-                        line.ProjectionPoints = points
-                    else:
-                        print(" Error: No 3d points: \n", points)
-                    '''
-
-                    for ind in range(0, len(points3D) - 1):
-                        pl = FreeCAD.Placement()
-                        vec = points3D[ind] - points3D[ind + 1]
-                        pl.Base = FreeCAD.Vector(group[ind])
-                        p = (points3D[ind] + points3D[ind + 1]) / 2
-                        pl.Base.z = p.z
-                        rot = FreeCAD.Rotation(FreeCAD.Vector(-1, 0, 0), vec)
-                        pl.Rotation = FreeCAD.Rotation(rot.toEuler()[0], rot.toEuler()[1], 0)
-                        placements.append(pl)
-            return placements
-
-    def isInside(self, cp):
-        point = FreeCAD.Vector(x + yy_med + offsetcols, y - xx_med + offsetrows, 0.0)
-        # first filter
-        if self.Area.isInside(point, 10, True):
-            #cp = rec.copy()
-            cp.Placement.Base = point
-            cut = cp.cut([self.Area])
-            # second filter
-            if len(cut.Vertexes) == 0:
-                return True
-        return False
-
-    def calculateAlignedArray(self):
-        pointsx, pointsy = self.getAligments()
-        xx = self.Rack.Shape.BoundBox.XLength
-        yy = self.Rack.Shape.BoundBox.YLength
-        xx_med = xx / 2
-        yy_med = yy / 2
-        rec = Part.makePolygon([FreeCAD.Vector(-xx_med, -yy_med, 0),
-                                FreeCAD.Vector(xx_med, -yy_med, 0),
-                                FreeCAD.Vector(xx_med, yy_med, 0),
-                                FreeCAD.Vector(-xx_med, yy_med, 0),
-                                FreeCAD.Vector(-xx_med, -yy_med, 0)])
-        rec.Placement.Rotation = FreeCAD.Rotation(FreeCAD.Vector(1, 0, 0),
-                                                  FreeCAD.Vector(0, 1, 0))
-        # variables for corridors:
-        countcols = 0
-        countrows = 0
-        offsetcols = 0
-        offsetrows = 0
-        valcols = FreeCAD.Units.Quantity(self.form.editColGap.text()).Value - (self.gap_col - yy)
-
-        pl = []
-        cols = []
-        cnt = 0
-        for x in pointsx:
-            col = []
-            for y in pointsy:
-                cnt += 1
-                point = FreeCAD.Vector(x + yy_med + offsetcols, y - xx_med + offsetrows, 0.0)
-                # first filter
-                if self.Area.isInside(point, 10, True):
-                    rec.Placement.Base = point
-                    cut = rec.cut([self.Area])
-                    # second filter
-                    if len(cut.Vertexes) == 0:
-                        pl.append(point)
-                        col.append(point)
-                        Part.show(rec)
-                        continue
-                col.append(0)
-            cols.append(col)
-
-            if len(col) > 0:
-                # code for vertical corridors:
-                if self.form.groupCorridor.isChecked():
-                    if self.form.editColCount.value() > 0:
-                        countcols += 1
-                        if countcols == self.form.editColCount.value():
-                            offsetcols += valcols
-                            countcols = 0
-        ''' old:
-        pl = []
-        cols = []
-        cnt = 0
-        for x in pointsx:
-            col = []
-            for y in pointsy:
-                cnt += 1
-                point = FreeCAD.Vector(x + yy_med + offsetcols, y - xx_med + offsetrows, 0.0)
-                # first filter
-                if self.Area.isInside(point, 10, True):
-                    rec.Placement.Base = point
-                    cut = rec.cut([self.Area])
-                    # second filter
-                    if len(cut.Vertexes) == 0:
-                        pl.append(point)
-                        col.append(point)
-                        continue
-                #col.append(None)
-
-            if len(col) > 0:
-                cols.append(col)
-                # code for vertical corridors:
-                if self.form.groupCorridor.isChecked():
-                    if self.form.editColCount.value() > 0:
-                        countcols += 1
-                        if countcols == self.form.editColCount.value():
-                            offsetcols += valcols
-                            countcols = 0'''
-
-        return self.adjustToTerrain(cols, xx)
-
-    # TODO: cambiar esto código para adaptarlo al "calculateAlignedArray":
-    def calculateNonAlignedArray(self):
-        gap_col = FreeCAD.Units.Quantity(self.form.editGapCols.text()).Value
-        gap_row = FreeCAD.Units.Quantity(self.form.editGapRows.text()).Value + max(self.Rack.Shape.BoundBox.XLength,
-                                                                                   self.Rack.Shape.BoundBox.YLength)
-        offset_x = FreeCAD.Units.Quantity(self.form.editOffsetHorizontal.text()).Value
-        offset_y = FreeCAD.Units.Quantity(self.form.editOffsetVertical.text()).Value
-
-        Area = self.calculateWorkingArea()
-
-        rec = Part.makePlane(self.Rack.Shape.BoundBox.YLength, self.Rack.Shape.BoundBox.XLength)
-
-        # TODO: revisar todo esto: -----------------------------------------------------------------
-        sel = FreeCADGui.Selection.getSelectionEx()[0]
-        refh = None
-        refv = None
-
-        if len(sel.SubObjects) == 0:
-            refh = refv = Area.Edges[0]
-
-        if len(sel.SubObjects) == 1:
-            refh = refv = sel.SubObjects[0]
-
-        if len(sel.SubObjects) == 2:
-            if sel.SubObjects[0].BoundBox.XLength > sel.SubObjects[1].BoundBox.XLength:
-                refh = sel.SubObjects[0]
-            else:
-                refh = sel.SubObjects[1]
-
-            if sel.SubObjects[0].BoundBox.YLength > sel.SubObjects[1].BoundBox.YLength:
-                refv = sel.SubObjects[0]
-            else:
-                refv = sel.SubObjects[1]
-
-        steps = int((refv.BoundBox.XMax - Area.BoundBox.XMin + offset_x) / gap_col)
-        startx = refv.BoundBox.XMax + offset_x - gap_col * steps
-        # todo end ----------------------------------------------------------------------------------
-
-        start = FreeCAD.Vector(startx, 0.0, 0.0)
-        pointsx = np.arange(start.x, Area.BoundBox.XMax, gap_col)
-
-        if self.form.groupCorridor.isChecked():
-            if (self.form.editColCount.value() > 0):
-                xlen = len(pointsx)
-                count = self.form.editColCount.value()
-                val = FreeCAD.Units.Quantity(self.form.editColGap.text()).Value - (
-                        gap_col - min(self.Rack.Shape.BoundBox.XLength, self.Rack.Shape.BoundBox.YLength))
-                while count <= xlen:
-                    for i, point in enumerate(pointsx):
-                        if i >= count:
-                            pointsx[i] += val
-                    count += self.form.editColCount.value()
-
-        pl = []
-        for point in pointsx:
-            p1 = FreeCAD.Vector(point, Area.BoundBox.YMax, 0.0)
-            p2 = FreeCAD.Vector(point, Area.BoundBox.YMin, 0.0)
-            line = Part.makePolygon([p1, p2])
-
-            inter = Area.section([line])
-            pts = [ver.Point for ver in inter.Vertexes]  # todo: sort points
-            for i in range(0, len(pts), 2):
-                line = Part.LineSegment(pts[i], pts[i + 1])
-                if line.length() >= rec.BoundBox.YLength:
-                    y1 = pts[i].y - rec.BoundBox.YLength
-                    cp = rec.copy()
-                    cp.Placement.Base = FreeCAD.Vector(pts[i].x - rec.BoundBox.XLength / 2, y1, 0.0)
-                    inter = cp.cut([Area])
-                    y1 = min([ver.Point.y for ver in inter.Vertexes])
-                    pointsy = np.arange(y1, pts[i + 1].y, -gap_row)
-                    for point in pointsy:
-                        cp = rec.copy()
-                        cp.Placement.Base = FreeCAD.Vector(pts[i].x - rec.BoundBox.XLength / 2, point, 0.0)
-                        cut = cp.cut([Area], 0)
-                        if len(cut.Vertexes) == 0:
-                            Part.show(cp)
-                            pl.append(point)
-        return pl
+        return refh, refv
 
     def accept(self):
         from datetime import datetime
@@ -708,15 +661,33 @@ class _PVPlantPlacementTaskPanel:
         self.offsetY = FreeCAD.Units.Quantity(self.form.editOffsetVertical.text()).Value
 
         if self.Terrain is None:
-            self.Terrain = PVPlantSite.get().Terrain.Shape
+            import PVPlantTerrain
+            self.Terrain = PVPlantTerrain.getShape(PVPlantSite.get().Terrain)
 
-        FreeCAD.ActiveDocument.openTransaction("Create Placement")
-        self.calculateWorkingArea()
-        placements = None
-        if self.form.cbAlignFrames.isChecked():
-            placements = self.calculateAlignedArray()
-        else:
-            placements = self.calculateNonAlignedArray()
+        refh, refv = self.getReferences()
+        corridor_count = 0
+        corridor_width = 0
+        if self.form.groupCorridor.isChecked():
+            corridor_count = self.form.editColCount.value()
+            corridor_width = FreeCAD.Units.Quantity(self.form.editColGap.text()).Value
+
+        engine = PlacementEngine(self.PVArea.Shape,
+                                 [FreeCAD.ActiveDocument.getObject(self.form.listProhivitedAreas.item(i).text()).Shape
+                                  for i in range(self.form.listProhivitedAreas.count())],
+                                 self.Rack.Shape.BoundBox.XLength, self.Rack.Shape.BoundBox.YLength,
+                                 self.gap_col, self.gap_row, self.offsetX, self.offsetY, refh, refv,
+                                 corridor_count, corridor_width, os.cpu_count() or 1)
+        if self.form.cbAlignFrames.isChecked() and self.form.cbOptimize.isChecked():
+            candidates = engine.optimize(top=5)
+            for candidate in candidates:
+                print(" -- Offset: {offsetX:.0f}, {offsetY:.0f} mm - {count} frames - alignment {alignment:.3f}".format(
+                    **candidate))
+            if len(candidates) > 0:
+                engine.offsetX = candidates[0]["offsetX"]
+                engine.offsetY = candidates[0]["offsetY"]
+                self.form.editOffsetHorizontal.setText("{:.3f} m".format(engine.offsetX / 1000))
+                self.form.editOffsetVertical.setText("{:.3f} m".format(engine.offsetY / 1000))
+        placements = engine.run(self.form.cbAlignFrames.isChecked())
 
         # last step: ------------------------------
         self.createFrameFromPoints(placements)
@@ -726,6 +697,89 @@ class _PVPlantPlacementTaskPanel:
         FreeCADGui.Control.closeDialog()
         return True
 
+PARALLEL_SLOTS = 50000  # smaller grids are not worth the start of the process pool
+INTERVAL_MARGIN = 1.0   # mm that the free intervals of a column shrink at each end (calculateNonAlignedArray)
+
+
+def alignedSlots(areas, pointsx, pointsy, xx, yy, tolerance=1.0, workers=1, strip=64):
+    '''
+    Slots of an aligned array of frames.
+    - areas: working areas, each one the list of rings of a face (PVPlantUtils.getPolygonsFromShape).
+    - pointsx, pointsy: grid of the array (mm), shared by all the areas. The frame of the slot (x, y)
+      is turned 90º: it goes from x to x + yy and from y - xx to y.
+    The grid is split in tasks: the columns crossing each area, in strips of "strip" columns, each
+    tested in one call (polygonKernel.gridRectanglesInside). With "workers" > 1 the tasks of big grids
+    run in a process pool. The results are merged in the order of the tasks, so they do not depend
+    on the number of workers.
+    Returns a list of columns (west to east), each one a list with the centres (FreeCAD.Vector) of
+    the frames that fit, north to south.
+    '''
+    pointsx = np.asarray(pointsx, dtype=float) + yy / 2
+    pointsy = np.asarray(pointsy, dtype=float) - xx / 2
+    if len(pointsx) == 0 or len(pointsy) == 0:
+        return []
+
+    tasks = []
+    for rings in areas:
+        if len(rings) == 0:
+            continue
+        points = np.vstack(rings)
+        cols = np.flatnonzero((pointsx + yy / 2 > points[:, 0].min()) & (pointsx - yy / 2 < points[:, 0].max()))
+        rows = np.flatnonzero((pointsy + xx / 2 > points[:, 1].min()) & (pointsy - xx / 2 < points[:, 1].max()))
+        if len(cols) == 0 or len(rows) == 0:
+            continue
+        for i in range(cols[0], cols[-1] + 1, strip):
+            j = min(i + strip, cols[-1] + 1)
+            tasks.append(((i, j, rows[0], rows[-1] + 1),
+                          (rings, pointsx[i:j], pointsy[rows[0]:rows[-1] + 1], yy / 2, xx / 2, tolerance)))
+
+    results = None
+    if workers > 1 and len(tasks) > 1 and len(pointsx) * len(pointsy) >= PARALLEL_SLOTS:
+        pool = PVPlantUtils.getProcessPool(min(workers, len(tasks)))
+        if pool is None:
+            FreeCAD.Console.PrintWarning("No process pool for the placement (python interpreter not found), "
+                                         "running serially\n")
+        else:
+            try:
+                with pool:
+                    results = list(pool.map(polygonKernel._gridRectanglesTask, [task[1] for task in tasks]))
+            except Exception as err:
+                FreeCAD.Console.PrintWarning("Parallel placement failed, running serially: {}\n".format(err))
+    if results is None:
+        results = [polygonKernel.gridRectanglesInside(*task[1]) for task in tasks]
+
+    inside = np.zeros((len(pointsx), len(pointsy)), dtype=bool)
+    for ((i, j, k, l), args), result in zip(tasks, results):
+        inside[i:j, k:l] |= result
+
+    cols = []
+    for i in np.flatnonzero(inside.any(axis=1)):
+        cols.append([FreeCAD.Vector(pointsx[i], y, 0.0) for y in pointsy[inside[i]]])
+    return cols
+
+
+def countSlots(col, start, end, phase, pitch):
+    '''
+    Frames of the rows "phase + k * pitch" that fit in the intervals of valid centres (col, start,
+    end from polygonKernel.columnIntervals). Returns the number of frames and the share of them with a
+    neighbour in the same row of an adjacent column.
+    '''
+    kmin = np.ceil((start - phase) / pitch).astype(np.int64)
+    kmax = np.floor((end - phase) / pitch).astype(np.int64)
+    counts = np.maximum(kmax - kmin + 1, 0)
+    count = int(counts.sum())
+    if count == 0:
+        return 0, 0.0
+
+    first = np.repeat(np.arange(len(counts)), counts)
+    rows = kmin[first] + np.arange(count) - (np.cumsum(counts) - counts)[first]
+    rows = rows - rows.min()
+    nrows = rows.max() + 1
+    codes = col[first].astype(np.int64) * nrows + rows
+    neighbour = np.isin(codes + nrows, codes) | np.isin(codes - nrows, codes)
+    return count, float(neighbour.mean())
+
+
 def algo(terrain, frames):
     line = Part.LineSegment(begin, end).toShape()
     pts = mp.projectShapeOnMesh(line, terrain, FreeCAD.Vector(0, 0, 1))
@@ -761,7 +815,8 @@ class adjustToTerrainTaskPanel:
 
     def accept(self):
         FreeCADGui.Control.closeDialog()
-        adjustToTerrain(FreeCADGui.Selection.getSelection(), self.form.checkTrenck, self.form.editStepSize)
+        adjustToTerrain(FreeCADGui.Selection.getSelection(), self.form.checkTrenck.isChecked(),
+                        self.form.editStepSize.value())
         return True
 
     def reject(self):
@@ -773,17 +828,16 @@ def adjustToTerrain(frames, trend = True, stepSize = 0):
     starttime = datetime.now()
 
     from scipy import stats
-    import MeshPart as mp
+    from Utils.terrainSampler import getSampler
 
-    FreeCAD.ActiveDocument.openTransaction("Adjust to terrain")
-    terrain = None
-    type = 0
-    if hasattr(PVPlantSite.get().Terrain, "Mesh") and (PVPlantSite.get().Terrain.Mesh.Area>0):
-        terrain = PVPlantSite.get().Terrain.Mesh
-    else:
-        terrain = PVPlantSite.get().Terrain.Shape
-        type = 1
+    sampler = getSampler()
+    if sampler is None:
+        FreeCAD.Console.PrintError("There is no terrain to adjust to\n")
+        return
+    if stepSize <= 0:
+        stepSize = 1000
 
+    FreeCAD.ActiveDocument.openTransaction("Adjust to terrain")
     cols = getCols(frames)
     for col in cols:
         for group in col:
@@ -791,8 +845,10 @@ def adjustToTerrain(frames, trend = True, stepSize = 0):
             frame1 = group[0]  # Norte
             frame2 = group[-1]  # Sur
             # TODO: revisar esta parte:
-            p0 = FreeCAD.Vector(frame1.Shape.BoundBox.Center.x, frame1.Shape.BoundBox.YMax, 0)
-            pf = FreeCAD.Vector(frame2.Shape.BoundBox.Center.x, frame2.Shape.BoundBox.YMin, 0)
+            bb1 = Part.getShape(frame1).BoundBox
+            bb2 = Part.getShape(frame2).BoundBox
+            p0 = FreeCAD.Vector(bb1.Center.x, bb1.YMax, 0)
+            pf = FreeCAD.Vector(bb2.Center.x, bb2.YMin, 0)
 
             points = []
             vec = (pf - p0).normalize()
@@ -805,7 +861,8 @@ def adjustToTerrain(frames, trend = True, stepSize = 0):
                 vec1.z = 0
                 vec2.z = 0
                 vec3 = vec2.sub(vec1)
-                c = vec3.Length / 2 + (frame1.Length.Value - frame2.Length.Value) / 4
+                c = vec3.Length / 2 + (PVPlantUtils.getFrameProperty(frame1, "Length").Value -
+                                       PVPlantUtils.getFrameProperty(frame2, "Length").Value) / 4
                 v = FreeCAD.Vector(vec)
                 v.Length = c
                 v = vec1.add(v)
@@ -813,68 +870,52 @@ def adjustToTerrain(frames, trend = True, stepSize = 0):
                 points.append(v)
             points.append(pf)
 
-            # 2. Get 3D points of the line:
-            points3D = []
-            if type == 0:   # Mesh:
-                import MeshPart as mp
-                points3D = mp.projectPointsOnMesh(points, terrain, FreeCAD.Vector(0, 0, 1))
-            else:           # Shape:
-                line = Part.LineSegment(points[0], points[-1])
-                tmp = terrain.makeParallelProjection(line.toShape(), FreeCAD.Vector(0, 0, 1))
-                if len(tmp.Vertexes) > 0:
-                    tmppoints = [ver.Point for ver in tmp.Vertexes]
-                    for point in points:
-                        plane = Part.Plane(point, vec)
-                        for i in range(len(tmppoints) - 1):
-                            seg = Part.LineSegment(tmppoints[i], tmppoints[i + 1])
-                            inter = plane.intersect(seg)
-                            if len(inter) > 0:
-                                if len(inter[0]):
-                                    inter = inter[0]
-                                    points3D.append(FreeCAD.Vector(inter[0].X, inter[0].Y, inter[0].Z))
-                                    break
+            # 2. Get 3D points of the line (one batched query):
+            points3D = sampler.drapePoints(points)
 
             # 3. Calculate trend:
             points3Dtrend = []
             if trend:
                 def getNewZ(x):
                     return slope * x + intercept
-                if type == 0:  # Mesh:
-                    tmp_points3D = list()
-                    for ind in range(0, len(points3D) - 1):
-                        line = Part.LineSegment(points3D[ind], points3D[ind + 1]).toShape()
-                        tmppoints = mp.projectShapeOnMesh(line, terrain, FreeCAD.Vector(0, 0, 1))
-                        xx = list()
-                        yy = list()
-                        zz = list()
-                        for point in tmppoints[0]:
-                            xx.append(point.x)
-                            yy.append(point.y)
-                            zz.append(point.z)
-                        slope, intercept, r, p, std_err = stats.linregress(yy, zz)
-                        newzz = list(map(getNewZ, [yy[0], yy[-1]]))
-                        if ind == 0:
-                            tmp_points3D.append(FreeCAD.Vector(xx[0], yy[0], newzz[0]))
+                # every point is the mean of the trend ends of the segments that share it; the points
+                # without any trend (segments out of the terrain) keep their height
+                tmp_points3D = [None] * len(points3D)
+                for ind in range(0, len(points3D) - 1):
+                    sections = sampler.drapePolyline([points3D[ind], points3D[ind + 1]], stepSize)
+                    tmppoints = [point for section in sections for point in section]
+                    if len(tmppoints) < 2:
+                        continue
+                    xx = [point.x for point in tmppoints]
+                    yy = [point.y for point in tmppoints]
+                    zz = [point.z for point in tmppoints]
+                    slope, intercept, r, p, std_err = stats.linregress(yy, zz)
+                    newzz = list(map(getNewZ, [yy[0], yy[-1]]))
+                    ends = (FreeCAD.Vector(xx[0], yy[0], newzz[0]), FreeCAD.Vector(xx[-1], yy[-1], newzz[-1]))
+                    for i, point in zip((ind, ind + 1), ends):
+                        if tmp_points3D[i] is None:
+                            tmp_points3D[i] = point
                         else:
-                            tmp_points3D[ind] = (tmp_points3D[ind] + FreeCAD.Vector(xx[0], yy[0], newzz[0])) / 2
-                        tmp_points3D.append(FreeCAD.Vector(xx[-1], yy[-1], newzz[-1]))
-                        points3Dtrend.append((FreeCAD.Vector(xx[0], yy[0], newzz[0]),
-                                              FreeCAD.Vector(xx[-1], yy[-1], newzz[-1])))
-                    points3D = tmp_points3D.copy()
+                            tmp_points3D[i] = (tmp_points3D[i] + point) / 2
+                    points3Dtrend.append(ends)
+                points3D = [points3D[i] if point is None else point for i, point in enumerate(tmp_points3D)]
 
             for ind in range(0, len(points3D) - 1):
                 p = (points3D[ind] + points3D[ind + 1]) / 2
-                group[ind].Placement.Base.z = p.z
+                pl = group[ind].Placement
+                pl.Base.z = p.z
                 vec = points3D[ind] - points3D[ind + 1]
                 rot = FreeCAD.Rotation(FreeCAD.Vector(-1, 0, 0), vec)
-                group[ind].Placement.Rotation = FreeCAD.Rotation(rot.toEuler()[0], rot.toEuler()[1], 0)
+                pl.Rotation = FreeCAD.Rotation(rot.toEuler()[0], rot.toEuler()[1], 0)
+                group[ind].Placement = pl
 
     total_time = datetime.now() - starttime
     print(" -- Tiempo tardado en ajustar al terreno:", total_time)
     FreeCAD.activeDocument().recompute()
 
 def getAxis(sel):
-    site = FreeCAD.ActiveDocument.Site.Terrain.Shape
+    import PVPlantTerrain
+    site = PVPlantTerrain.getShape(FreeCAD.ActiveDocument.Site.Terrain)
     for rack in sel:
         poles = rack.Shape.SubShapes[1].SubShapes
         line = Part.LineSegment(poles[0].BoundBox.Center, poles[-1].BoundBox.Center)
@@ -971,17 +1012,17 @@ def getCols(sel, tolerance=4000, sort = True):
 
     cols = []
     while len(sel) > 0:
-        obj = sel[0]
-        p = obj.Shape.BoundBox.Center
-        vec = obj.Shape.SubShapes[1].SubShapes[1].BoundBox.Center - \
-              obj.Shape.SubShapes[1].SubShapes[0].BoundBox.Center
+        shape = Part.getShape(sel[0])
+        p = shape.BoundBox.Center
+        vec = shape.SubShapes[1].SubShapes[1].BoundBox.Center - \
+              shape.SubShapes[1].SubShapes[0].BoundBox.Center
         n = FreeCAD.Vector(vec.y, -vec.x, 0)
 
         # 1. Detectar los objetos que están en una misma columna
         col = []
         newsel = []
         for obj1 in sel:
-            if obj1.Shape.BoundBox.isCutPlane(p, n): #todo: esto no es del todo correcto. buscar otra manera
+            if Part.getShape(obj1).BoundBox.isCutPlane(p, n): #todo: esto no es del todo correcto. buscar otra manera
                 col.append(obj1)
             else:
                 newsel.append(obj1)
@@ -998,7 +1039,8 @@ def getCols(sel, tolerance=4000, sort = True):
                 vec1.z = 0
                 vec2 = FreeCAD.Vector(col[ind + 1].Placement.Base)
                 vec2.z = 0
-                distance = abs((vec1 - vec2).Length) - (col[ind].Width.Value + col[ind + 1].Width.Value) / 2
+                distance = abs((vec1 - vec2).Length) - (PVPlantUtils.getFrameProperty(col[ind], "Width").Value +
+                                                        PVPlantUtils.getFrameProperty(col[ind + 1], "Width").Value) / 2
                 if distance > tolerance:
                     newcol.append(group.copy())
                     group.clear()
@@ -1029,7 +1071,8 @@ def getGroupsInColumn(column, tolerance = 4000):
             vec1.z = 0
             vec2 = FreeCAD.Vector(column[ind].Placement.Base)
             vec2.z = 0
-            distance = (vec1 - vec2).Length - (column[ind].Length.Value + column[ind + 1].Length.Value) / 2
+            distance = (vec1 - vec2).Length - (PVPlantUtils.getFrameProperty(column[ind], "Length").Value +
+                                               PVPlantUtils.getFrameProperty(column[ind + 1], "Length").Value) / 2
             if distance > tolerance:
                 groups.append(group.copy())
                 group.clear()
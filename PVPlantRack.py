@@ -1273,6 +1273,44 @@ def makeTracker(name = "Tracker", setup = None):
         pass
     return obj
 
+def makeTrackers(placements, setup, name="Tracker", group=None):
+    '''
+    Bulk version of makeTracker for the results of the placement.
+    Every tracker is a Tracker object like the ones of makeTracker (so exportPVSyst, the BOQ, the
+    strings and the cables read them as always), but all of them are created in one transaction,
+    added to "group" (the Frames group of the document by default) and to Site.Frames at once,
+    and the document is recomputed once.
+    Returns the list of new objects.
+    '''
+    doc = FreeCAD.ActiveDocument
+    doc.openTransaction("Create Trackers")
+    trackers = list()
+    for pl in placements:
+        obj = doc.addObject("Part::FeaturePython", "Tracker")
+        obj.Label = name
+        Tracker(obj)
+        if FreeCAD.GuiUp:
+            _ViewProviderTracker(obj.ViewObject)
+        obj.Setup = setup
+        obj.Placement = pl
+        trackers.append(obj)
+
+    site = PVPlantSite.get()
+    if group is None:
+        group = doc.getObject("Frames")
+        if group is None:
+            group = doc.addObject("App::DocumentObjectGroup", "Frames")
+            group.Label = "Frames"
+            if site is not None:
+                site.addObject(group)
+    group.addObjects(trackers)
+
+    if site is not None and hasattr(site, "Frames"):
+        site.Frames = site.Frames + trackers
+    doc.commitTransaction()
+    doc.recompute()
+    return trackers
+
 class Tracker(ArchComponent.Component):
     "A 1 Axis Tracker Obcject"
 
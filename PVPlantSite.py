@@ -761,14 +761,14 @@ class _PVPlantSite(ArchSite._Site):
         return node
 
     def setLatLon(self, lat, lon):
-        import utm
         import PVPlantImportGrid
-        x, y, zone_number, zone_letter = utm.from_latlon(lat, lon)
+        from Utils import geoProjection
+        x, y, zone_number, zone_letter = geoProjection.fromLatLon(lat, lon)
         self.obj.UtmZone = zone_list[zone_number - 1]
         # self.obj.UtmZone = "Z"+str(zone_number)
         #z = PVPlantImportGrid.get_elevation(lat, lon)
         zz = PVPlantImportGrid.getSinglePointElevationFromBing(lat, lon)
-        self.obj.Origin = FreeCAD.Vector(x * 1000, y * 1000, zz.z)
+        self.obj.Origin = FreeCAD.Vector(float(x) * 1000, float(y) * 1000, zz.z)
 
 
 class _ViewProviderSite(ArchSite._ViewProviderSite):
@@ -25,6 +25,7 @@ import ArchComponent
 import Part
 import math
 import PVPlantRack
+import Utils.PVPlantUtils as utils
 
 if FreeCAD.GuiUp:
     import FreeCADGui
@@ -432,22 +433,25 @@ class _String(ArchComponent.Component):
         if (prop == "Frame") or (prop == "StringSetup"):
             if not (obj.Frame is None) and not (obj.StringSetup is None):
                 JuntionBoxPosition = 200
-                portrait = obj.Frame.ModuleOrientation == "Portrait"
+                # the frame can be a Tracker or an App::Link to its setup:
+                setup = utils.getFrameSetup(obj.Frame)
+                frameShape = Part.getShape(obj.Frame)
+                portrait = setup.ModuleOrientation == "Portrait"
                 cableLength = 1200
-                if hasattr(obj.Frame, "PoleCableLength"):
-                    cableLength = obj.Frame.PoleCableLength.Value
+                if hasattr(setup, "PoleCableLength"):
+                    cableLength = setup.PoleCableLength.Value
 
-                moduleWidth = obj.Frame.ModuleWidth.Value
-                moduleHeight = obj.Frame.ModuleHeight.Value
-                dist_x = JuntionBoxPosition + obj.Frame.ModuleColGap.Value + (
+                moduleWidth = setup.ModuleWidth.Value
+                moduleHeight = setup.ModuleHeight.Value
+                dist_x = JuntionBoxPosition + setup.ModuleColGap.Value + (
                     moduleWidth if portrait else moduleHeight) / 2
-                dist_y = obj.Frame.ModuleRowGap.Value + (moduleHeight if portrait else moduleWidth)
+                dist_y = setup.ModuleRowGap.Value + (moduleHeight if portrait else moduleWidth)
 
                 PolePosition = 0
                 if portrait:
                     PolePosition = moduleWidth / 2 - JuntionBoxPosition
 
-                FrameModules = obj.Frame.Shape.SubShapes[0].SubShapes[0].SubShapes
+                FrameModules = frameShape.SubShapes[0].SubShapes[0].SubShapes
                 cableProfile = Part.Face(Part.Wire(Part.Circle(FreeCAD.Vector(0, 0, 0), FreeCAD.Vector(1, 0, 0), 6).toShape()))
                 positiveMC4 = Part.Shape()
                 positiveMC4.read(os.path.join(Dir3dObjects, "MC4 POSITIVE.IGS"))
@@ -455,11 +459,11 @@ class _String(ArchComponent.Component):
                 negativeMC4.read(os.path.join(Dir3dObjects, "MC4 NEGATIVE.IGS"))
 
                 vec = None
-                if obj.Frame.Route:
+                if getattr(obj.Frame, "Route", None):
                     vertexes = obj.Frame.Route.Shape.Vertexes
                     vec = vertexes[1].Point - vertexes[0].Point
                 else:
-                    poles = obj.Frame.Shape.SubShapes[1].SubShapes
+                    poles = frameShape.SubShapes[1].SubShapes
                     vec = poles[1].BoundBox.Center - poles[0].BoundBox.Center
                 vecp= FreeCAD.Vector(-vec.y, vec.x, vec.z)
             # V1:
@@ -24,7 +24,7 @@ import FreeCAD
 import ArchComponent
 import Part
 import PVPlantSite
-import copy
+import math
 import numpy as np
 
 if FreeCAD.GuiUp:
@@ -51,73 +51,6 @@ DirImages = os.path.join(DirResources, "Images")
 
 
 
-#----------------------------------------------------------------------------------------------
-#from PySide.QtWidgets import QVBoxLayout, QLabel, QPushButton, QWidget, QMainWindow, QApplication
-from PySide.QtCore import QTimer, QRunnable, Slot, Signal, QObject, QThreadPool
-
-import sys
-import time
-import traceback
-
-
-class WorkerSignals(QObject):
-    '''
-    Defines the signals available from a running worker thread.
-    Supported signals are:
-    - finished: No data
-    - error: tuple (exctype, value, traceback.format_exc() )
-    - result: object data returned from processing, anything
-    - progress: int indicating % progress
-
-    '''
-    finished = Signal()
-    error = Signal(tuple)
-    result = Signal(object)
-    progress = Signal(int)
-
-class Worker(QRunnable):
-    '''
-    Worker thread
-    Inherits from QRunnable to handler worker thread setup, signals and wrap-up.
-    - param callback: The function callback to run on this worker thread. Supplied args and
-                      kwargs will be passed through to the runner.
-    - type callback: function
-    - param args: Arguments to pass to the callback function
-    - param kwargs: Keywords to pass to the callback function
-    '''
-
-    def __init__(self, fn, *args, **kwargs):
-        super(Worker, self).__init__()
-
-        # Store constructor arguments (re-used for processing)
-        self.fn = fn
-        self.args = args
-        self.kwargs = kwargs
-        self.signals = WorkerSignals()
-
-        # Add the callback to our kwargs
-        self.kwargs['progress_callback'] = self.signals.progress
-
-    @Slot()
-    def run(self):
-        '''
-        Initialise the runner function with passed args, kwargs.
-        '''
-
-        # Retrieve args/kwargs here; and fire processing using them
-        try:
-            result = self.fn(*self.args)
-            print(result)
-        except:
-            traceback.print_exc()
-            exctype, value = sys.exc_info()[:2]
-            self.signals.error.emit((exctype, value, traceback.format_exc()))
-        else:
-            self.signals.result.emit(result)  # Return the result of the processing
-        finally:
-            self.signals.finished.emit()  # Done
-#--------------------------------------------------------------------------------------------
-
 def makeTerrain(name="Terrain"):
     obj = FreeCAD.ActiveDocument.addObject("Part::FeaturePython", "Terrain")
     obj.Label = name
@@ -126,6 +59,13 @@ def makeTerrain(name="Terrain"):
     FreeCAD.ActiveDocument.recompute()
     return obj
 
+
+def getShape(terrain):
+    ''' BRep of a terrain object. PVPlant terrains without a stored Shape build it from their mesh on demand '''
+    if hasattr(terrain, "Proxy") and hasattr(terrain.Proxy, "getShape"):
+        return terrain.Proxy.getShape(terrain)
+    return terrain.Shape
+
 class _Terrain(ArchComponent.Component):
     "A Shadow Terrain Obcject"
 
@@ -252,6 +192,73 @@ class _Terrain(ArchComponent.Component):
                             "Mesh")
         obj.setEditorMode("Mesh", 1)
 
+        if not "BuildShape" in pl:
+            # documents made before this property kept the Shape of the mesh:
+            obj.addProperty("App::PropertyBool",
+                            "BuildShape",
+                            "Surface",
+                            "Store also the BRep of the mesh in Shape (slow and heavy for big DEMs). "
+                            "Without it the BRep is built on demand"
+                            ).BuildShape = not obj.Shape.isNull()
+
+        if not "PyramidLevels" in pl:
+            obj.addProperty("App::PropertyIntegerList",
+                            "PyramidLevels",
+                            "Surface",
+                            "Decimation factors of the level-of-detail meshes (1 = full resolution)"
+                            ).PyramidLevels = [1, 4, 16]
+
+        # Contour properties.
+        if not "MinorContourInterval" in pl:
+            obj.addProperty("App::PropertyLength",
+                            "MinorContourInterval",
+                            "Contour",
+                            "Height between contours (0 = no contours)").MinorContourInterval = 0
+
+        if not "MayorContourInterval" in pl:
+            obj.addProperty("App::PropertyLength",
+                            "MayorContourInterval",
+                            "Contour",
+                            "Height between major contours").MayorContourInterval = 5000
+
+        if not "ContourSmoothing" in pl:
+            obj.addProperty("App::PropertyInteger",
+                            "ContourSmoothing",
+                            "Contour",
+                            "Points of the moving average that smooths the contours").ContourSmoothing = 5
+
+        if not "ContourTolerance" in pl:
+            obj.addProperty("App::PropertyLength",
+                            "ContourTolerance",
+                            "Contour",
+                            "Spacing of the level-of-detail terrain that is contoured (0 = full resolution)"
+                            ).ContourTolerance = 0
+
+        if not "ContourRaster" in pl:
+            obj.addProperty("App::PropertyBool",
+                            "ContourRaster",
+                            "Contour",
+                            "Contour the terrains made from a DEM on their grid instead of their mesh"
+                            ).ContourRaster = True
+
+        if not "ContourPoints" in pl:
+            obj.addProperty("App::PropertyVectorList",
+                            "ContourPoints",
+                            "Contour",
+                            "Points of contours", 4).ContourPoints = []
+
+        if not "ContourVertices" in pl:
+            obj.addProperty("App::PropertyIntegerList",
+                            "ContourVertices",
+                            "Contour",
+                            "Vertices of contours.", 4).ContourVertices = []
+
+        if not "ContourClasses" in pl:
+            obj.addProperty("App::PropertyIntegerList",
+                            "ContourClasses",
+                            "Contour",
+                            "Class of every contour (0 = minor, 1 = major).", 4).ContourClasses = []
+
         '''
         #obj.setEditorMode("Volume", 1)
         if not "AllowedAreas" in pl:
@@ -277,6 +284,191 @@ class _Terrain(ArchComponent.Component):
         if state:
             self.Type = state
 
+    def readGrid(self, obj):
+        '''
+        Read the DEM cells inside the cutting boundary.
+        Returns x, y (mm, site coordinates), z (mm, NaN outside the boundary or nodata) and the mask
+        of the valid cells, or None if the DEM does not cover the boundary.
+        '''
+        import Utils.importDEM as openDEM
+        from Utils import PVPlantUtils
+
+        # Stream only the cells inside the boundary (decimated to 1 m) and keep the rest of
+        # the file out of memory:
+        x, y, datavals, cellsize, nodata_value = openDEM.readEsriGrid(obj.DEM,
+                                                                    obj.CuttingBoundary.Shape.BoundBox,
+                                                                    grid_space=1,
+                                                                    offset=PVPlantSite.get().Origin)
+        if datavals.size == 0:
+            return None
+
+        # Cells inside the boundary (even-odd scanline mask, one NumPy pass):
+        mask = PVPlantUtils.gridMask(PVPlantUtils.getPolygonsFromShape(obj.CuttingBoundary.Shape), x, y)
+        mask &= ~np.isnan(datavals)
+        datavals[~mask] = np.nan
+        return x, y, datavals, mask
+
+    def clearCache(self, levels_only=False):
+        ''' Forget the samplers and the level-of-detail meshes (they are rebuilt on demand) '''
+        if not levels_only:
+            self.sampler = None
+            self.shape = None
+        self.levelMeshes = {}
+        self.levelSamplers = {}
+
+    def getSampler(self, obj, tolerance=0):
+        '''
+        Return the TerrainSampler of this terrain: bilinear interpolation on the DEM grid, or
+        vertical rays on the mesh for terrains made from a points group.
+        With a "tolerance" (mm) the sampler of the coarsest pyramid level that meets it is returned.
+        The samplers are kept in memory until the DEM, the boundary or the mesh change.
+        '''
+        from Utils.terrainSampler import TerrainSampler
+
+        if getattr(self, "sampler", None) is None:
+            self.clearCache()
+            grid = None
+            if obj.DEM and obj.CuttingBoundary:
+                grid = self.readGrid(obj)
+            if grid is not None:
+                self.sampler = TerrainSampler(*grid[:3])
+            elif obj.Mesh.CountFacets > 0:
+                self.sampler = TerrainSampler(mesh=obj.Mesh)
+            elif not obj.Shape.isNull():
+                import Mesh
+                self.sampler = TerrainSampler(mesh=Mesh.Mesh(obj.Shape.tessellate(100)))
+            else:
+                return None
+
+        level = self.getLevel(obj, tolerance)
+        if level == 1:
+            return self.sampler
+        if level not in self.levelSamplers:
+            if self.sampler.isGrid:
+                self.levelSamplers[level] = TerrainSampler(self.sampler.x[::level],
+                                                           self.sampler.y[::level],
+                                                           self.sampler.z[::level, ::level])
+            else:
+                self.levelSamplers[level] = TerrainSampler(mesh=self.getMesh(obj, tolerance))
+        return self.levelSamplers[level]
+
+    def getShape(self, obj):
+        '''
+        Return the BRep of the terrain: the stored Shape, or the shape of the mesh built on the
+        first call and kept in memory until the mesh changes.
+        '''
+        if not obj.Shape.isNull():
+            return obj.Shape
+        if getattr(self, "shape", None) is None:
+            if obj.Mesh.CountFacets == 0:
+                return obj.Shape
+            import PVPlantCreateTerrainMesh
+            self.shape = PVPlantCreateTerrainMesh.MeshToShape(obj.Mesh)
+        return self.shape
+
+    def updateShape(self, obj):
+        ''' Store the BRep of the mesh in Shape only when BuildShape is set '''
+        self.shape = None
+        if obj.BuildShape and obj.Mesh.CountFacets > 0:
+            import PVPlantCreateTerrainMesh
+            obj.Shape = PVPlantCreateTerrainMesh.MeshToShape(obj.Mesh)
+        elif not obj.Shape.isNull():
+            obj.Shape = Part.Shape()
+
+    def getResolution(self, obj):
+        '''
+        Spacing (mm) between the points of the full resolution terrain. It is taken from the DEM
+        header or from the mesh, so it neither reads the DEM nor builds a MeshIndex.
+        '''
+        sampler = getattr(self, "sampler", None)
+        if sampler is not None and sampler.isGrid:
+            return abs(sampler.dx)
+        if obj.DEM and obj.CuttingBoundary:
+            import Utils.importDEM as openDEM
+            with open(obj.DEM, "r") as file:
+                cellsize = float(openDEM.readEsriHeader(file)[0]["cellsize"])
+            # readGrid decimates the DEM to 1 m:
+            return 1000 * cellsize * max(round(1 / cellsize), 1)
+        mesh = obj.Mesh
+        if mesh.CountFacets == 0:
+            return 0
+        bb = mesh.BoundBox
+        return math.sqrt(2 * bb.XLength * bb.YLength / mesh.CountFacets)
+
+    def getLevel(self, obj, tolerance=0):
+        ''' Coarsest factor of PyramidLevels whose spacing is not bigger than "tolerance" (mm) '''
+        if tolerance <= 0:
+            return 1
+        resolution = self.getResolution(obj)
+        if resolution <= 0:
+            return 1
+        level = 1
+        for factor in sorted(obj.PyramidLevels):
+            if factor > 1 and factor * resolution <= tolerance:
+                level = factor
+        return level
+
+    def getMesh(self, obj, tolerance=0):
+        '''
+        Return the terrain mesh at the coarsest pyramid level that meets "tolerance" (mm):
+        strided DEM grids for raster terrains, decimated copies for the others.
+        '''
+        level = self.getLevel(obj, tolerance)
+        if level == 1:
+            return obj.Mesh
+        if level not in self.levelMeshes:
+            sampler = self.getSampler(obj)
+            if sampler.isGrid:
+                import PVPlantCreateTerrainMesh
+                mesh = PVPlantCreateTerrainMesh.GridToMesh(sampler.x[::level],
+                                                           sampler.y[::level],
+                                                           sampler.z[::level, ::level])
+            else:
+                mesh = sampler.mesh.copy()
+                mesh.decimate(level * self.getResolution(obj), 1 - 1 / level ** 2)
+            self.levelMeshes[level] = mesh
+        return self.levelMeshes[level]
+
+    def updateContours(self, obj):
+        '''
+        Fill ContourPoints / ContourVertices / ContourClasses: the polylines are packed one after
+        the other, ContourVertices holds the number of points of each one and ContourClasses
+        whether it is a minor (0) or a major (1) contour.
+        '''
+        minor = obj.MinorContourInterval.Value
+        mayor = obj.MayorContourInterval.Value
+        lines = []
+        if minor > 0 and mayor > 0 and obj.Mesh.CountFacets > 0:
+            import PVPlantTerrainAnalisys
+            levels, is_mayor, polylines = PVPlantTerrainAnalisys.getContours(obj, minor, mayor,
+                                                                            obj.ContourSmoothing,
+                                                                            obj.ContourTolerance.Value,
+                                                                            obj.ContourRaster)
+            lines = [(int(mayor_line), points) for mayor_line, level_lines in zip(is_mayor, polylines)
+                     for points in level_lines]
+
+        if len(lines) == 0:
+            obj.ContourPoints = []
+            obj.ContourVertices = []
+            obj.ContourClasses = []
+            return
+        obj.ContourPoints = list(map(tuple, np.concatenate([points for c, points in lines]).tolist()))
+        obj.ContourVertices = [len(points) for c, points in lines]
+        obj.ContourClasses = [c for c, points in lines]
+
+    def setContours(self, obj, minor, mayor, smoothing=5, tolerance=0, raster=True):
+        ''' Set all the contour properties and compute the contours once '''
+        self.settingContours = True
+        try:
+            obj.MinorContourInterval = minor
+            obj.MayorContourInterval = mayor
+            obj.ContourSmoothing = smoothing
+            obj.ContourTolerance = tolerance
+            obj.ContourRaster = raster
+        finally:
+            self.settingContours = False
+        self.updateContours(obj)
+
     def onChanged(self, obj, prop):
         '''Do something when a property has changed'''
 
@@ -290,151 +482,51 @@ class _Terrain(ArchComponent.Component):
         NODATA_VALUE:           Los valores de entrada que serán NoData en el ráster de salida  Opcional. El valor predeterminado es -9999
         '''
 
+        if prop in ("DEM", "CuttingBoundary", "PointsGroup"):
+            self.clearCache()
+        elif prop == "Mesh" and getattr(self, "sampler", None) is not None and not self.sampler.isGrid:
+            self.clearCache()
+        elif prop == "PyramidLevels":
+            self.clearCache(levels_only=True)
+
+        if prop in ("Mesh", "BuildShape"):
+            if "BuildShape" in obj.PropertiesList and not getattr(obj.Document, "Restoring", False):
+                self.updateShape(obj)
+
+        if prop in ("Mesh", "MinorContourInterval", "MayorContourInterval", "ContourSmoothing",
+                    "ContourTolerance", "ContourRaster") and not getattr(self, "settingContours", False):
+            pl = obj.PropertiesList
+            if "ContourClasses" in pl and "ContourRaster" in pl and not getattr(obj.Document, "Restoring", False):
+                self.updateContours(obj)
+
         if prop == "DEM" or prop == "CuttingBoundary":
-            from datetime import datetime
             if obj.DEM and obj.CuttingBoundary:
-                grid_space = 1
-                file = open(obj.DEM, "r")
-                templist = [line.split() for line in file.readlines()]
-                file.close()
-                del file
-
-                # Read meta data:
-                meta = templist[0:6]
-                nx = int(meta[0][1])                     # NCOLS
-                ny = int(meta[1][1])                     # NROWS
-                xllref = meta[2][0]                      # XLLCENTER / XLLCORNER
-                xllvalue = round(float(meta[2][1]), 3)
-                yllref = meta[3][0]                      # YLLCENTER / XLLCORNER
-                yllvalue = round(float(meta[3][1]), 3)
-                cellsize = round(float(meta[4][1]), 3)   # CELLSIZE
-                nodata_value = float(meta[5][1])         # NODATA_VALUE
-
-                # set coarse_factor
-                coarse_factor = max(round(grid_space / cellsize), 1)
-
-                # Get z values
-                templist = templist[6:(6 + ny)]
-                templist = [templist[i][0::coarse_factor] for i in np.arange(0, len(templist), coarse_factor)]
-                datavals = np.array(templist).astype(float)
-                del templist
-
-                # create xy coordinates
-                import PVPlantSite
-                offset = PVPlantSite.get().Origin
-                x = 1000 * (cellsize * np.arange(nx)[0::coarse_factor] + xllvalue) - offset.x
-                y = 1000 * (cellsize * np.arange(ny)[-1::-1][0::coarse_factor] + yllvalue) - offset.y
-                datavals = 1000 * datavals # - offset.z
-
-                # remove points out of area
-                # 1. coarse:
-                inc_x = obj.CuttingBoundary.Shape.BoundBox.XLength * 0.0
-                inc_y = obj.CuttingBoundary.Shape.BoundBox.YLength * 0.0
-                tmp = np.where(np.logical_and(x >= (obj.CuttingBoundary.Shape.BoundBox.XMin - inc_x),
-                                              x <= (obj.CuttingBoundary.Shape.BoundBox.XMax + inc_x)))[0]
-                x_max = np.ndarray.max(tmp)
-                x_min = np.ndarray.min(tmp)
-
-                tmp = np.where(np.logical_and(y >= (obj.CuttingBoundary.Shape.BoundBox.YMin - inc_y),
-                                              y <= (obj.CuttingBoundary.Shape.BoundBox.YMax + inc_y)))[0]
-                y_max = np.ndarray.max(tmp)
-                y_min = np.ndarray.min(tmp)
-                del tmp
-
-                x = x[x_min:x_max+1]
-                y = y[y_min:y_max+1]
-                datavals = datavals[y_min:y_max+1, x_min:x_max+1]
+                grid = self.readGrid(obj)
+                if grid is None:
+                    FreeCAD.Console.PrintWarning("The DEM does not cover the cutting boundary\n")
+                    return
+                x, y, datavals, mask = grid
+                del grid
 
                 # Create mesh - surface:
                 if True:  # faster but more memory 46s - 4,25 gb
+                    # Regular grid: connectivity is implicit, no Delaunay needed. Bands of rows are
+                    # meshed in parallel and welded through the shared rows.
                     import PVPlantCreateTerrainMesh
-                    v=1
-                    if v == 0:
-                        pts = []
-                        for i in range(0, len(x)):
-                            for j in range(len(y)):
-                                if datavals[j][i] != nodata_value:
-                                    if obj.CuttingBoundary.Shape.isInside(FreeCAD.Vector(x[i], y[j], 0), 0, True):
-                                        pts.append([x[i], y[j], datavals[j][i]])
-
-                        mesh = PVPlantCreateTerrainMesh.Triangulate(np.array(pts))
-                        del pts
-                        import Mesh
-                        Mesh.show(mesh)
-
-                        sh = Part.Shape()
-                        sh.makeShapeFromMesh(mesh.Topology, 0.1)
-                        obj.Shape = sh
-
-                    elif v == 1:
-                        rows = [[],]
-                        cnt = 0
-                        steps = 10
-                        for j in range(len(y)):
-                            pts=[]
-                            for i in range(len(x)):
-                                if datavals[j][i] != nodata_value:
-                                    if obj.CuttingBoundary.Shape.isInside(FreeCAD.Vector(x[i], y[j], 0), 0, True):
-                                        pts.append([x[i], y[j], datavals[j][i]])
-                            rows[-1].extend(pts)
-                            cnt += 1
-                            if cnt == steps:
-                                rows.append(pts)
-                                cnt = 0
-                        if len(rows[-1]) in [0,1]:
-                            rows.pop()
-
-                        import Mesh
-                        m1 = Mesh.Mesh()
-
-                        def domesh(m):
-                            m1.addMesh(m.copy())
-                            obj.Mesh = m1
-
-                        starttime = datetime.now()
-                        for points in rows:
-                            worker = Worker(PVPlantCreateTerrainMesh.Triangulate, (np.array(points)))  # Any other args, kwargs are passed to the run function
-                            #worker.signals.result.connect(self.print_output)
-                            #worker.signals.finished.connect(self.thread_complete)
-                            #worker.signals.progress.connect(self.progress_fn)
-                            self.threadpool = QThreadPool()
-                            self.threadpool.start(worker)
-
-                        #Mesh.show(m1)
-                        total_time = datetime.now() - starttime
-                        print(" -- qt thread: ", total_time)
-
-                        ''' sin thread:
-                        starttime = datetime.now()
-                        def makeTriangulation(points):
-                            return PVPlantCreateTerrainMesh.Triangulate(np.array(points))
-                        from multiprocessing import cpu_count
-                        from multiprocessing.pool import ThreadPool
-                        results = ThreadPool(cpu_count() - 1).imap_unordered(makeTriangulation, rows)
-                        #tmp=[]
-                        m2 = Mesh.Mesh()
-                        for result in results:
-                            #Mesh.show(result)
-                            #tmp.append(result)
-                            m2.addMesh(result.copy())
-                        Mesh.show(m2)
-
-                        total_time = datetime.now() - starttime
-                        print(" -- thread: ", total_time)
-                        '''
-
-                        #sh = Part.Shape()
-                        #sh.makeShapeFromMesh(mesh.Topology, 0.1)
-                        #obj.Shape = sh
+                    mesh = PVPlantCreateTerrainMesh.TiledGridToMesh(x, y, datavals, mask)
+                    if mesh is None:
+                        FreeCAD.Console.PrintWarning("There are no DEM cells inside the cutting boundary\n")
+                        return
+                    # keep the grid for the height queries:
+                    from Utils.terrainSampler import TerrainSampler
+                    self.clearCache()
+                    self.sampler = TerrainSampler(x, y, datavals)
+                    obj.Mesh = mesh
 
                 else:  # 51s - 3,2 gb
                     lines = list()
                     for j in range(len(y)):
-                        pts = []
-                        for i in range(len(x)):
-                            if (obj.CuttingBoundary.Shape.isInside(FreeCAD.Vector(x[i], y[j], 0), 0.0, True)) \
-                                    and (datavals[j][i] != nodata_value):
-                                pts.append(FreeCAD.Vector(x[i], y[j], datavals[j][i]) * 1000)
+                        pts = [FreeCAD.Vector(x[i], y[j], datavals[j][i]) for i in np.nonzero(mask[j])[0]]
                         if len(pts) > 0:
                             bsp = Part.BSplineCurve()
                             bsp.approximate(pts)
@@ -442,7 +534,7 @@ class _Terrain(ArchComponent.Component):
                             #lines.append(Part.makePolygon(pts))
                     sh = Part.makeLoft(lines, False, True, False)
                     obj.Shape = sh
-                del x, y, datavals
+                del x, y, datavals, mask
 
         if prop == "PointsGroup" or prop == "CuttingBoundary":
             if obj.PointsGroup and obj.CuttingBoundary:
@@ -454,25 +546,20 @@ class _Terrain(ArchComponent.Component):
 
                 # TODO: not use the first point, else the Origin in "Site".
                 #  It is standard for everything.
-                firstPoint = self.obj.PointsGroup.Points.Points[0]
-                nbase = FreeCAD.Vector(firstPoint.x, firstPoint.y, firstPoint.z)
-                data = []
-                for point in self.obj.PointsGroup.Points.Points:
-                    tmp = FreeCAD.Vector(0, 0, 0).add(point)
-                    tmp.z = 0
-                    if bnd.isInside(tmp, 0, True):
-                        p = point - nbase
-                        data.append([float(p.x), float(p.y), float(p.z)])
-
-                Data = np.array(data)
-                data.clear()
+                from Utils import PVPlantUtils
+                points = np.array([[p.x, p.y, p.z] for p in obj.PointsGroup.Points.Points], dtype=float)
+                nbase = FreeCAD.Vector(*points[0])
+                inside = PVPlantUtils.is_inside_sm_array(PVPlantUtils.getPolygonsFromShape(bnd), points)
+                Data = points[inside] - points[0]
+                del points
 
                 import PVPlantCreateTerrainMesh
                 mesh = PVPlantCreateTerrainMesh.Triangulate(Data)
-                shape = PVPlantCreateTerrainMesh.MeshToShape(mesh)
-                shape.Placement.move(nbase)
-
-                obj.Shape = shape
+                if mesh is None:
+                    FreeCAD.Console.PrintWarning("The points inside the cutting boundary can not be triangulated\n")
+                    return
+                mesh.translate(nbase.x, nbase.y, nbase.z)
+                obj.Mesh = mesh
                 if obj.DEM:
                     obj.DEM = None
 
@@ -486,8 +573,39 @@ class _ViewProviderTerrain(ArchComponent.ViewProviderComponent):
 
     def __init__(self, vobj):
         ArchComponent.ViewProviderComponent.__init__(self, vobj)
+        self.setProperties(vobj)
         vobj.Proxy = self
 
+    def setProperties(self, vobj):
+        pl = vobj.PropertiesList
+        if not "DisplayResolution" in pl:
+            vobj.addProperty("App::PropertyLength",
+                             "DisplayResolution",
+                             "Terrain",
+                             "Spacing of the level-of-detail mesh shown in the 3D view (0 = full resolution)"
+                             ).DisplayResolution = 4000
+
+        if not "MinorContourColor" in pl:
+            vobj.addProperty("App::PropertyColor",
+                             "MinorContourColor",
+                             "Contour",
+                             "Color of the minor contours").MinorContourColor = (0.0, 0.0, 0.8)
+        if not "MinorContourWidth" in pl:
+            vobj.addProperty("App::PropertyFloat",
+                             "MinorContourWidth",
+                             "Contour",
+                             "Line width of the minor contours").MinorContourWidth = 2
+        if not "MayorContourColor" in pl:
+            vobj.addProperty("App::PropertyColor",
+                             "MayorContourColor",
+                             "Contour",
+                             "Color of the major contours").MayorContourColor = (0.0, 0.0, 1.0)
+        if not "MayorContourWidth" in pl:
+            vobj.addProperty("App::PropertyFloat",
+                             "MayorContourWidth",
+                             "Contour",
+                             "Line width of the major contours").MayorContourWidth = 5
+
     def getIcon(self):
         return str(os.path.join(DirIcons, "terrain.svg"))
 
@@ -496,65 +614,167 @@ class _ViewProviderTerrain(ArchComponent.ViewProviderComponent):
         Create Object visuals in 3D view.
         '''
         self.Object = vobj.Object
+        self.setProperties(vobj)
 
-        # GeoCoords Node.
-        self.geo_coords = coin.SoGeoCoordinate()
+        # Coords Node (local coordinates of the level-of-detail mesh).
+        self.coords = coin.SoCoordinate3()
 
         # Surface features.
         self.triangles = coin.SoIndexedFaceSet()
-        # print(self.triangles)
         self.face_material = coin.SoMaterial()
-        self.edge_material = coin.SoMaterial()
-        self.edge_color = coin.SoBaseColor()
-        self.edge_style = coin.SoDrawStyle()
-        self.edge_style.style = coin.SoDrawStyle.LINES
+        self.face_material.diffuseColor = vobj.ShapeColor[:3]
 
         shape_hints = coin.SoShapeHints()
-        shape_hints.vertex_ordering = coin.SoShapeHints.COUNTERCLOCKWISE
-        mat_binding = coin.SoMaterialBinding()
-        mat_binding.value = coin.SoMaterialBinding.PER_FACE
+        shape_hints.vertexOrdering = coin.SoShapeHints.COUNTERCLOCKWISE
+        self.mat_binding = coin.SoMaterialBinding()
+        self.mat_binding.value = coin.SoMaterialBinding.OVERALL
         offset = coin.SoPolygonOffset()
 
         # Face root.
         faces = coin.SoSeparator()
         faces.addChild(shape_hints)
         faces.addChild(self.face_material)
-        faces.addChild(mat_binding)
-        faces.addChild(self.geo_coords)
+        faces.addChild(self.mat_binding)
+        faces.addChild(offset)
+        faces.addChild(self.coords)
         faces.addChild(self.triangles)
 
         # Highlight for selection.
         highlight = coin.SoType.fromName('SoFCSelection').createInstance()
         highlight.style = 'EMISSIVE_DIFFUSE'
-        faces.addChild(shape_hints)
-        highlight.addChild(self.edge_material)
-        highlight.addChild(mat_binding)
-        highlight.addChild(self.edge_style)
-        highlight.addChild(self.geo_coords)
-        highlight.addChild(self.triangles)
-
-    def updateData(self, obj, prop):
+        highlight.addChild(faces)
+
+        # Contour roots: one line set per class (0 = minor, 1 = major).
+        self.contours = []
+        terrain_root = coin.SoSeparator()
+        terrain_root.addChild(highlight)
+        for i in range(2):
+            cont_color = coin.SoBaseColor()
+            line_style = coin.SoDrawStyle()
+            line_style.style = coin.SoDrawStyle.LINES
+            cont_coords = coin.SoCoordinate3()
+            cont_lines = coin.SoLineSet()
+            contours = coin.SoSeparator()
+            contours.addChild(cont_color)
+            contours.addChild(line_style)
+            contours.addChild(cont_coords)
+            contours.addChild(cont_lines)
+            terrain_root.addChild(contours)
+            self.contours.append((cont_color, line_style, cont_coords, cont_lines))
+        vobj.addDisplayMode(terrain_root, "Terrain")
+
+        # Take features from properties.
+        for prop in ("MinorContourColor", "MinorContourWidth", "MayorContourColor", "MayorContourWidth"):
+            self.onChanged(vobj, prop)
+        self.updateContours(vobj.Object)
+        # the level mesh may need the DEM: it is built when the Terrain mode is first shown
+        self.displayed = False
+        self.levelOutdated = True
+        self.facetCount = 0
+
+    def getDisplayModes(self, vobj):
+        return ArchComponent.ViewProviderComponent.getDisplayModes(self, vobj) + ["Terrain"]
+
+    def getDefaultDisplayMode(self):
+        return "Terrain"
+
+    def setDisplayMode(self, mode):
+        if mode == "Terrain":
+            self.displayed = True
+            if getattr(self, "levelOutdated", False):
+                self.updateLevel(self.Object.ViewObject)
+            return mode
+        self.displayed = False
+        return ArchComponent.ViewProviderComponent.setDisplayMode(self, mode)
+
+    def updateLevel(self, vobj, force=False):
         '''
-        Update Object visuals when a data property changed.
+        Show the coarsest pyramid level of the terrain that meets DisplayResolution. While the
+        Terrain mode is not shown (hidden object, other display mode) the level is only marked as
+        outdated, unless "force".
         '''
-        origin = PVPlantSite.get()
-        base = copy.deepcopy(origin.Origin)
-        base.z = 0
-
-        # Set geosystem.
-        geo_system = ["UTM", origin.UtmZone, "FLAT"]
-        self.geo_coords.geoSystem.setValues(geo_system)
+        obj = vobj.Object
+        if not hasattr(self, "coords") or not hasattr(obj.Proxy, "getMesh"):
+            return
+        if not force and not (getattr(self, "displayed", False) and vobj.Visibility):
+            self.levelOutdated = True
+            return
+        self.levelOutdated = False
+        self.setFacetColors(vobj, None)
+        mesh = obj.Proxy.getMesh(obj, vobj.DisplayResolution.Value)
+        if mesh is None or mesh.CountFacets == 0:
+            self.coords.point.setNum(0)
+            self.triangles.coordIndex.setNum(0)
+            self.facetCount = 0
+            return
+
+        from Utils.terrainSampler import meshArrays
+        points, faces = meshArrays(mesh)
+        index = np.column_stack((faces, np.full(len(faces), -1)))
+        self.triangles.coordIndex.setNum(0)
+        self.coords.point.setValues(0, len(points), points.tolist())
+        self.coords.point.setNum(len(points))
+        self.triangles.coordIndex.setValues(0, index.size, index.ravel().tolist())
+        self.facetCount = len(faces)
+
+    def setFacetColors(self, vobj, colors):
         '''
-        self.boundary_coords.geoSystem.setValues(geo_system)
-        self.major_coords.geoSystem.setValues(geo_system)
-        self.minor_coords.geoSystem.setValues(geo_system)
+        Colour every facet of the level shown in the Terrain mode: "colors" holds one (r, g, b)
+        per facet, in the order of the facets of obj.Proxy.getMesh(obj, DisplayResolution).
+        None goes back to ShapeColor. Returns False if the colours do not match the level.
         '''
+        if not hasattr(self, "face_material"):
+            return False
+        if colors is not None and getattr(self, "levelOutdated", False):
+            self.updateLevel(vobj, force=True)
+        if colors is None or len(colors) != self.facetCount:
+            self.mat_binding.value = coin.SoMaterialBinding.OVERALL
+            self.face_material.diffuseColor.setValue(vobj.ShapeColor[:3])
+            return colors is None
+        self.face_material.diffuseColor.setValues(0, len(colors), [tuple(color[:3]) for color in colors])
+        self.face_material.diffuseColor.setNum(len(colors))
+        self.mat_binding.value = coin.SoMaterialBinding.PER_FACE
+        return True
 
-        if prop == "Shape":
-            shape = obj.getPropertyByName(prop)
-            # Get GeoOrigin.
-            points = [ver.Point for ver in shape.Vertexes]
-            self.geo_coords.point.values = points
+    def updateContours(self, obj):
+        ''' Split the packed contour properties of the terrain into the line set of each class '''
+        if not hasattr(self, "contours") or not "ContourClasses" in obj.PropertiesList:
+            return
+        points = np.array([tuple(point) for point in obj.ContourPoints], dtype=float).reshape(-1, 3)
+        vertices = np.array(obj.ContourVertices, dtype=int)
+        classes = np.array(obj.ContourClasses, dtype=int)
+        if vertices.sum() != len(points) or len(classes) != len(vertices):
+            return      # properties being updated one after the other
+        line_class = np.repeat(classes, vertices)
+        for i, (cont_color, line_style, cont_coords, cont_lines) in enumerate(self.contours):
+            selected = points[line_class == i]
+            cont_lines.numVertices.setNum(0)
+            cont_coords.point.setValues(0, len(selected), selected.tolist())
+            cont_coords.point.setNum(len(selected))
+            cont_lines.numVertices.setValues(0, int((classes == i).sum()), vertices[classes == i].tolist())
+
+    def updateData(self, obj, prop):
+        '''
+        Update Object visuals when a data property changed.
+        '''
+        if prop in ("Mesh", "PyramidLevels"):
+            self.updateLevel(obj.ViewObject)
+        elif prop in ("ContourPoints", "ContourVertices", "ContourClasses"):
+            self.updateContours(obj)
+
+    def onChanged(self, vobj, prop):
+        if prop == "DisplayResolution":
+            self.updateLevel(vobj)
+        elif prop == "Visibility" and vobj.Visibility and getattr(self, "levelOutdated", False):
+            self.updateLevel(vobj)
+        elif prop in ("MinorContourColor", "MayorContourColor") and hasattr(self, "contours"):
+            color = vobj.getPropertyByName(prop)
+            self.contours[0 if prop.startswith("Minor") else 1][0].rgb = (color[0], color[1], color[2])
+        elif prop in ("MinorContourWidth", "MayorContourWidth") and hasattr(self, "contours"):
+            self.contours[0 if prop.startswith("Minor") else 1][1].lineWidth = vobj.getPropertyByName(prop)
+        elif prop == "ShapeColor" and hasattr(self, "face_material"):
+            self.setFacetColors(vobj, None)
+        ArchComponent.ViewProviderComponent.onChanged(self, vobj, prop)
 
     def claimChildren(self):
         """Define which objects will appear as children in the tree view.
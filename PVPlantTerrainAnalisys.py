@@ -44,193 +44,492 @@ def Mest2FemMesh(obj):
     FreeCAD.activeDocument().recompute()
     return obj2
 
-def makeContours(land, minor = 1000, mayor = 5000,
-                 minorColor=(0.0, 0.00, 0.80), mayorColor=(0.00, 0.00, 1.00),
-                 minorThickness = 2, mayorThickness = 5,
-                 filter_size = 5):
-    if not land:
-        return
+def getTerrainFacets(land, tolerance=0):
+    '''
+    Points and faces arrays of the mesh whose facets are the faces analysed on "land": the
+    level-of-detail mesh that meets "tolerance" (mm) for PVPlant terrains, the mesh of other
+    objects with one face per facet, or None to use the faces of the shape.
+    '''
+    from Utils.terrainSampler import meshArrays
+
+    mesh = None
+    if hasattr(land, "Proxy") and hasattr(land.Proxy, "getMesh"):
+        mesh = land.Proxy.getMesh(land, tolerance)
+    elif getattr(land, "Mesh", None) is not None and \
+            (not hasattr(land, "Shape") or land.Mesh.CountFacets == len(land.Shape.Faces)):
+        mesh = land.Mesh
+    if mesh is None or mesh.CountFacets == 0:
+        return None
+    return meshArrays(mesh)
+
+
+def getFaceNormals(land, areas=False, tolerance=0):
+    '''
+    Unit normals ((n, 3) array) of the faces of a terrain, and with "areas" also the area of every
+    face. The faces are the facets given by getTerrainFacets (PVPlant terrains at the pyramid
+    level that meets "tolerance") or else the faces of the shape, in the order of Shape.Faces.
+    '''
+    import numpy as np
+    import PVPlantTerrain
+
+    facets = getTerrainFacets(land, tolerance)
+    if facets is not None:
+        points, faces = facets
+        a, b, c = points[faces[:, 0]], points[faces[:, 1]], points[faces[:, 2]]
+        normals = np.cross(b - a, c - a)
+        length = np.linalg.norm(normals, axis=1)
+        area = length / 2
+    else:
+        shape = PVPlantTerrain.getShape(land)
+        normals = np.array([tuple(face.normalAt(0, 0)) for face in shape.Faces], dtype=float).reshape(-1, 3)
+        length = np.linalg.norm(normals, axis=1)
+        area = np.array([face.Area for face in shape.Faces], dtype=float) if areas else None
+    length[length == 0] = 1
+    normals = normals / length[:, None]
+    return (normals, area) if areas else normals
+
 
-    if land.TypeId == 'Mesh::Feature':
-        Contours_Mesh(land.Mesh, minor, mayor, minorColor, mayorColor, minorThickness, mayorThickness, filter_size)
+def getFaceHeights(land, tolerance=0):
+    ''' Height (mm) of the centre of every face of a terrain, with the faces of getFaceNormals '''
+    import numpy as np
+    import PVPlantTerrain
+
+    facets = getTerrainFacets(land, tolerance)
+    if facets is not None:
+        points, faces = facets
+        return points[faces][:, :, 2].mean(axis=1)
+    return np.array([face.CenterOfMass.z for face in PVPlantTerrain.getShape(land).Faces], dtype=float)
+
+
+def getDisplayTolerance(land):
+    ''' Spacing (mm) of the level of a PVPlant terrain shown in the 3D view, 0 for other objects '''
+    if FreeCAD.GuiUp and hasattr(land.ViewObject, "DisplayResolution"):
+        return land.ViewObject.DisplayResolution.Value
+    return 0
+
+
+def colorFaces(land, colors):
+    '''
+    Show one colour per face of a terrain: on the level shown by PVPlant terrains (analysed with
+    getDisplayTolerance), or as the DiffuseColor of the faces of the shape for other objects.
+    '''
+    proxy = getattr(land.ViewObject, "Proxy", None)
+    if hasattr(proxy, "setFacetColors") and getTerrainFacets(land, getDisplayTolerance(land)) is not None:
+        if not proxy.setFacetColors(land.ViewObject, colors):
+            FreeCAD.Console.PrintWarning("The analysis does not match the level shown of {}\n".format(land.Label))
     else:
-        Contours_Part(land, minor, mayor, minorColor, mayorColor, minorThickness, mayorThickness, filter_size)
+        land.ViewObject.DiffuseColor = colors
 
-    FreeCAD.ActiveDocument.recompute()
 
-def Contours_Mesh(Mesh, minor, mayor,
-                  minorColor, mayorColor,
-                  minorLineWidth, mayorLineWidth,
-                  filter_size): #filter_size de 3 a 21 y siempre impar
-
-    def calculateSection(cuts):
-        for inc in cuts:
-            CrossSections = Mesh.crossSections([((0, 0, inc), (0, 0, 1))], 0.000001)
-
-            for PointList in CrossSections[0]:
-                if len(PointList) > 1:
-                    # 1. Smooth the points
-                    if (len(PointList) > filter_size) and (filter_size > 0):
-                        for a in range(len(PointList)):
-                            x = 0
-                            y = 0
-                            for p in range(-filter_radius, filter_radius + 1):
-                                point_id = a + p
-                                if point_id < 0:
-                                    point_id = 0
-
-                                if point_id >= len(PointList):
-                                    point_id = len(PointList) - 1
-
-                                x += PointList[point_id].x
-                                y += PointList[point_id].y
-
-                            x /= filter_size
-                            y /= filter_size
-                            PointList[a].x = x
-                            PointList[a].y = y
-
-                        for a in reversed(range(len(PointList))):
-                            x = 0
-                            y = 0
-                            for p in range(-filter_radius, filter_radius + 1):
-                                point_id = a + p
-                                if point_id < 0:
-                                    point_id = 0
-
-                                if point_id >= len(PointList):
-                                    point_id = len(PointList) - 1
-
-                                x += PointList[point_id].x
-                                y += PointList[point_id].y
-
-                            x /= filter_size
-                            y /= filter_size
-                            PointList[a].x = x
-                            PointList[a].y = y
-
-                    # 2. Make lines
-                    Contour = Draft.makeWire(PointList, closed=False, face=None, support=None)
-                    Contour.MakeFace = False
-                    Contour.Label = str(int(inc / 1000)) + "m"
-                    Contours.addObject(Contour)
-
-                    if inc % mayor == 0:
-                        Contour.ViewObject.LineWidth = mayorLineWidth
-                        Contour.ViewObject.LineColor = mayorColor
-                    else:
-                        Contour.ViewObject.LineWidth = minorLineWidth
-                        Contour.ViewObject.LineColor = minorColor
-
-                    del Contour, PointList
-            del CrossSections
-
-    filter_radius = int(filter_size / 2)
-    try:
-        Contours = FreeCAD.ActiveDocument.Contours
-    except:
-        Contours = FreeCAD.ActiveDocument.addObject("App::DocumentObjectGroup", 'Contours')
+def slopeAngles(normals):
+    ''' Slope (degrees) of the faces with the given normals, pointing up or down '''
+    import numpy as np
+    return np.degrees(np.arccos(np.clip(np.abs(normals[:, 2]), 0, 1)))
+
+
+def aspectAngles(normals):
+    ''' Aspect (degrees clockwise from north, 0 - 360) of the faces; NaN for flat faces '''
+    import numpy as np
+    normals = normals * np.where(normals[:, 2] < 0, -1.0, 1.0)[:, None]
+    aspect = np.degrees(np.arctan2(normals[:, 0], normals[:, 1])) % 360
+    aspect[np.hypot(normals[:, 0], normals[:, 1]) < 1e-9] = np.nan
+    return aspect
+
+
+def aspectHistogram(aspects, areas, edges=None):
+    '''
+    Area of the faces in every aspect bin ("edges" in degrees, 8 compass sectors by default) and
+    the area of the flat faces, which have no aspect.
+    '''
+    import numpy as np
+    if edges is None:
+        edges = np.linspace(0, 360, 9)
+    valid = ~np.isnan(aspects)
+    histogram = np.histogram(aspects[valid], bins=edges, weights=areas[valid])[0]
+    return histogram, areas[~valid].sum()
+
+
+def rangeEdges(ranges):
+    '''
+    Bin edges of a list of [from, to, color] ranges for aspectHistogram: the ranges are sorted and
+    must be contiguous and increasing, otherwise the histogram would put the areas in the wrong
+    bins. Returns None (the default compass sectors) when they are not:
+
+    >>> rangeEdges([[90, 180, None], [0, 90, None]])
+    [0.0, 90.0, 180.0]
+    >>> rangeEdges([[0, 90, None], [100, 180, None]]) is None
+    True
+    '''
+    if len(ranges) == 0:
+        return None
+    ranges = sorted(ranges, key=lambda r: (r[0], r[1]))
+    edges = [float(ranges[0][0])]
+    for ini, fin, color in ranges:
+        if ini != edges[-1] or fin <= ini:
+            return None
+        edges.append(float(fin))
+    return edges
+
+
+def aspectReport(histogram, flat, edges=None):
+    ''' Text table of an aspect histogram: area (m²) and share of every bin and of the flat faces '''
+    import numpy as np
+    if edges is None:
+        edges = np.linspace(0, 360, 9)
+    total = histogram.sum() + flat
+    total = total if total > 0 else 1
+    lines = ["Aspect histogram:"]
+    for ini, fin, area in zip(edges[:-1], edges[1:], histogram):
+        lines.append("  {:6.1f}º - {:6.1f}º: {:12.1f} m² ({:5.1f} %)".format(ini, fin, area / 1e6, 100 * area / total))
+    lines.append("  flat:            {:12.1f} m² ({:5.1f} %)".format(flat / 1e6, 100 * flat / total))
+    return "\n".join(lines) + "\n"
+
+
+def classifyValues(values, ranges, default=(1.0, 1.0, 1.0)):
+    '''
+    Colour of every value: ranges is a list of [from, to, color] (both ends included); a value takes
+    the colour of the first range that holds it, or "default". Returns a list of colour tuples
+    (DiffuseColor). A value on a bound shared by two ranges takes the lower one, and the values in
+    a gap between ranges take "default":
+
+    >>> red, green, white = (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (1.0, 1.0, 1.0)
+    >>> colors = classifyValues([10, 5, 7, 15, 0, 20, -1, 21], [[10, 20, green], [0, 5, red]])
+    >>> colors == [green, red, white, green, red, green, white, white]
+    True
+    >>> classifyValues([5], [[0, 5, red], [5, 10, green]]) == [red]
+    True
+    '''
+    import numpy as np
+
+    values = np.asarray(values, dtype=float)
+    if len(ranges) == 0:
+        return [tuple(default)] * len(values)
+    ranges = sorted(ranges, key=lambda r: r[0])
+    lows = np.array([r[0] for r in ranges], dtype=float)
+    highs = np.array([r[1] for r in ranges], dtype=float)
+    palette = np.array([tuple(r[2]) for r in ranges] + [tuple(default)], dtype=float)
+
+    # last range that starts at or below the value, or the one before it if it also holds the value:
+    idx = np.searchsorted(lows, values, side="right") - 1
+    prev = np.maximum(idx - 1, 0)
+    shared = (idx > 0) & (lows[prev] <= values) & (values <= highs[prev])
+    idx[shared] -= 1
+    safe = np.maximum(idx, 0)
+    inside = (idx >= 0) & (lows[safe] <= values) & (values <= highs[safe])
+    idx[~inside] = len(ranges)
+    return list(map(tuple, palette[idx].tolist()))
+
+
+def contourLevels(zmin, zmax, minor, mayor):
+    ''' Heights of the contours between zmin and zmax, and which of them are major contours '''
+    import numpy as np
+    levels = np.arange(np.ceil(zmin / minor) * minor, zmax, minor)
+    rest = np.mod(levels, mayor)
+    is_mayor = np.isclose(rest, 0) | np.isclose(rest, mayor)
+    return levels, is_mayor
+
+
+def smoothPolyline(points, filter_size=5, passes=2):
+    '''
+    Moving average (window of filter_size points, "passes" times) of the x, y of a polyline given
+    as an (n, 3) array. Open polylines keep their ends, closed ones (first == last) stay closed.
+    '''
+    import numpy as np
+
+    radius = int(filter_size / 2)
+    if radius < 1 or len(points) <= filter_size:
+        return points
+    closed = len(points) > 3 and np.allclose(points[0], points[-1])
+    out = points[:-1].copy() if closed else points.copy()
+    kernel = np.ones(2 * radius + 1) / (2 * radius + 1)
+    for _ in range(passes):
+        for axis in (0, 1):
+            padded = np.pad(out[:, axis], radius, mode="wrap" if closed else "edge")
+            out[:, axis] = np.convolve(padded, kernel, mode="valid")
+    if closed:
+        return np.vstack((out, out[:1]))
+    out[0] = points[0]
+    out[-1] = points[-1]
+    return out
+
+
+def meshContours(mesh, levels, filter_size=0):
+    '''
+    Cut a mesh at all "levels" with a single crossSections call.
+    Returns one list per level with the polylines ((n, 3) arrays) of that level.
+    '''
+    import numpy as np
 
-    ZMin = Mesh.BoundBox.ZMin // 10000
-    ZMin *= 10000
-    ZMax = Mesh.BoundBox.ZMax
+    if len(levels) == 0:
+        return []
+    sections = mesh.crossSections([((0, 0, z), (0, 0, 1)) for z in levels], 0.000001)
+    result = []
+    for section in sections:
+        lines = []
+        for PointList in section:
+            if len(PointList) > 1:
+                points = np.array([tuple(point) for point in PointList], dtype=float)
+                lines.append(smoothPolyline(points, filter_size))
+        result.append(lines)
+    return result
+
+
+# Marching squares. Corners of a cell: a = (r, c), b = (r, c + 1), c = (r + 1, c + 1), d = (r + 1, c);
+# edges: 0 = a-b, 1 = b-c, 2 = d-c, 3 = a-d; case bits: a = 1, b = 2, c = 4, d = 8 (corner above level).
+# Saddles (5 and 10) are resolved with the mean of the four corners.
+_MS_SEGMENTS = {1: [(3, 0)], 2: [(0, 1)], 3: [(1, 3)], 4: [(1, 2)], 6: [(0, 2)], 7: [(2, 3)],
+                8: [(2, 3)], 9: [(0, 2)], 11: [(1, 2)], 12: [(1, 3)], 13: [(0, 1)], 14: [(0, 3)]}
+_MS_SADDLES = {(5, False): [(3, 0), (1, 2)], (5, True): [(0, 1), (2, 3)],
+               (10, False): [(0, 1), (2, 3)], (10, True): [(3, 0), (1, 2)]}
+
+
+def _chainSegments(keys1, keys2, points1, points2):
+    ''' Join segments that share end keys into polylines. Returns a list of (keys, points) '''
+    import numpy as np
+
+    keys, inverse = np.unique(np.concatenate((keys1, keys2)), return_inverse=True)
+    inverse = inverse.ravel()
+    nodes = np.empty((len(keys), 3))
+    nodes[inverse] = np.concatenate((points1, points2))
+    m = len(keys1)
+    u, v = inverse[:m], inverse[m:]
+
+    src = np.concatenate((u, v))
+    dst = np.concatenate((v, u))
+    order = np.argsort(src, kind="stable")
+    src, dst = src[order], dst[order]
+    first = np.searchsorted(src, src, side="left")
+    neighbours = np.full((len(keys), 2), -1, dtype=np.int64)
+    slot = np.arange(len(src)) - first
+    keep = slot < 2
+    neighbours[src[keep], slot[keep]] = dst[keep]
+    degree = np.bincount(src, minlength=len(keys))
+
+    neighbours = neighbours.tolist()
+    visited = bytearray(len(keys))
+    lines = []
+    # open polylines first (they start at a node with a single neighbour), closed loops after:
+    for start in np.concatenate((np.nonzero(degree == 1)[0], np.nonzero(degree != 1)[0])).tolist():
+        if visited[start]:
+            continue
+        line = [start]
+        visited[start] = 1
+        current = start
+        while True:
+            a, b = neighbours[current]
+            if a >= 0 and not visited[a]:
+                current = a
+            elif b >= 0 and not visited[b]:
+                current = b
+            else:
+                break
+            visited[current] = 1
+            line.append(current)
+        if len(line) > 2 and start in neighbours[line[-1]]:
+            line.append(start)
+        if len(line) > 1:
+            lines.append(line)
+    return [(keys[line[0]], nodes[line]) for line in lines]
+
+
+def gridContours(x, y, z, levels, filter_size=0):
+    '''
+    Marching squares on a regular grid (x: (nx,), y: (ny,), z: (ny, nx), NaN = no data) for all
+    "levels" at once: every (cell, level) pair that crosses is generated with array operations, so
+    the cost follows the length of the contours and not the number of levels.
+    Returns one list per level with the polylines ((n, 3) arrays) of that level.
+    '''
+    import numpy as np
 
+    levels = np.asarray(levels, dtype=float)
+    result = [[] for _ in levels]
+    z = np.asarray(z, dtype=float)
+    ny, nx = z.shape
+    if len(levels) == 0 or nx < 2 or ny < 2:
+        return result
+
+    corners = np.stack((z[:-1, :-1], z[:-1, 1:], z[1:, 1:], z[1:, :-1]))
+    cmin = corners.min(axis=0).ravel()
+    cmax = corners.max(axis=0).ravel()
+    valid = np.isfinite(cmin) & np.isfinite(cmax)
+    cells = np.nonzero(valid)[0]
+
+    # levels crossed by every cell: cmin <= level < cmax
+    k0 = np.searchsorted(levels, cmin[cells], side="left")
+    k1 = np.searchsorted(levels, cmax[cells], side="left")
+    count = k1 - k0
+    cells = np.repeat(cells, count)
+    level = np.repeat(k0, count) + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    if len(cells) == 0:
+        return result
+
+    values = corners.reshape(4, -1)[:, cells]
+    height = levels[level]
+    case = ((values[0] > height) * 1 + (values[1] > height) * 2 +
+            (values[2] > height) * 4 + (values[3] > height) * 8)
+    centre = values.mean(axis=0) > height
+    r, c = np.divmod(cells, nx - 1)
+
+    # end points of each edge, as (row, col) offsets from the cell:
+    p_dr, p_dc = np.array([0, 0, 1, 0]), np.array([0, 1, 0, 0])
+    q_dr, q_dc = np.array([0, 1, 1, 1]), np.array([1, 1, 1, 0])
+    n_h = ny * (nx - 1)
+    n_edges = n_h + (ny - 1) * nx
+
+    def edgePoints(edge, rows, cols, h):
+        r1, c1 = rows + p_dr[edge], cols + p_dc[edge]
+        r2, c2 = rows + q_dr[edge], cols + q_dc[edge]
+        z1, z2 = z[r1, c1], z[r2, c2]
+        t = (h - z1) / (z2 - z1)
+        points = np.column_stack((x[c1] + t * (x[c2] - x[c1]), y[r1] + t * (y[r2] - y[r1]), h))
+        horizontal = (edge == 0) | (edge == 2)
+        ids = np.where(horizontal, r1 * (nx - 1) + c1, n_h + r1 * nx + c1)
+        return ids, points
+
+    keys1, keys2, points1, points2 = [], [], [], []
+    tables = [((k, None), segments) for k, segments in _MS_SEGMENTS.items()] + list(_MS_SADDLES.items())
+    for (k, above), segments in tables:
+        selected = case == k
+        if above is not None:
+            selected &= centre == above
+        idx = np.nonzero(selected)[0]
+        if len(idx) == 0:
+            continue
+        for e1, e2 in segments:
+            for e, keys, points in ((e1, keys1, points1), (e2, keys2, points2)):
+                ids, pts = edgePoints(np.full(len(idx), e), r[idx], c[idx], height[idx])
+                keys.append(level[idx].astype(np.int64) * n_edges + ids)
+                points.append(pts)
+
+    for key, points in _chainSegments(np.concatenate(keys1), np.concatenate(keys2),
+                                      np.concatenate(points1), np.concatenate(points2)):
+        result[int(key // n_edges)].append(smoothPolyline(points, filter_size))
+    return result
+
+
+def shapeContours(shape, levels, filter_size=0):
+    ''' Same as meshContours for a Part shape: all levels are cut by a single Shape.slices call '''
     import numpy as np
-    minor_array = np.arange(ZMin, ZMax, minor)
-    mayor_array = np.arange(ZMin, ZMax, mayor)
-    minor_array = np.array(list(filter(lambda x: x not in mayor_array, minor_array)))
-    calculateSection(minor_array)
-    calculateSection(mayor_array)
-
-def Contours_Part(Terrain, minor, mayor,
-                  minorColor, mayorColor,
-                  minorLineWidth, mayorLineWidth,
-                  filter_size): #filter_size de 3 a 21 y siempre impar
-
-    def calculateSection(cuts):
-        cnt = 0
-        for inc in cuts:
-            CrossSections = Terrain.Shape.slice(FreeCAD.Vector(0, 0, 1), inc)
-
-            for wire in CrossSections:
-                PointList = []
-                for vertex in wire.Vertexes:
-                    PointList.append(vertex.Point)
-
-                if len(PointList) > 1:
-                    # 1. Smooth the points
-                    if (len(PointList) > filter_size) and (filter_size > 0):
-                        for a in range(len(PointList)):
-                            x = 0
-                            y = 0
-                            for p in range(-filter_radius, filter_radius + 1):
-                                point_id = a + p
-                                if point_id < 0:
-                                    point_id = 0
-
-                                if point_id >= len(PointList):
-                                    point_id = len(PointList) - 1
-
-                                x += PointList[point_id].x
-                                y += PointList[point_id].y
-
-                            x /= filter_size
-                            y /= filter_size
-                            PointList[a].x = x
-                            PointList[a].y = y
-
-                        for a in reversed(range(len(PointList))):
-                            x = 0
-                            y = 0
-                            for p in range(-filter_radius, filter_radius + 1):
-                                point_id = a + p
-                                if point_id < 0:
-                                    point_id = 0
-
-                                if point_id >= len(PointList):
-                                    point_id = len(PointList) - 1
-
-                                x += PointList[point_id].x
-                                y += PointList[point_id].y
-
-                            x /= filter_size
-                            y /= filter_size
-                            PointList[a].x = x
-                            PointList[a].y = y
-                    # 2. TODO: close wire
-
-                    # 3. Make lines
-                    Contour = Draft.makeWire(PointList, closed=False, face=None, support=None)
-                    Contour.MakeFace = False
-                    Contour.Label = str(int(inc / 1000)) + "m"
-                    Contours.addObject(Contour)
-
-                    if inc % mayor == 0:
-                        Contour.ViewObject.LineWidth = mayorLineWidth
-                        Contour.ViewObject.LineColor = mayorColor
-                    else:
-                        Contour.ViewObject.LineWidth = minorLineWidth
-                        Contour.ViewObject.LineColor = minorColor
-            cnt += 1
-            if cnt == 10:
-                return
-
-    filter_radius = int(filter_size / 2)
+
+    levels = np.asarray(levels, dtype=float)
+    result = [[] for _ in levels]
+    if len(levels) == 0:
+        return result
+    for wire in shape.slices(FreeCAD.Vector(0, 0, 1), levels.tolist()).Wires:
+        PointList = [vertex.Point for vertex in wire.OrderedVertexes]
+        if wire.isClosed():
+            PointList.append(PointList[0])
+        if len(PointList) > 1:
+            points = np.array([tuple(point) for point in PointList], dtype=float)
+            level = int(np.abs(levels - points[0, 2]).argmin())
+            result[level].append(smoothPolyline(points, filter_size))
+    return result
+
+
+def makeContourObjects(levels, is_mayor, polylines,
+                       minorColor, mayorColor,
+                       minorLineWidth, mayorLineWidth, output="compound"):
+    '''
+    Put the contours in the "Contours" group: with output == "compound" one Part::Feature per
+    class (minor / major) holding all its polylines, with "wires" one Draft wire per polyline.
+    '''
+    import Part
+
     try:
         Contours = FreeCAD.ActiveDocument.Contours
     except:
         Contours = FreeCAD.ActiveDocument.addObject("App::DocumentObjectGroup", 'Contours')
 
-    ZMin = Terrain.Shape.BoundBox.ZMin // 10000
-    ZMin *= 10000
-    ZMax = Terrain.Shape.BoundBox.ZMax
-
+    classes = {False: [], True: []}
+    for inc, mayor, lines in zip(levels, is_mayor, polylines):
+        classes[bool(mayor)].extend((inc, points) for points in lines)
+
+    for mayor, lines in classes.items():
+        if len(lines) == 0:
+            continue
+        color = mayorColor if mayor else minorColor
+        width = mayorLineWidth if mayor else minorLineWidth
+        if output == "wires":
+            for inc, points in lines:
+                Contour = Draft.makeWire([FreeCAD.Vector(*point) for point in points.tolist()],
+                                         closed=False, face=None, support=None)
+                Contour.MakeFace = False
+                Contour.Label = str(int(inc / 1000)) + "m"
+                Contour.ViewObject.LineWidth = width
+                Contour.ViewObject.LineColor = color
+                Contours.addObject(Contour)
+        else:
+            Contour = FreeCAD.ActiveDocument.addObject("Part::Feature",
+                                                       "Contours_Mayor" if mayor else "Contours_Minor")
+            Contour.Shape = Part.makeCompound([Part.makePolygon([FreeCAD.Vector(*point) for point in points.tolist()])
+                                               for inc, points in lines])
+            if FreeCAD.GuiUp:
+                Contour.ViewObject.LineWidth = width
+                Contour.ViewObject.LineColor = color
+            Contours.addObject(Contour)
+
+
+def getContours(land, minor = 1000, mayor = 5000, filter_size = 5, tolerance = 0, raster = True):
+    '''
+    Contours of a terrain: DEM terrains are contoured on their grid (marching squares, if
+    "raster"), meshes and PVPlant terrains on their mesh (at the pyramid level that meets
+    "tolerance") and other objects on their shape.
+    Returns the levels, which of them are major contours and the polylines of every level.
+    '''
     import numpy as np
-    minor_array = np.arange(ZMin, ZMax, minor)
-    mayor_array = np.arange(ZMin, ZMax, mayor)
-    minor_array = np.array(list(filter(lambda x: x not in mayor_array, minor_array)))
-    calculateSection(minor_array)
-    calculateSection(mayor_array)
+
+    sampler = None
+    if raster and hasattr(land, "Proxy") and hasattr(land.Proxy, "getSampler"):
+        sampler = land.Proxy.getSampler(land, tolerance)
+
+    if sampler is not None and sampler.isGrid:
+        levels, is_mayor = contourLevels(np.nanmin(sampler.z), np.nanmax(sampler.z), minor, mayor)
+        return levels, is_mayor, gridContours(sampler.x, sampler.y, sampler.z, levels, filter_size)
+
+    mesh = None
+    if hasattr(land, "Proxy") and hasattr(land.Proxy, "getMesh"):
+        mesh = land.Proxy.getMesh(land, tolerance)
+    elif land.TypeId == 'Mesh::Feature':
+        mesh = land.Mesh
+    if mesh is not None and mesh.CountFacets > 0:
+        levels, is_mayor = contourLevels(mesh.BoundBox.ZMin, mesh.BoundBox.ZMax, minor, mayor)
+        return levels, is_mayor, meshContours(mesh, levels, filter_size)
+
+    import PVPlantTerrain
+    shape = PVPlantTerrain.getShape(land)
+    levels, is_mayor = contourLevels(shape.BoundBox.ZMin, shape.BoundBox.ZMax, minor, mayor)
+    return levels, is_mayor, shapeContours(shape, levels, filter_size)
+
+
+def makeContours(land, minor = 1000, mayor = 5000,
+                 minorColor=(0.0, 0.00, 0.80), mayorColor=(0.00, 0.00, 1.00),
+                 minorThickness = 2, mayorThickness = 5,
+                 filter_size = 5, tolerance = 0, output = None, raster = True):
+    '''
+    tolerance (mm): PVPlant terrains are cut at the coarsest pyramid level that meets it
+    output: "terrain" (stored in the contour properties of a PVPlant terrain, the default for
+    them), "compound" (one object per contour class) or "wires" (one Draft wire per polyline)
+    raster: terrains made from a DEM are contoured on their grid (marching squares)
+    '''
+    if not land:
+        return
+
+    if output is None:
+        output = "terrain" if "ContourPoints" in land.PropertiesList else "compound"
+
+    if output == "terrain":
+        if FreeCAD.GuiUp and hasattr(land.ViewObject, "MinorContourColor"):
+            land.ViewObject.MinorContourColor = minorColor
+            land.ViewObject.MayorContourColor = mayorColor
+            land.ViewObject.MinorContourWidth = minorThickness
+            land.ViewObject.MayorContourWidth = mayorThickness
+        land.Proxy.setContours(land, minor, mayor, filter_size, tolerance, raster)
+    else:
+        levels, is_mayor, polylines = getContours(land, minor, mayor, filter_size, tolerance, raster)
+        makeContourObjects(levels, is_mayor, polylines, minorColor, mayorColor,
+                           minorThickness, mayorThickness, output)
+
+    FreeCAD.ActiveDocument.recompute()
 
 # Base widget for task panel terrain analisys
 class _generalTaskPanel:
@@ -486,10 +785,11 @@ class _HeightTaskPanel(_generalTaskPanel):
 
         # Initial set-up:
         land = FreeCAD.ActiveDocument.Site.Terrain
+        self.heights = getFaceHeights(land, getDisplayTolerance(land)) / 1000
         self.form.editFrom.setSuffix(" m")
-        self.form.editFrom.setValue(land.Shape.BoundBox.ZMin / 1000)
+        self.form.editFrom.setValue(self.heights.min() if len(self.heights) else 0)
         self.form.editTo.setSuffix(" m")
-        self.form.editTo.setValue(land.Shape.BoundBox.ZMax / 1000)
+        self.form.editTo.setValue(self.heights.max() if len(self.heights) else 0)
         self.form.editSteps.setValue(10)
         self.form.editFrom.valueChanged.connect(self.updateTableValues)
         self.form.editTo.valueChanged.connect(self.updateTableValues)
@@ -497,16 +797,7 @@ class _HeightTaskPanel(_generalTaskPanel):
     def accept(self):
         land = FreeCAD.ActiveDocument.Site.Terrain
         if land.isDerivedFrom("Part::Feature"):
-            colorlist = []
-            for face in land.Shape.Faces:
-                zz = face.CenterOfMass.z / 1000
-                color = (.0, .0, .0)
-                for i in range(1,len(self.ranges)):
-                    if self.ranges[i][0] <= zz <= self.ranges[i][1]:
-                        color = self.ranges[i][2]
-                        break
-                colorlist.append(color)
-            land.ViewObject.DiffuseColor = colorlist
+            colorFaces(land, classifyValues(self.heights, self.ranges, default=(.0, .0, .0)))
         FreeCAD.activeDocument().recompute()
         return True
 
@@ -527,68 +818,26 @@ class _SlopeTaskPanel(_generalTaskPanel):
         self.form.editTo.valueChanged.connect(self.updateTableValues)
 
     def getAngles(self):
-        import math
         land = FreeCAD.ActiveDocument.Site.Terrain
-        angles = []
-        for face in land.Shape.Faces:
-            normal = face.normalAt(0, 0)
-            rad = normal.getAngle(FreeCAD.Vector(0, 0, 1))
-            angle = math.degrees(rad)
-            angles.append(angle)
-        return angles
+        if land.isDerivedFrom("Mesh::Feature"):
+            import numpy as np
+            normals = np.array([tuple(normal) for normal in land.Mesh.getPointNormals()]).reshape(-1, 3)
+            return slopeAngles(normals)
+        return slopeAngles(getFaceNormals(land, tolerance=getDisplayTolerance(land)))
 
     def getPointSlope(self, ranges = None):
         from datetime import datetime
         starttime = datetime.now()
-        import math
 
         land = FreeCAD.ActiveDocument.Site.Terrain
         if land.isDerivedFrom("Part::Feature"):
-            colorlist = []
-            for face in land.Shape.Faces:
-                normal = face.normalAt(0, 0)
-                rad = normal.getAngle(FreeCAD.Vector(0, 0, 1))
-                angle = math.degrees(rad)
-                if(angle > 90):
-                    angle -= 90
-                color = (1.0, 1.0, 1.0)
-                for i in range(0, len(ranges)):
-                    if ranges[i][0] <= angle <= ranges[i][1]:
-                        color = ranges[i][2]
-                        break
-                colorlist.append(color)
-            print(len(land.Shape.Faces) == len(colorlist))
-            land.ViewObject.DiffuseColor = colorlist
-
-        # TODO: check this code:
-        elif obj.isDerivedFrom("Mesh::Feature"):
+            colorFaces(land, classifyValues(self.getAngles(), ranges))
+
+        elif land.isDerivedFrom("Mesh::Feature"):
+            # Colores por nodo sobre una copia FEM de la malla:
             fMesh = Mest2FemMesh(land)
-            import math
-            setColors = []
-            i = 1
-            normals = land.Mesh.getPointNormals()
-            for normal in normals:
-                rad = normal.getAngle(FreeCAD.Vector(0, 0, 1))
-                angle = math.degrees(rad)
-
-                # Cambiar esto a la lista de colores configurable
-                if angle < 5:
-                    setColors[i] = (0.0, 0.5, 0.0)
-                elif angle < 7.5:
-                    setColors[i] = (0.0, 1.0, 0.5)
-                elif (angle < 10):
-                    setColors[i] = (0.0, 1.0, 1.0)
-                elif (angle < 12.5):
-                    setColors[i] = (0.0, 0.0, 0.5)
-                elif (angle < 14):
-                    setColors[i] = (0.0, 0.0, 1.0)
-                elif (angle > 20):
-                    setColors[i] = (1.0, 0.0, 0.0)
-                else:
-                    setColors[i] = (1.0, 1.0, 1.0)
-                i += 1
-
-            fMesh.ViewObject.NodeColor = setColors
+            colors = classifyValues(self.getAngles(), ranges)
+            fMesh.ViewObject.NodeColor = dict(zip(range(1, len(colors) + 1), colors))
 
         FreeCAD.activeDocument().recompute()
         print("Everything OK (", datetime.now() - starttime, ")")
@@ -607,8 +856,6 @@ class _OrientationTaskPanel(_generalTaskPanel):
     def __init__(self):
         _generalTaskPanel.__init__(self)
 
-        self.getAngles()
-
         # Initial set-up:
         self.form.editFrom.setSuffix(" º")
         self.form.editFrom.setValue(0.0)
@@ -620,86 +867,41 @@ class _OrientationTaskPanel(_generalTaskPanel):
         self.form.editTo.valueChanged.connect(self.updateTableValues)
 
     def getAngles(self):
-        import math
         land = FreeCAD.ActiveDocument.Site.Terrain
-        anglesx = []
-        anglesy = []
-        for face in land.Shape.Faces:
-            normal = face.normalAt(0, 0)
-            normal.z = 0
-            anglesx.append(math.degrees(normal.getAngle(FreeCAD.Vector(1, 0, 0))))
-            anglesy.append(math.degrees(normal.getAngle(FreeCAD.Vector(0, 1, 0))))
-
-        print("Min x: ", min(anglesx), " y: ", min(anglesy))
-        print("Max x: ", max(anglesx), " y: ", max(anglesy))
-        return anglesx, anglesy
+        if land.isDerivedFrom("Mesh::Feature"):
+            import numpy as np
+            normals = np.array([tuple(normal) for normal in land.Mesh.getPointNormals()]).reshape(-1, 3)
+            return aspectAngles(normals)
+        return aspectAngles(getFaceNormals(land, tolerance=getDisplayTolerance(land)))
 
     def accept(self):
-        import math
         from datetime import datetime
         starttime = datetime.now()
 
         land = FreeCAD.ActiveDocument.Site.Terrain
-        print(land)
         if land.isDerivedFrom("Part::Feature"):
-            colorlist = []
-            j = 0
-            minx = 99999
-            miny = 99999
-            for face in land.Shape.Faces:
-                normal = face.normalAt(0, 0)
-                normal.z = 0
-                anglex = math.degrees(normal.getAngle(FreeCAD.Vector(1, 0, 0)))
-                angley = math.degrees(normal.getAngle(FreeCAD.Vector(0, 1, 0)))
-
-                minx = min([minx, anglex])
-                miny = min([miny, angley])
-                if angley >= 90:
-                    anglex = 360.0 - anglex
-
-                #print(anglex, " ", angley)
-                for i in range(1, len(self.ranges)):
-                    if self.ranges[i][0] <= anglex <= self.ranges[i][1]:
-                        colorlist.append(self.ranges[i][2])
-                        break
-                j += 1
-                if j == 100:
-                    break
-            land.ViewObject.DiffuseColor = colorlist
-            print("Angulos: ", math.degrees(minx), " - ", miny)
-
-        # TODO: check this code:
+            normals, areas = getFaceNormals(land, areas=True, tolerance=getDisplayTolerance(land))
+            aspects = aspectAngles(normals)
+            colorFaces(land, classifyValues(aspects, self.ranges))
+
         elif land.isDerivedFrom("Mesh::Feature"):
+            # Colores por nodo sobre una copia FEM de la malla:
             fMesh = Mest2FemMesh(land)
-            import Mesh
-            fMesh = Mest2FemMesh(land)
+            colors = classifyValues(self.getAngles(), self.ranges)
+            fMesh.ViewObject.NodeColor = dict(zip(range(1, len(colors) + 1), colors))
+            # the histogram is made with the facets, weighted by their area:
+            normals, areas = getFaceNormals(land, areas=True)
+            aspects = aspectAngles(normals)
 
-            setColors = {}
-            i = 1
-            normals = land.Mesh.getPointNormals()
-            print("   ---------   time to FEMMESH:  (", datetime.now() - starttime, ")")
-
-            for normal in normals:
-                rad = normal.getAngle(FreeCAD.Vector(1, 1, 0))
-                angle = math.degrees(rad)
-
-                # Cambiar esto a la lista de colores configurable
-                if angle < 45:
-                    setColors[i] = (0.0, 1.0, 0.0)
-                elif (angle < 90):
-                    setColors[i] = (0.0, 1.0, 1.0)
-                elif (angle < 135):
-                    setColors[i] = (0.0, 0.0, 1.0)
-                elif (angle <= 180):
-                    setColors[i] = (1.0, 0.0, 1.0)
-                #else:
-                #    setColors[i] = (1.0, 0.0, 0.0)
-
-                i += 1
-                if i== 1000:
-                    break
-
-            fMesh.ViewObject.NodeColor = setColors
+        else:
+            return True
+
+        # Superficie por orientación:
+        edges = rangeEdges(self.ranges)
+        if edges is None and self.ranges:
+            FreeCAD.Console.PrintWarning("The ranges are not contiguous, the histogram uses the compass sectors\n")
+        self.histogram, flat = aspectHistogram(aspects, areas, edges)
+        FreeCAD.Console.PrintMessage(aspectReport(self.histogram, flat, edges))
 
         FreeCAD.activeDocument().recompute()
         print("Everything OK (", datetime.now() - starttime, ")")
@@ -216,7 +216,8 @@ class _Trench(ArchComponent.Component):
 
         obj.Base.Visibility = False
         w = self.calculatePathWire(obj)
-        land = FreeCAD.ActiveDocument.Site.Terrain.Shape
+        import PVPlantTerrain
+        land = PVPlantTerrain.getShape(FreeCAD.ActiveDocument.Site.Terrain)
         w = Part.Wire(land.makeParallelProjection(w, FreeCAD.Vector(0, 0, 1)).Edges)
         #Part.show(w, "Projected_wire")
 
@@ -214,16 +214,15 @@ class FrameArea(_Area):
                 obj.Shape = Part.Shape()
                 return
 
-            import Utils.PVPlantUtils as utils
+            from Utils.terrainSampler import getSampler
 
             base = obj.Base.Shape
-            land = PVPlantSite.get().Terrain.Mesh
-            vec = FreeCAD.Vector(0,0,1)
-            wire = utils.getProjected(base, vec)
-            tmp = mp.projectShapeOnMesh(wire, land, vec)
+            sampler = getSampler()
             shape = Part.makeCompound([])
-            for section in tmp:
-                shape.add(Part.makePolygon(section))
+            if sampler:
+                for section in sampler.drapeShape(base, 1000):
+                    if len(section) > 1:
+                        shape.add(Part.makePolygon(section))
             obj.Shape = shape
 
     def addFrame(self, frame):
@@ -511,7 +510,7 @@ class PVSubplant:
 
                 pts = []
                 for frame in obj.Frames:
-                    for panel in frame.Shape.SubShapes[0].SubShapes[0].SubShapes:
+                    for panel in Part.getShape(frame).SubShapes[0].SubShapes[0].SubShapes:
                         zm = panel.BoundBox.ZMax
                         for i in range(8):
                             pt = panel.BoundBox.getPoint(i)
@@ -38,7 +38,7 @@ else:
 
 try:
     _fromUtf8 = QtCore.QString.fromUtf8
-except AttributeError:
+except (AttributeError, NameError):
     def _fromUtf8(s):
         return s
 
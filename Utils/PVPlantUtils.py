@@ -1,6 +1,7 @@
 import FreeCAD
 import Part
 import math
+import os
 
 if FreeCAD.GuiUp:
     import FreeCADGui, os
@@ -19,7 +20,7 @@ else:
 
 try:
     _fromUtf8 = QtCore.QString.fromUtf8
-except AttributeError:
+except (AttributeError, NameError):
     def _fromUtf8(s):
         return s
 
@@ -38,6 +39,19 @@ def partToWire(obj):
     return path1
 
 
+def getFrameSetup(frame):
+    ''' Setup of a frame: its "Setup" property or, for an App::Link, the linked object '''
+    setup = getattr(frame, "Setup", None)
+    return setup if setup is not None else frame.getLinkedObject()
+
+
+def getFrameProperty(frame, name):
+    ''' Property of a frame; the frames created as App::Link take it from their setup '''
+    if hasattr(frame, name):
+        return getattr(frame, name)
+    return getattr(getFrameSetup(frame), name)
+
+
 '''
 def isInside(border, target):
     degree = 0
@@ -171,6 +185,63 @@ def is_inside_sm(polygon, point):
     return intersections & 1
 
 
+def getPolygonsFromShape(shape, deflection=100):
+    '''
+    Return the closed rings of a shape as a list of (n, 2) NumPy arrays (xy, mm).
+    Curved edges are discretized with "deflection" (mm). Shapes without wires are closed
+    through their vertexes.
+    '''
+    import numpy as np
+
+    wires = []
+    if len(shape.Faces) > 0:
+        for face in shape.Faces:
+            wires.extend(face.Wires)
+    else:
+        wires = shape.Wires
+
+    polygons = []
+    for wire in wires:
+        pts = wire.discretize(Deflection=deflection)
+        polygons.append(np.array([[p.x, p.y] for p in pts], dtype=float))
+    if len(polygons) == 0 and len(shape.Vertexes) > 2:
+        polygons.append(np.array([[v.Point.x, v.Point.y] for v in shape.Vertexes], dtype=float))
+
+    for i, polygon in enumerate(polygons):
+        if not np.array_equal(polygon[0], polygon[-1]):
+            polygons[i] = np.vstack((polygon, polygon[:1]))
+    return polygons
+
+
+from Utils.polygonKernel import is_inside_sm_array, gridMask, rectanglesInside, columnIntervals, \
+    gridRectanglesInside
+
+
+def getProcessPool(workers):
+    '''
+    concurrent.futures.ProcessPoolExecutor with "workers" processes, or None when it can not be
+    created. Inside FreeCAD sys.executable is the FreeCAD binary, so the processes are started
+    ("spawn") with the python interpreter shipped next to it, so the tasks must be functions of a
+    module that does not import FreeCAD (Utils.polygonKernel).
+    '''
+    import multiprocessing
+    import sys
+    from concurrent.futures import ProcessPoolExecutor
+
+    context = multiprocessing.get_context("spawn")
+    if not os.path.basename(sys.executable).lower().startswith("python"):
+        folder = os.path.dirname(sys.executable)
+        candidates = [os.path.join(folder, name) for name in ("python", "python3", "python.exe")]
+        candidates = [candidate for candidate in candidates if os.path.isfile(candidate)]
+        if len(candidates) == 0:
+            return None
+        context.set_executable(candidates[0])
+    try:
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    except (OSError, ValueError, NotImplementedError):
+        return None
+
+
 # buscar el camino más corto:
 from collections import defaultdict
 class Graph():
@@ -249,11 +320,15 @@ def FlattenWire(wire):
 def getPointsFromVertexes(Vertexes):
     return [ver.Point for ver in Vertexes]
 
-def makeProfileFromTerrain(path):
-    import PVPlantSite
-    terrain = PVPlantSite.get().Terrain
-    if terrain:
-        return terrain.Shape.makeParallelProjection(path.Shape.Wires[0], FreeCAD.Vector(0, 0, 1))
+def makeProfileFromTerrain(path, step=1000):
+    from Utils.terrainSampler import getSampler
+    sampler = getSampler()
+    if sampler:
+        points = []
+        for section in sampler.drapeShape(path.Shape.Wires[0], step):
+            points.extend(section)
+        if len(points) > 1:
+            return Part.makePolygon(points)
 
 def alpha_shape(points, alpha):
     """
@@ -0,0 +1,179 @@
+# /**********************************************************************
+# *                                                                     *
+# * Copyright (c) 2021 Javier Braña <javier.branagutierrez@gmail.com>  *
+# *                                                                     *
+# * This program is free software; you can redistribute it and/or modify*
+# * it under the terms of the GNU Lesser General Public License (LGPL)  *
+# * as published by the Free Software Foundation; either version 2 of   *
+# * the License, or (at your option) any later version.                 *
+# * for detail see the LICENCE text file.                               *
+# *                                                                     *
+# * This program is distributed in the hope that it will be useful,     *
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of      *
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the       *
+# * GNU Library General Public License for more details.                *
+# *                                                                     *
+# * You should have received a copy of the GNU Library General Public   *
+# * License along with this program; if not, write to the Free Software *
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307*
+# * USA                                                                 *
+# *                                                                     *
+# ***********************************************************************
+
+import FreeCAD
+import numpy as np
+import hashlib
+import json
+import math
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BING_URL = "http://dev.virtualearth.net/REST/v1/Elevation/Polyline"
+BING_KEY = "AmsPZA-zRt2iuIdQgvXZIxme2gWcgLaz7igOUy7VPB8OKjjEd373eCnj1KFv2CqX"
+BING_MAX_SAMPLES = 1024
+
+
+def getCacheDir():
+    path = os.path.join(FreeCAD.getUserCachePath(), "PVPlant", "Elevation")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class ElevationFetcher:
+    '''
+    Elevation of regular UTM grids from the Bing Maps polyline service.
+
+    The grid is split in tiles: runs of "samples" points of one row, aligned to multiples of the
+    resolution in the UTM zone, so neighbouring sites ask for the same tiles. Tiles are requested
+    concurrently by a pool of "workers" threads, failed requests are retried with exponential
+    backoff and every answer is kept in a local cache keyed by the lat/lon of the tile ends and
+    the number of samples (that is, the resolution). Re-runs are served from the cache.
+    "base_url" can point to any server that answers like the Bing service (a local stub for tests).
+    '''
+
+    def __init__(self, base_url=BING_URL, key=BING_KEY, workers=8, retries=4, backoff=0.5,
+                 timeout=20, samples=1000, cache=True):
+        self.base_url = base_url
+        self.key = key
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.samples = min(samples, BING_MAX_SAMPLES)
+        self.cache = cache
+
+    def _url(self, lat1, lng1, lat2, lng2, samples):
+        query = urllib.parse.urlencode({"points": "{},{},{},{}".format(lat1, lng1, lat2, lng2),
+                                        "heights": "sealevel",
+                                        "samples": samples,
+                                        "key": self.key}, safe=",")
+        return self.base_url + "?" + query
+
+    def _request(self, url):
+        ''' GET "url" and return the decoded json. Connection errors, 429 and 5xx are retried. '''
+        for attempt in range(self.retries + 1):
+            try:
+                with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                    return json.loads(response.read().decode("utf-8"))
+            except urllib.error.HTTPError as err:
+                if err.code != 429 and err.code < 500 or attempt == self.retries:
+                    raise
+            except (urllib.error.URLError, OSError, ValueError):
+                if attempt == self.retries:
+                    raise
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def _cachePath(self, lat1, lng1, lat2, lng2, samples):
+        key = "{:.7f},{:.7f},{:.7f},{:.7f},{}".format(lat1, lng1, lat2, lng2, samples)
+        return os.path.join(getCacheDir(), hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy")
+
+    def fetchTile(self, lat1, lng1, lat2, lng2, samples):
+        ''' Elevations (m) of "samples" points evenly spaced from (lat1, lng1) to (lat2, lng2) '''
+        path = self._cachePath(lat1, lng1, lat2, lng2, samples) if self.cache else None
+        if path and os.path.exists(path):
+            try:
+                return np.load(path)
+            except (OSError, ValueError):
+                pass
+
+        answer = self._request(self._url(lat1, lng1, lat2, lng2, samples))
+        elevations = np.asarray(answer['resourceSets'][0]['resources'][0]['elevations'], dtype=float)
+        if len(elevations) != samples:
+            raise ValueError("Expected {} elevations, got {}".format(samples, len(elevations)))
+
+        if path:
+            tmp = path[:-4] + ".tmp.npy"
+            np.save(tmp, elevations)
+            os.replace(tmp, path)
+        return elevations
+
+    def fetchPoints(self, lat, lon):
+        '''
+        Elevations (m) of a list of points, "samples" points per request (Elevation/List service,
+        next to base_url). Points are not cached.
+        '''
+        lat = np.atleast_1d(np.asarray(lat, dtype=float))
+        lon = np.atleast_1d(np.asarray(lon, dtype=float))
+        url = self.base_url.rsplit("/", 1)[0] + "/List"
+
+        def fetch(ini):
+            points = ",".join("{},{}".format(a, b) for a, b in zip(lat[ini:ini + self.samples],
+                                                                    lon[ini:ini + self.samples]))
+            query = urllib.parse.urlencode({"points": points, "heights": "sealevel", "key": self.key},
+                                           safe=",")
+            answer = self._request(url + "?" + query)
+            return answer['resourceSets'][0]['resources'][0]['elevations']
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            blocks = list(pool.map(fetch, range(0, len(lat), self.samples)))
+        return np.concatenate([np.asarray(block, dtype=float) for block in blocks]) if blocks else np.empty(0)
+
+    def fetchGrid(self, boundbox, resolution, zone_number, zone_letter, offset=None):
+        '''
+        Elevation grid covering "boundbox".
+        - boundbox: FreeCAD.BoundBox (mm) in the frame of "offset".
+        - resolution: grid spacing (mm).
+        - offset: FreeCAD.Vector (mm) added to get UTM coordinates (Site.Origin).
+        Returns x (mm, west to east), y (mm, north to south), z (mm, NaN where a tile failed) like
+        importDEM.readEsriGrid.
+        '''
+        from Utils import geoProjection
+
+        if offset is None:
+            offset = FreeCAD.Vector(0, 0, 0)
+        n = self.samples
+        ix0 = math.floor((boundbox.XMin + offset.x) / resolution)
+        ix1 = math.ceil((boundbox.XMax + offset.x) / resolution)
+        iy0 = math.floor((boundbox.YMin + offset.y) / resolution)
+        iy1 = math.ceil((boundbox.YMax + offset.y) / resolution)
+        cols = np.arange(ix0, ix1 + 1)
+        rows = np.arange(iy1, iy0 - 1, -1)
+        tiles = [(iy, it) for iy in rows for it in range(ix0 // n, ix1 // n + 1)]
+
+        # ends of every tile in one call:
+        tile_rows, tile_cols = np.array(tiles, dtype=float).reshape(-1, 2).T
+        northing = tile_rows * resolution / 1000
+        lat1, lng1 = geoProjection.toLatLon(tile_cols * n * resolution / 1000, northing,
+                                            zone_number, zone_letter)
+        lat2, lng2 = geoProjection.toLatLon((tile_cols * n + n - 1) * resolution / 1000, northing,
+                                            zone_number, zone_letter)
+
+        def fetch(k):
+            try:
+                return self.fetchTile(lat1[k], lng1[k], lat2[k], lng2[k], n)
+            except Exception as err:
+                FreeCAD.Console.PrintWarning("Elevation tile not available: {}\n".format(err))
+                return np.full(n, np.nan)
+
+        z = np.full((len(rows), len(cols)), np.nan)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for (iy, it), elevations in zip(tiles, pool.map(fetch, range(len(tiles)))):
+                k = np.arange(it * n, it * n + n)
+                inside = (k >= ix0) & (k <= ix1)
+                z[iy1 - iy, k[inside] - ix0] = elevations[inside] * 1000
+
+        return cols * resolution - offset.x, rows * resolution - offset.y, z
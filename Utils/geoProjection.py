@@ -0,0 +1,214 @@
+# /**********************************************************************
+# *                                                                     *
+# * Copyright (c) 2021 Javier Braña <javier.branagutierrez@gmail.com>  *
+# *                                                                     *
+# * This program is free software; you can redistribute it and/or modify*
+# * it under the terms of the GNU Lesser General Public License (LGPL)  *
+# * as published by the Free Software Foundation; either version 2 of   *
+# * the License, or (at your option) any later version.                 *
+# * for detail see the LICENCE text file.                               *
+# *                                                                     *
+# * This program is distributed in the hope that it will be useful,     *
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of      *
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the       *
+# * GNU Library General Public License for more details.                *
+# *                                                                     *
+# * You should have received a copy of the GNU Library General Public   *
+# * License along with this program; if not, write to the Free Software *
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307*
+# * USA                                                                 *
+# *                                                                     *
+# ***********************************************************************
+
+'''
+Conversion of whole arrays of coordinates between WGS84 lat/lon, UTM (m) and the local frame of
+the Site (mm, UTM minus Site.Origin). Same formulas as the "utm" package, written with NumPy.
+'''
+
+import numpy as np
+import functools
+
+K0 = 0.9996
+R = 6378137
+E = 0.00669438
+E2 = E * E
+E3 = E2 * E
+E_P2 = E / (1 - E)
+
+_SQRT_E = np.sqrt(1 - E)
+_E = (1 - _SQRT_E) / (1 + _SQRT_E)
+_E2 = _E * _E
+_E3 = _E2 * _E
+_E4 = _E3 * _E
+_E5 = _E4 * _E
+
+M1 = (1 - E / 4 - 3 * E2 / 64 - 5 * E3 / 256)
+M2 = (3 * E / 8 + 3 * E2 / 32 + 45 * E3 / 1024)
+M3 = (15 * E2 / 256 + 45 * E3 / 1024)
+M4 = (35 * E3 / 3072)
+
+P2 = (3. / 2 * _E - 27. / 32 * _E3 + 269. / 512 * _E5)
+P3 = (21. / 16 * _E2 - 55. / 32 * _E4)
+P4 = (151. / 96 * _E3 - 417. / 128 * _E5)
+P5 = (1097. / 512 * _E4)
+
+ZONE_LETTERS = "CDEFGHJKLMNPQRSTUVWXX"
+
+
+def _modAngle(value):
+    return (value + np.pi) % (2 * np.pi) - np.pi
+
+
+def zoneNumber(lat, lon):
+    ''' UTM zone of a point, with the Norway and Svalbard exceptions '''
+    if 56 <= lat < 64 and 3 <= lon < 12:
+        return 32
+    if 72 <= lat <= 84 and lon >= 0:
+        if lon < 9:
+            return 31
+        elif lon < 21:
+            return 33
+        elif lon < 33:
+            return 35
+        elif lon < 42:
+            return 37
+    if lon == 180:
+        return 60
+    return int((lon + 180) / 6) % 60 + 1
+
+
+def zoneLetter(lat):
+    if -80 <= lat <= 84:
+        return ZONE_LETTERS[int(lat + 80) >> 3]
+    return None
+
+
+class UtmZone:
+    ''' Transverse Mercator projection of one UTM zone. Get them with getZone (they are cached). '''
+
+    def __init__(self, number, northern=True):
+        self.number = number
+        self.northern = northern
+        self.centralMeridian = np.radians((number - 1) * 6 - 180 + 3)
+        self.falseNorthing = 0 if northern else 10000000
+
+    def fromLatLon(self, lat, lon):
+        ''' lat, lon (degrees) -> easting, northing (m) '''
+        lat_rad = np.radians(np.asarray(lat, dtype=float))
+        lat_sin = np.sin(lat_rad)
+        lat_cos = np.cos(lat_rad)
+        lat_tan = lat_sin / lat_cos
+        lat_tan2 = lat_tan * lat_tan
+        lat_tan4 = lat_tan2 * lat_tan2
+
+        n = R / np.sqrt(1 - E * lat_sin ** 2)
+        c = E_P2 * lat_cos ** 2
+        a = lat_cos * _modAngle(np.radians(np.asarray(lon, dtype=float)) - self.centralMeridian)
+        a2 = a * a
+        a3 = a2 * a
+        a4 = a3 * a
+        a5 = a4 * a
+        a6 = a5 * a
+        m = R * (M1 * lat_rad -
+                 M2 * np.sin(2 * lat_rad) +
+                 M3 * np.sin(4 * lat_rad) -
+                 M4 * np.sin(6 * lat_rad))
+
+        easting = K0 * n * (a +
+                            a3 / 6 * (1 - lat_tan2 + c) +
+                            a5 / 120 * (5 - 18 * lat_tan2 + lat_tan4 + 72 * c - 58 * E_P2)) + 500000
+        northing = K0 * (m + n * lat_tan * (a2 / 2 +
+                                            a4 / 24 * (5 - lat_tan2 + 9 * c + 4 * c ** 2) +
+                                            a6 / 720 * (61 - 58 * lat_tan2 + lat_tan4 + 600 * c - 330 * E_P2)))
+        return easting, northing + self.falseNorthing
+
+    def toLatLon(self, easting, northing):
+        ''' easting, northing (m) -> lat, lon (degrees) '''
+        x = np.asarray(easting, dtype=float) - 500000
+        y = np.asarray(northing, dtype=float) - self.falseNorthing
+
+        m = y / K0
+        mu = m / (R * M1)
+        p_rad = (mu +
+                 P2 * np.sin(2 * mu) +
+                 P3 * np.sin(4 * mu) +
+                 P4 * np.sin(6 * mu) +
+                 P5 * np.sin(8 * mu))
+        p_sin = np.sin(p_rad)
+        p_sin2 = p_sin * p_sin
+        p_cos = np.cos(p_rad)
+        p_tan = p_sin / p_cos
+        p_tan2 = p_tan * p_tan
+        p_tan4 = p_tan2 * p_tan2
+
+        ep_sin = 1 - E * p_sin2
+        n = R / np.sqrt(ep_sin)
+        r = (1 - E) / ep_sin
+        c = E_P2 * p_cos ** 2
+        c2 = c * c
+
+        d = x / (n * K0)
+        d2 = d * d
+        d3 = d2 * d
+        d4 = d3 * d
+        d5 = d4 * d
+        d6 = d5 * d
+
+        latitude = (p_rad - (p_tan / r) *
+                    (d2 / 2 -
+                     d4 / 24 * (5 + 3 * p_tan2 + 10 * c - 4 * c2 - 9 * E_P2)) +
+                    d6 / 720 * (61 + 90 * p_tan2 + 298 * c + 45 * p_tan4 - 252 * E_P2 - 3 * c2))
+        longitude = (d -
+                     d3 / 6 * (1 + 2 * p_tan2 + c) +
+                     d5 / 120 * (5 - 2 * c + 28 * p_tan2 - 3 * c2 + 8 * E_P2 + 24 * p_tan4)) / p_cos
+        longitude = _modAngle(longitude + self.centralMeridian)
+        return np.degrees(latitude), np.degrees(longitude)
+
+
+@functools.lru_cache(maxsize=None)
+def getZone(number, northern=True):
+    return UtmZone(int(number), bool(northern))
+
+
+def fromLatLon(lat, lon, number=None):
+    '''
+    Like utm.from_latlon: returns easting, northing (m), zone number and zone letter.
+    lat, lon can be arrays; the zone is the zone of the first point unless "number" is given.
+    '''
+    lat0 = float(np.ravel(lat)[0])
+    lon0 = float(np.ravel(lon)[0])
+    if number is None:
+        number = zoneNumber(lat0, lon0)
+    easting, northing = getZone(number, lat0 >= 0).fromLatLon(lat, lon)
+    return easting, northing, number, zoneLetter(lat0)
+
+
+def toLatLon(easting, northing, number, letter):
+    ''' Like utm.to_latlon: easting, northing (m) of the zone "number" + "letter" -> lat, lon '''
+    return getZone(number, letter.upper() >= 'N').toLatLon(easting, northing)
+
+
+def siteZone(site=None):
+    ''' UTM zone of the Site (Site.UtmZone is "Z<number>", the hemisphere is taken from Latitude) '''
+    if site is None:
+        import PVPlantSite
+        site = PVPlantSite.get()
+    return getZone(int(str(site.UtmZone).lstrip("Z")), float(site.Latitude) >= 0)
+
+
+def latLonToLocal(lat, lon, site=None):
+    ''' lat, lon (degrees) -> x, y (mm) in the local frame of the Site '''
+    if site is None:
+        import PVPlantSite
+        site = PVPlantSite.get()
+    easting, northing = siteZone(site).fromLatLon(lat, lon)
+    return easting * 1000 - site.Origin.x, northing * 1000 - site.Origin.y
+
+
+def localToLatLon(x, y, site=None):
+    ''' x, y (mm) in the local frame of the Site -> lat, lon (degrees) '''
+    if site is None:
+        import PVPlantSite
+        site = PVPlantSite.get()
+    return siteZone(site).toLatLon((np.asarray(x, dtype=float) + site.Origin.x) / 1000,
+                                   (np.asarray(y, dtype=float) + site.Origin.y) / 1000)
@@ -20,96 +20,450 @@
 # *                                                                     *
 # ***********************************************************************
 
+import FreeCAD
+import numpy as np
+import itertools
+import math
+import os
+import json
+import hashlib
+
+ESRI_HEADER_KEYS = ("ncols", "nrows", "xllcorner", "xllcenter", "yllcorner", "yllcenter",
+                    "cellsize", "nodata_value")
+
+
 def getFile():
     from PySide import QtGui
     filters = "Esri ASC (*.asc);;CSV (*.csv);;All files (*.*)"
     return QtGui.QFileDialog.getOpenFileName(None, "Open DEM,","",filters)[0]
 
 
-def openEsri(filename):
-    grid_space = 1
-    file = open(filename, "r")
-    templist = [line.split() for line in file.readlines()]
-    file.close()
-    del file
-
-    # Read meta data:
-    meta = templist[0:6]
-    nx = int(meta[0][1])                        # NCOLS
-    ny = int(meta[1][1])                        # NROWS
-    xllref = meta[2][0]                         # XLLCENTER / XLLCORNER
-    xllvalue = round(float(meta[2][1]), 3)
-    yllref = meta[3][0]                         # YLLCENTER / XLLCORNER
-    yllvalue = round(float(meta[3][1]), 3)
-    cellsize = round(float(meta[4][1]), 3)      # CELLSIZE
-    nodata_value = float(meta[5][1])            # NODATA_VALUE
-
-    # set coarse_factor
+def readEsriHeader(file):
+    '''
+    Read the header of an ESRI ASCII grid from an open file.
+    Returns a dict with the header values (lower case keys) and the first data line, which has
+    already been consumed from the file.
+    '''
+    header = {}
+    for line in file:
+        tokens = line.split()
+        if len(tokens) == 0:
+            continue
+        key = tokens[0].lower()
+        if key not in ESRI_HEADER_KEYS:
+            return header, line
+        header[key] = tokens[1]
+    return header, ""
+
+
+def _esriRows(file, first_line, ncols, dtype):
+    ''' Yield the grid rows as arrays. Rows wrapped over several lines are joined. '''
+    pending = []
+    count = 0
+    for line in itertools.chain([first_line], file):
+        if not line.strip():
+            continue
+        values = np.fromstring(line, dtype=dtype, sep=' ')
+        if count == 0 and len(values) == ncols:
+            yield values
+            continue
+        pending.append(values)
+        count += len(values)
+        if count >= ncols:
+            values = np.concatenate(pending)
+            yield values[:ncols]
+            pending = [values[ncols:]]
+            count = len(pending[0])
+
+
+def _esriGeometry(header):
+    ''' Normalise the header: x0, y0 are the coordinates (m) of the centre of the lower left cell. '''
+    cellsize = round(float(header["cellsize"]), 3)                      # CELLSIZE
+    if "xllcenter" in header:
+        x0 = round(float(header["xllcenter"]), 3)
+    else:
+        x0 = round(float(header["xllcorner"]), 3) + cellsize / 2
+    if "yllcenter" in header:
+        y0 = round(float(header["yllcenter"]), 3)
+    else:
+        y0 = round(float(header["yllcorner"]), 3) + cellsize / 2
+    return {"ncols": int(header["ncols"]),                              # NCOLS
+            "nrows": int(header["nrows"]),                              # NROWS
+            "cellsize": cellsize,
+            "x0": x0,
+            "y0": y0,
+            "nodata_value": float(header.get("nodata_value", -9999))}   # NODATA_VALUE
+
+
+def _fillEsriGrid(file, first_line, geometry, rows, col_slice, out):
+    ''' Read the rows listed in "rows" (ascending) into "out". Returns the number of rows read. '''
+    if len(rows) == 0:
+        return 0
+    wanted = set(rows.tolist())
+    last = rows[-1]
+    k = 0
+    for row, values in enumerate(_esriRows(file, first_line, geometry["ncols"], out.dtype)):
+        if row > last:
+            break
+        if row in wanted:
+            out[k] = values[col_slice]
+            k += 1
+    out[k:] = np.nan
+    return k
+
+
+def getCacheDir():
+    path = os.path.join(FreeCAD.getUserCachePath(), "PVPlant", "DEM")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _cacheKey(filename, coarse_factor, dtype):
+    '''
+    Name of the cache of "filename": "<path hash>_<version hash>". The version hash changes with
+    the size, mtime, coarse_factor and dtype, so the caches of older versions of the file can be
+    found by the path hash and pruned.
+    '''
+    stat = os.stat(filename)
+    path = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()[:16]
+    version = "|".join([str(stat.st_size), str(stat.st_mtime_ns), str(coarse_factor), np.dtype(dtype).str])
+    return path + "_" + hashlib.sha1(version.encode("utf-8")).hexdigest()[:16]
+
+
+def _pruneEsriCache(filename):
+    ''' Remove the caches of "filename" made for another size or mtime of the file '''
+    stat = os.stat(filename)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    path = getCacheDir()
+    prefix = _cacheKey(filename, 1, np.float32).split("_")[0] + "_"
+    for name in os.listdir(path):
+        if not (name.startswith(prefix) and name.endswith(".json")):
+            continue
+        base = os.path.join(path, name[:-5])
+        try:
+            with open(base + ".json", "r") as file:
+                if json.load(file).get("stamp") == stamp:
+                    continue
+        except (OSError, ValueError):
+            pass
+        for extension in (".npy", ".json"):
+            try:
+                os.remove(base + extension)
+            except OSError:
+                pass
+
+
+def _esriWindow(geometry, boundbox=None, grid_space=1, offset=None):
+    '''
+    Rows and columns of the file inside "boundbox", decimated by
+    coarse_factor = round(grid_space / cellsize): (coarse_factor, (row_min, row_max, col_min, col_max)).
+    row_min and col_min are multiples of coarse_factor.
+    '''
+    if offset is None:
+        offset = FreeCAD.Vector(0, 0, 0)
+    cellsize = geometry["cellsize"]
+    x0 = geometry["x0"]
+    ytop = geometry["y0"] + cellsize * (geometry["nrows"] - 1)
     coarse_factor = max(round(grid_space / cellsize), 1)
 
-    # Get z values
-    templist = templist[6:(6 + ny)]
-    templist = [templist[i][0::coarse_factor] for i in np.arange(0, len(templist), coarse_factor)]
-    datavals = np.array(templist).astype(float)
-    del templist
-
-    # create xy coordinates: Coordenada X-Y del origen (por el centro o la esquina inferior
-    # izquierda de la celda)
-    if xllref.upper() == "XLLCENTER":
-        xllvalue = xllvalue - cellsize * nx / 2.0
-    if yllref.upper() == "YLLCENTER":
-        yllvalue = yllvalue - cellsize * ny / 2.0
-    x = 1000 * (cellsize * np.arange(nx)[0::coarse_factor] + xllvalue)
-    y = 1000 * (cellsize * np.arange(ny)[-1::-1][0::coarse_factor] + yllvalue)
-    z = 1000 * datavals
+    col_min, col_max = 0, geometry["ncols"] - 1
+    row_min, row_max = 0, geometry["nrows"] - 1
+    if boundbox is not None:
+        eps = cellsize * 1e-6
+        col_min = max(col_min, math.ceil(((boundbox.XMin + offset.x) / 1000 - x0) / cellsize - eps))
+        col_max = min(col_max, math.floor(((boundbox.XMax + offset.x) / 1000 - x0) / cellsize + eps))
+        row_min = max(row_min, math.ceil((ytop - (boundbox.YMax + offset.y) / 1000) / cellsize - eps))
+        row_max = min(row_max, math.floor((ytop - (boundbox.YMin + offset.y) / 1000) / cellsize + eps))
+    col_min = math.ceil(col_min / coarse_factor) * coarse_factor
+    row_min = math.ceil(row_min / coarse_factor) * coarse_factor
+    return coarse_factor, (row_min, row_max, col_min, col_max)
+
+
+def loadEsriCache(filename, grid_space=1, dtype=np.float32):
+    '''
+    Return (geometry, grid) from the binary cache of "filename", or (None, None) if there is no
+    valid cache. The grid is memory-mapped (read only) and holds the whole file decimated by
+    coarse_factor, z in meters with NaN for nodata cells.
+    '''
+    with open(filename, "r") as file:
+        geometry = _esriGeometry(readEsriHeader(file)[0])
+    coarse_factor = max(round(grid_space / geometry["cellsize"]), 1)
+    base = os.path.join(getCacheDir(), _cacheKey(filename, coarse_factor, dtype))
+    try:
+        with open(base + ".json", "r") as file:
+            cached = json.load(file)
+        cached.pop("stamp", None)
+        grid = np.load(base + ".npy", mmap_mode="r")
+    except (OSError, ValueError):
+        return None, None
+    if cached != geometry:
+        return None, None
+    return geometry, grid
+
+
+def buildEsriCache(filename, grid_space=1, dtype=np.float32):
+    '''
+    Parse "filename" once, decimated by coarse_factor, straight into a memory-mapped .npy file in
+    the cache directory. The header goes to a .json file next to it. Both are written to unique
+    temporary files first, so a cache is never read half written, and the caches of older
+    versions of the file are removed.
+    '''
+    import tempfile
+    from numpy.lib.format import open_memmap
+
+    path = getCacheDir()
+    stat = os.stat(filename)
+    handle, tmp = tempfile.mkstemp(suffix=".npy", dir=path)
+    os.close(handle)
+    try:
+        with open(filename, "r") as file:
+            header, first_line = readEsriHeader(file)
+            geometry = _esriGeometry(header)
+            coarse_factor = max(round(grid_space / geometry["cellsize"]), 1)
+            base = os.path.join(path, _cacheKey(filename, coarse_factor, dtype))
+            rows = np.arange(0, geometry["nrows"], coarse_factor)
+            cols = np.arange(0, geometry["ncols"], coarse_factor)
+            grid = open_memmap(tmp, mode="w+", dtype=dtype, shape=(len(rows), len(cols)))
+            _fillEsriGrid(file, first_line, geometry, rows, slice(0, None, coarse_factor), grid)
+            grid[grid == geometry["nodata_value"]] = np.nan
+            grid.flush()
+            del grid
+        os.replace(tmp, base + ".npy")
+
+        handle, tmp = tempfile.mkstemp(suffix=".json", dir=path)
+        with os.fdopen(handle, "w") as file:
+            json.dump(dict(geometry, stamp=[stat.st_size, stat.st_mtime_ns]), file)
+        os.replace(tmp, base + ".json")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    _pruneEsriCache(filename)
+    return geometry, np.load(base + ".npy", mmap_mode="r")
+
+
+def readEsriGrid(filename, boundbox=None, grid_space=1, offset=None, dtype=np.float32, cache=True):
+    '''
+    Read an ESRI ASCII grid (.asc) into a NumPy array.
+
+    Only the rows and columns inside "boundbox" are kept and the grid is decimated by
+    coarse_factor = round(grid_space / cellsize) while it is read, so the memory used is the
+    memory of the result and not the memory of the whole file.
+    With "cache" the decimated grid is parsed only once and stored as a binary .npy file keyed by
+    path, size, mtime, coarse_factor and dtype; later calls (other boundary, reopened project)
+    just memory-map it and slice the window.
+    - boundbox: FreeCAD.BoundBox (mm) in the same frame as the output coordinates.
+    - offset: FreeCAD.Vector (mm) subtracted to the x, y coordinates (Site.Origin).
+    Returns x (mm, west to east), y (mm, north to south), z (mm, NaN for nodata cells),
+    cellsize (m) and nodata_value.
+    '''
+    if offset is None:
+        offset = FreeCAD.Vector(0, 0, 0)
+
+    with open(filename, "r") as file:
+        geometry = _esriGeometry(readEsriHeader(file)[0])
+    cellsize = geometry["cellsize"]
+    nodata_value = geometry["nodata_value"]
+    x0 = geometry["x0"]
+    ytop = geometry["y0"] + cellsize * (geometry["nrows"] - 1)
+
+    # Window of rows and columns to read:
+    coarse_factor, window = _esriWindow(geometry, boundbox, grid_space, offset)
+    row_min, row_max, col_min, col_max = window
+    cols = np.arange(col_min, col_max + 1, coarse_factor)
+    rows = np.arange(row_min, row_max + 1, coarse_factor)
+
+    cached = None
+    if cache and len(rows) > 0 and len(cols) > 0:
+        try:
+            cached = loadEsriCache(filename, grid_space, dtype)[1]
+            if cached is None:
+                cached = buildEsriCache(filename, grid_space, dtype)[1]
+        except OSError as err:
+            FreeCAD.Console.PrintWarning("DEM cache not available: {}\n".format(err))
+            cached = None
 
+    if len(rows) == 0 or len(cols) == 0:
+        z = np.empty((len(rows), len(cols)), dtype=dtype)
+    elif cached is not None:
+        # cached row/column k is the row/column k * coarse_factor of the file:
+        z = np.array(cached[row_min // coarse_factor:row_max // coarse_factor + 1,
+                            col_min // coarse_factor:col_max // coarse_factor + 1], dtype=dtype)
+    else:
+        z = np.empty((len(rows), len(cols)), dtype=dtype)
+        with open(filename, "r") as file:
+            first_line = readEsriHeader(file)[1]
+            _fillEsriGrid(file, first_line, geometry, rows, slice(col_min, col_max + 1, coarse_factor), z)
+        z[z == nodata_value] = np.nan
+
+    z *= 1000
+    x = 1000 * (x0 + cellsize * cols) - offset.x
+    y = 1000 * (ytop - cellsize * rows) - offset.y
     return x, y, z, cellsize, nodata_value
 
 
+def openEsri(filename, boundbox=None, offset=None):
+    return readEsriGrid(filename, boundbox, offset=offset)
+
+
+def cropGrid(x, y, z, boundbox):
+    '''
+    Crop a grid to "boundbox" (same frame as x, y) with binary searches on its axes, which can be
+    ascending or descending. Returns views of x, y and z, nothing is copied.
+    '''
+    def window(axis, vmin, vmax):
+        if len(axis) > 1 and axis[0] > axis[-1]:
+            n = len(axis)
+            return slice(n - np.searchsorted(axis[::-1], vmax, side="right"),
+                         n - np.searchsorted(axis[::-1], vmin, side="left"))
+        return slice(np.searchsorted(axis, vmin, side="left"),
+                     np.searchsorted(axis, vmax, side="right"))
+
+    cols = window(x, boundbox.XMin, boundbox.XMax)
+    rows = window(y, boundbox.YMin, boundbox.YMax)
+    return x[cols], y[rows], z[rows, cols]
+
+
+def gridPoints(x, y, z, chunk=1000000):
+    '''
+    Yield the valid (not NaN) nodes of a grid as contiguous (n, 3) arrays of about "chunk" points,
+    one block of rows at a time, so the point cloud never exists as a list of Python objects.
+    '''
+    step = max(chunk // max(len(x), 1), 1)
+    for ini in range(0, len(y), step):
+        block = z[ini:ini + step]
+        valid = ~np.isnan(block)
+        rows, cols = np.nonzero(valid)
+        yield np.column_stack((x[cols], y[ini + rows], block[valid]))
+
+
+def _thinVoxels(keys, sums, counts):
+    ''' Merge the rows that share a voxel key: coordinate sums and point counts are added '''
+    keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    sums = np.column_stack([np.bincount(inverse, weights=sums[:, i], minlength=len(keys))
+                            for i in range(3)])
+    counts = np.bincount(inverse, weights=counts, minlength=len(keys))
+    return keys, sums, counts
+
+
+def _thinMinZ(keys, points):
+    ''' Keep the lowest point of every ground cell '''
+    order = np.lexsort((points[:, 2], keys[:, 1], keys[:, 0]))
+    keys = keys[order]
+    points = points[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+    return keys[first], points[first]
+
+
+def readXYZ(filename, columns=(0, 1, 2), delimiter=None, skiprows=0, thinning=None, cellsize=1.0,
+            chunk=1000000):
+    '''
+    Read a CSV / XYZ survey into an (n, 3) array (units of the file).
+    - columns: indexes of the x, y and z columns.
+    - delimiter: column separator, None for blanks.
+    - skiprows: number of header lines.
+    - thinning: None to keep every point, "voxel" for the centroid of the points of each cube of
+      "cellsize", or "minz" for the lowest point of each ground cell of "cellsize".
+    The file is parsed "chunk" rows at a time and each block is thinned before the next one is
+    read, so with thinning the memory used is the memory of the thinned cloud.
+    '''
+    if thinning not in (None, "voxel", "minz"):
+        raise ValueError("Unknown thinning method: {}".format(thinning))
+
+    blocks = []
+    keys = np.empty((0, 3 if thinning == "voxel" else 2), dtype=np.int64)
+    sums = np.empty((0, 3))
+    counts = np.empty(0)
+    with open(filename, "r") as file:
+        for _ in range(skiprows):
+            next(file, None)
+        while True:
+            lines = list(itertools.islice(file, chunk))
+            if len(lines) == 0:
+                break
+            lines = [line for line in lines if line.strip()]
+            if len(lines) == 0:
+                continue
+            points = np.loadtxt(lines, delimiter=delimiter, usecols=columns, ndmin=2)
+            if thinning is None:
+                blocks.append(points)
+                continue
+
+            block_keys = np.floor(points[:, :keys.shape[1]] / cellsize).astype(np.int64)
+            if thinning == "voxel":
+                keys, sums, counts = _thinVoxels(np.concatenate((keys, block_keys)),
+                                                 np.concatenate((sums, points)),
+                                                 np.concatenate((counts, np.ones(len(points)))))
+            else:
+                keys, sums = _thinMinZ(np.concatenate((keys, block_keys)), np.concatenate((sums, points)))
+
+    if thinning is None:
+        return np.concatenate(blocks) if blocks else np.empty((0, 3))
+    if thinning == "voxel":
+        return sums / counts[:, None]
+    return sums
+
+
 def openCSV(filename, delim = ','):
-    import csv
-    pts = list()
-    with open(filename, newline='\n') as csvfile:
-        reader = csv.reader(csvfile, delimiter = delim)
-        for row in reader:
-            pts.append(FreeCAD.Vector(float(row[1]), float(row[2]), float(row[3])))
-
-    return pts
-
-
-def interpolatePoints(points, cellsize = 2.0):
-    import numpy as np
-    import scipy as sp
-    import scipy.interpolate
-
-    pts = list()
-    x = list()
-    y = list()
-    z = list()
-    for point in points:
-        x.append(point.x)
-        y.append(point.y)
-        z.append(point.z)
-
-    x = np.array(x)
-    y = np.array(y)
-    z = np.array(z)
-    spline = sp.interpolate.Rbf(x, y, z, function='thin-plate')
-    xtotalsteps = int((max(x) - min(x)) / cellsize)
-    #ytotalsteps = int((max(y) - min(y)) / cellsize)
-    xi = np.linspace(min(x), max(x), xtotalsteps)
-    step = 100
-    ini = min(y)
-    while ini < max(y):
-        end = min(ini + (step - 1) * cellsize, max(y))
-        yi = np.linspace(ini, end, step)
-        ini = end + cellsize
-        X, Y = np.meshgrid(xi, yi)
-        Z = spline(X, Y)
-        xx = X.flatten()
-        yy = Y.flatten()
-        zz = Z.flatten()
-        for i, point in enumerate(xx):
-            pts.append(FreeCAD.Vector(xx[i], yy[i], zz[i]) * 1000)
-
-    return pts
\ No newline at end of file
+    ''' Survey exported as "id, x, y, z" rows '''
+    return readXYZ(filename, columns=(1, 2, 3), delimiter=delim)
+
+
+def _idwInterpolator(xy, z, neighbours=8, power=2):
+    ''' Inverse distance weighting over the "neighbours" nearest points (KD-tree) '''
+    from scipy.spatial import cKDTree
+
+    tree = cKDTree(xy)
+    k = min(neighbours, len(xy))
+
+    def interpolate(query):
+        dist, idx = tree.query(query, k=k)
+        if k == 1:
+            return z[idx]
+        with np.errstate(divide="ignore"):
+            weights = 1.0 / dist ** power
+        exact = dist[:, 0] == 0
+        weights[exact] = 0
+        weights[exact, 0] = 1
+        return (weights * z[idx]).sum(axis=1) / weights.sum(axis=1)
+
+    return interpolate
+
+
+def interpolatePoints(points, cellsize=2.0, method="linear", neighbours=8, power=2, chunk=250000):
+    '''
+    Interpolate scattered survey points (m) on a regular grid of "cellsize" (m).
+    Only local interpolators are used, so 100k+ points are gridded in seconds:
+    - "linear": piecewise linear on the Delaunay triangulation (NaN outside the convex hull).
+    - "idw": inverse distance weighting of the "neighbours" nearest points (KD-tree).
+    The grid is evaluated in blocks of about "chunk" nodes to bound the memory used.
+    Returns x (mm), y (mm), z (mm, (len(y), len(x))) like readEsriGrid.
+    '''
+    if len(points) and isinstance(points[0], FreeCAD.Vector):
+        points = [(point.x, point.y, point.z) for point in points]
+    points = np.asarray(points, dtype=float)
+    xy = points[:, :2]
+    z = points[:, 2]
+
+    if method == "linear":
+        from scipy.interpolate import LinearNDInterpolator
+        from scipy.spatial import Delaunay
+        interpolate = LinearNDInterpolator(Delaunay(xy), z)
+    elif method == "idw":
+        interpolate = _idwInterpolator(xy, z, neighbours, power)
+    else:
+        raise ValueError("Unknown interpolation method: {}".format(method))
+
+    xmin, ymin = xy.min(axis=0)
+    xmax, ymax = xy.max(axis=0)
+    xi = np.arange(xmin, xmax + cellsize / 2, cellsize)
+    yi = np.arange(ymin, ymax + cellsize / 2, cellsize)
+    zi = np.empty((len(yi), len(xi)))
+
+    step = max(chunk // len(xi), 1)
+    for ini in range(0, len(yi), step):
+        X, Y = np.meshgrid(xi, yi[ini:ini + step])
+        zi[ini:ini + step] = interpolate(np.column_stack((X.ravel(), Y.ravel()))).reshape(X.shape)
+
+    return xi * 1000, yi * 1000, zi * 1000
@@ -0,0 +1,106 @@
+# /**********************************************************************
+# *                                                                     *
+# * Copyright (c) 2021 Javier Braña <javier.branagutierrez@gmail.com>  *
+# *                                                                     *
+# * This program is free software; you can redistribute it and/or modify*
+# * it under the terms of the GNU Lesser General Public License (LGPL)  *
+# * as published by the Free Software Foundation; either version 2 of   *
+# * the License, or (at your option) any later version.                 *
+# * for detail see the LICENCE text file.                               *
+# *                                                                     *
+# * This program is distributed in the hope that it will be useful,     *
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of      *
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the       *
+# * GNU Library General Public License for more details.                *
+# *                                                                     *
+# * You should have received a copy of the GNU Library General Public   *
+# * License along with this program; if not, write to the Free Software *
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307*
+# * USA                                                                 *
+# *                                                                     *
+# ***********************************************************************
+
+'''
+Benchmark of PVPlantPlacement.PlacementEngine on synthetic plants. Run it without GUI:
+
+    FreeCADCmd Utils/placementBenchmark.py [MW ...]
+
+For every power (10, 100 and 500 MW by default) it builds an irregular PV area of about
+HECTARES_PER_MW hectares per MW with a few round prohibited areas, places 1 axis trackers on it
+and prints the time of each step and of an 8x8 sweep of the offsets.
+'''
+
+import os
+import sys
+import time
+import math
+
+import FreeCAD
+import Part
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PVPlantPlacement
+
+HECTARES_PER_MW = 1.6
+TRACKER_LENGTH = 47000      # mm, 45 modules
+TRACKER_WIDTH = 4500        # mm, 2 modules in portrait
+TRACKER_POWER = 90 * 550    # W
+PITCH = 10000               # mm, distance between columns
+GAP = 500                   # mm, between trackers of a column
+
+
+def syntheticArea(power, holes=3):
+    ''' PV area (Part.Face) and prohibited areas of a plant of "power" MW, centred in the origin '''
+    radius = math.sqrt(power * HECTARES_PER_MW * 1e10 / math.pi)
+    points = []
+    for i in range(720):
+        t = 2 * math.pi * i / 720
+        r = radius * (1 + 0.15 * math.sin(3 * t) + 0.08 * math.cos(7 * t))
+        points.append(FreeCAD.Vector(r * math.cos(t), r * math.sin(t), 0))
+    points.append(points[0])
+    area = Part.Face(Part.makePolygon(points))
+
+    prohibited = []
+    for i in range(holes):
+        t = 2 * math.pi * i / holes
+        center = FreeCAD.Vector(0.45 * radius * math.cos(t), 0.45 * radius * math.sin(t), 0)
+        prohibited.append(Part.Face(Part.Wire(Part.makeCircle(0.12 * radius, center))))
+    return area, prohibited
+
+
+def benchmark(power, aligned=True):
+    area, prohibited = syntheticArea(power)
+    engine = PVPlantPlacement.PlacementEngine(area, prohibited, TRACKER_LENGTH, TRACKER_WIDTH,
+                                              PITCH, TRACKER_LENGTH + GAP,
+                                              corridor_count=10, corridor_width=8000)
+    times = []
+    start = time.perf_counter()
+    engine.calculateWorkingArea()
+    times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    if aligned:
+        cols = engine.calculateAlignedArray()
+    else:
+        cols = engine.calculateNonAlignedArray()
+    times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    best = engine.optimize(steps=(8, 8))[0]
+    times.append(time.perf_counter() - start)
+
+    count = sum(len(col) for col in cols)
+    print("{:>6} MW | {:>7.1f} ha | {:>6} trackers ({:>7.1f} MWp) | area {:>7.3f} s | slots {:>7.3f} s | "
+          "optimize 8x8 {:>7.3f} s ({} trackers)".format(power, area.Area / 1e10, count, count * TRACKER_POWER / 1e6,
+                                                         times[0], times[1], times[2], best["count"]))
+    return count, times
+
+
+def run(powers=(10, 100, 500), aligned=True):
+    for power in powers:
+        benchmark(power, aligned)
+
+
+if __name__ == "__main__":
+    powers = [float(arg) for arg in sys.argv[1:] if arg.replace(".", "", 1).isdigit()]
+    run(powers if powers else (10, 100, 500))
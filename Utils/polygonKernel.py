@@ -0,0 +1,236 @@
+# /**********************************************************************
+# *                                                                     *
+# * Copyright (c) 2021 Javier Braña <javier.branagutierrez@gmail.com>  *
+# *                                                                     *
+# * This program is free software; you can redistribute it and/or modify*
+# * it under the terms of the GNU Lesser General Public License (LGPL)  *
+# * as published by the Free Software Foundation; either version 2 of   *
+# * the License, or (at your option) any later version.                 *
+# * for detail see the LICENCE text file.                               *
+# *                                                                     *
+# * This program is distributed in the hope that it will be useful,     *
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of      *
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the       *
+# * GNU Library General Public License for more details.                *
+# *                                                                     *
+# * You should have received a copy of the GNU Library General Public   *
+# * License along with this program; if not, write to the Free Software *
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307*
+# * USA                                                                 *
+# *                                                                     *
+# ***********************************************************************
+
+# Pure NumPy geometry of the placement. This module must not import FreeCAD nor Part: the
+# processes of the placement pool (PVPlantUtils.getProcessPool) import it to run the tasks.
+
+import numpy as np
+
+
+def _polygonEdges(polygons):
+    ''' Stack the edges of all the rings: returns x1, y1, x2, y2 arrays. '''
+    if isinstance(polygons, np.ndarray):
+        polygons = [polygons]
+    edges = np.vstack([np.hstack((polygon[:-1, :2], polygon[1:, :2])) for polygon in polygons])
+    return edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+
+
+def is_inside_sm_array(polygons, points):
+    '''
+    Vectorized version of is_inside_sm (even-odd rule) for an (n, 2) array of points.
+    "polygons" is a closed ring or a list of closed rings (holes are handled by the even-odd
+    rule). Returns a boolean array.
+    '''
+    points = np.asarray(points, dtype=float)
+    px = points[:, 0]
+    py = points[:, 1]
+    inside = np.zeros(len(points), dtype=bool)
+    for x1, y1, x2, y2 in zip(*_polygonEdges(polygons)):
+        if y1 == y2:
+            continue
+        crosses = (y1 <= py) != (y2 <= py)
+        xc = x1 + (py[crosses] - y1) * (x2 - x1) / (y2 - y1)
+        inside[crosses] ^= px[crosses] > xc
+    return inside
+
+
+def gridMask(polygons, x, y):
+    '''
+    Even-odd scanline mask of a regular grid.
+    x: (nx,) column coordinates, y: (ny,) row coordinates (any order).
+    Returns a (ny, nx) boolean array, True for the cells inside the polygons. Every edge
+    crossing of every row is computed in one NumPy pass and the parity is accumulated along
+    the rows, so the cost is O(cells + crossings) instead of one point test per cell.
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    x1, y1, x2, y2 = _polygonEdges(polygons)
+    keep = y1 != y2
+    x1, y1, x2, y2 = x1[keep], y1[keep], x2[keep], y2[keep]
+
+    # rows crossed by each edge: ymin <= y < ymax
+    yorder = np.argsort(y, kind="stable")
+    ys = y[yorder]
+    lo = np.searchsorted(ys, np.minimum(y1, y2), side="left")
+    hi = np.searchsorted(ys, np.maximum(y1, y2), side="left")
+    counts = hi - lo
+    edge = np.repeat(np.arange(len(counts)), counts)
+    start = np.cumsum(counts) - counts
+    row = yorder[lo[edge] + np.arange(counts.sum()) - start[edge]]
+    xc = x1[edge] + (y[row] - y1[edge]) * (x2[edge] - x1[edge]) / (y2[edge] - y1[edge])
+
+    # a crossing toggles every cell to its right
+    xorder = np.argsort(x, kind="stable")
+    col = np.searchsorted(x[xorder], xc, side="right")
+    toggles = np.zeros((len(y), len(x) + 1), dtype=np.int32)
+    np.add.at(toggles, (row, col), 1)
+    mask = (np.cumsum(toggles[:, :-1], axis=1) & 1).astype(bool)
+    result = np.empty_like(mask)
+    result[:, xorder] = mask
+    return result
+
+
+def rectanglesInside(polygons, centers, halfx, halfy, tolerance=1.0, chunk=2000000):
+    '''
+    Vectorized containment test of axis-aligned rectangles (all of the same size).
+    centers: (n, 2) array (mm); halfx, halfy: half sizes of the rectangles (mm).
+    A rectangle is inside when its four corners are inside the polygons (even-odd rule) and no
+    edge of the polygons crosses it. The rectangles are shrunk by "tolerance" so the ones that
+    only touch the boundary are accepted. Returns a boolean array.
+    '''
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    hx = halfx - tolerance
+    hy = halfy - tolerance
+    cx = centers[:, 0]
+    cy = centers[:, 1]
+
+    # 01. corners:
+    corners = np.empty((len(centers), 4, 2))
+    corners[:, :, 0] = cx[:, None] + np.array([-hx, hx, hx, -hx])
+    corners[:, :, 1] = cy[:, None] + np.array([-hy, -hy, hy, hy])
+    inside = is_inside_sm_array(polygons, corners.reshape(-1, 2)).reshape(-1, 4).all(axis=1)
+    candidates = np.flatnonzero(inside)
+    if len(candidates) == 0:
+        return inside
+
+    # 02. edge crossings: pairs edge - rectangle whose x ranges overlap (sorted by x, so every
+    # edge gets a contiguous run of rectangles), then a Liang-Barsky clip of the edge to the box.
+    x1, y1, x2, y2 = _polygonEdges(polygons)
+    order = candidates[np.argsort(cx[candidates], kind="stable")]
+    sx = cx[order]
+    lo = np.searchsorted(sx, np.minimum(x1, x2) - hx, side="right")
+    hi = np.searchsorted(sx, np.maximum(x1, x2) + hx, side="left")
+    counts = np.maximum(hi - lo, 0)
+
+    crossed = np.zeros(len(centers), dtype=bool)
+    ini = 0
+    while ini < len(counts):
+        end = ini + max(1, int(np.searchsorted(np.cumsum(counts[ini:]), chunk, side="right")))
+        cnt = counts[ini:end]
+        edge = np.repeat(np.arange(ini, end), cnt)
+        start = np.cumsum(cnt) - cnt
+        rect = order[lo[edge] + np.arange(cnt.sum()) - start[edge - ini]]
+        ini = end
+        if len(rect) == 0:
+            continue
+
+        tenter = np.zeros(len(rect))
+        texit = np.ones(len(rect))
+        for p1, p2, c, h in ((x1[edge], x2[edge], cx[rect], hx), (y1[edge], y2[edge], cy[rect], hy)):
+            d = p2 - p1
+            flat = d == 0
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ta = (c - h - p1) / d
+                tb = (c + h - p1) / d
+            out = flat & (np.abs(p1 - c) >= h)
+            tenter = np.where(flat, tenter, np.maximum(tenter, np.minimum(ta, tb)))
+            texit = np.where(flat, texit, np.minimum(texit, np.maximum(ta, tb)))
+            texit[out] = -1
+        crossed[rect[tenter < texit]] = True
+
+    return inside & ~crossed
+
+
+def _rangePairs(lo, hi):
+    ''' Expand the ranges lo[i]:hi[i] to the pairs (i, j) with lo[i] <= j < hi[i]. '''
+    counts = np.maximum(hi - lo, 0)
+    first = np.repeat(np.arange(len(counts)), counts)
+    start = np.cumsum(counts) - counts
+    return first, lo[first] + np.arange(counts.sum()) - start[first]
+
+
+def columnIntervals(polygons, x, halfx, halfy, tolerance=1.0):
+    '''
+    Valid centres of axis-aligned rectangles (half sizes halfx, halfy) in the columns "x": for
+    every column, the y intervals where the centre of a rectangle can go with the rectangle inside
+    the polygons (same test as rectanglesInside).
+    The centre line of every column is cut with all the edges at once (crossings sorted and paired,
+    even-odd rule), the y ranges of the edges that pass through the column strip are removed and
+    the rest is shrunk by halfy.
+    Returns col (index in x), start, end arrays, sorted by column and y.
+    '''
+    x = np.asarray(x, dtype=float)
+    hx = halfx - tolerance
+    hy = halfy - tolerance
+    x1, y1, x2, y2 = _polygonEdges(polygons)
+    exmin = np.minimum(x1, x2)
+    exmax = np.maximum(x1, x2)
+    xorder = np.argsort(x, kind="stable")
+    xs = x[xorder]
+
+    # 01. inside the polygons: crossings of the centre lines (exmin <= x < exmax)
+    edge, col = _rangePairs(np.searchsorted(xs, exmin, side="left"), np.searchsorted(xs, exmax, side="left"))
+    yc = y1[edge] + (xs[col] - x1[edge]) * (y2[edge] - y1[edge]) / (x2[edge] - x1[edge])
+    order = np.lexsort((yc, col))
+    col, yc = col[order], yc[order]
+    inside = (col[0::2], yc[0::2], yc[1::2])
+
+    # 02. blocked: y range of the edges clipped to the open strip (x - hx, x + hx)
+    edge, col = _rangePairs(np.searchsorted(xs, exmin - hx, side="right"),
+                            np.searchsorted(xs, exmax + hx, side="left"))
+    dx = x2[edge] - x1[edge]
+    dy = y2[edge] - y1[edge]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ta = (xs[col] - hx - x1[edge]) / dx
+        tb = (xs[col] + hx - x1[edge]) / dx
+    t0 = np.where(dx == 0, 0, np.clip(np.minimum(ta, tb), 0, 1))
+    t1 = np.where(dx == 0, 1, np.clip(np.maximum(ta, tb), 0, 1))
+    ya = y1[edge] + t0 * dy
+    yb = y1[edge] + t1 * dy
+    blocked = (col, np.minimum(ya, yb), np.maximum(ya, yb))
+
+    # 03. free = inside - blocked: sweep of the events of every column sorted by y
+    ncol = (len(inside[0]), len(blocked[0]))
+    ecol = np.concatenate((inside[0], inside[0], blocked[0], blocked[0]))
+    ey = np.concatenate((inside[1], inside[2], blocked[1], blocked[2]))
+    ea = np.concatenate((np.ones(ncol[0]), -np.ones(ncol[0]), np.zeros(2 * ncol[1]))).astype(int)
+    eb = np.concatenate((np.zeros(2 * ncol[0]), np.ones(ncol[1]), -np.ones(ncol[1]))).astype(int)
+    order = np.lexsort((ey, ecol))
+    ecol, ey, ea, eb = ecol[order], ey[order], ea[order], eb[order]
+    free = (np.cumsum(ea) > 0) & (np.cumsum(eb) == 0)
+    free[:-1] &= ecol[:-1] == ecol[1:]
+    free[-1:] = False
+
+    # runs of free segments, shrunk by hy:
+    idx = np.flatnonzero(free)
+    first = np.ones(len(idx), dtype=bool)
+    first[1:] = idx[1:] != idx[:-1] + 1
+    last = np.ones(len(idx), dtype=bool)
+    last[:-1] = first[1:]
+    col = ecol[idx[first]]
+    start = ey[idx[first]] + hy
+    end = ey[idx[last] + 1] - hy
+    keep = start <= end
+    col, start, end = xorder[col[keep]], start[keep], end[keep]
+    order = np.lexsort((start, col))
+    return col[order], start[order], end[order]
+
+
+def gridRectanglesInside(polygons, x, y, halfx, halfy, tolerance=1.0):
+    ''' rectanglesInside for the centres of a grid: returns a (len(x), len(y)) boolean array. '''
+    gx, gy = np.meshgrid(np.asarray(x, dtype=float), np.asarray(y, dtype=float), indexing="ij")
+    centers = np.column_stack((gx.ravel(), gy.ravel()))
+    return rectanglesInside(polygons, centers, halfx, halfy, tolerance).reshape(gx.shape)
+
+
+def _gridRectanglesTask(args):
+    return gridRectanglesInside(*args)
@@ -0,0 +1,340 @@
+# /**********************************************************************
+# *                                                                     *
+# * Copyright (c) 2021 Javier Braña <javier.branagutierrez@gmail.com>  *
+# *                                                                     *
+# * This program is free software; you can redistribute it and/or modify*
+# * it under the terms of the GNU Lesser General Public License (LGPL)  *
+# * as published by the Free Software Foundation; either version 2 of   *
+# * the License, or (at your option) any later version.                 *
+# * for detail see the LICENCE text file.                               *
+# *                                                                     *
+# * This program is distributed in the hope that it will be useful,     *
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of      *
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the       *
+# * GNU Library General Public License for more details.                *
+# *                                                                     *
+# * You should have received a copy of the GNU Library General Public   *
+# * License along with this program; if not, write to the Free Software *
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307*
+# * USA                                                                 *
+# *                                                                     *
+# ***********************************************************************
+
+import FreeCAD
+import numpy as np
+
+
+def toXY(points):
+    '''
+    Convert a list of FreeCAD.Vector, a list of tuples or an array to an (n, 2) float array.
+    '''
+    if isinstance(points, np.ndarray):
+        return np.asarray(points[..., :2], dtype=float).reshape(-1, 2)
+    return np.array([[p[0], p[1]] for p in points], dtype=float).reshape(-1, 2)
+
+
+def densify(points, step):
+    '''
+    Insert points along a polyline ((n, 2+) array) so that no segment is longer than "step".
+    The original vertexes are kept.
+    '''
+    points = np.asarray(points, dtype=float)
+    if len(points) < 2 or not step:
+        return points
+    seg = points[1:] - points[:-1]
+    lengths = np.linalg.norm(seg[:, :2], axis=1)
+    parts = np.maximum(np.ceil(lengths / step).astype(int), 1)
+    segment = np.repeat(np.arange(len(seg)), parts)
+    start = np.cumsum(parts) - parts
+    t = (np.arange(parts.sum()) - start[segment]) / parts[segment]
+    result = points[segment] + seg[segment] * t[:, None]
+    return np.vstack((result, points[-1:]))
+
+
+def meshArrays(mesh):
+    ''' Vertex (n, 3) and face index (m, 3) arrays of a Mesh.Mesh '''
+    points, faces = mesh.Topology
+    points = np.array([[p.x, p.y, p.z] for p in points], dtype=float).reshape(-1, 3)
+    faces = np.array(faces, dtype=np.int64).reshape(-1, 3)
+    return points, faces
+
+
+class MeshIndex:
+    '''
+    2D bucket grid over the xy footprint of the facets of a terrain mesh.
+    Every bucket lists the facets whose bounding box touches it (CSR layout: cellStart,
+    cellFacets), so a vertical ray at (x, y) only has to test the few facets of its bucket.
+    Queries are solved for whole point batches with barycentric coordinates in NumPy.
+    '''
+
+    def __init__(self, points, faces, cellsize=None):
+        self.points = np.asarray(points, dtype=float)
+        self.faces = np.asarray(faces, dtype=np.int64)
+        tri = self.points[self.faces]                               # (m, 3, 3)
+        tmin = tri[:, :, :2].min(axis=1)
+        tmax = tri[:, :, :2].max(axis=1)
+        self.origin = tmin.min(axis=0)
+        extent = np.maximum(tmax.max(axis=0) - self.origin, 1e-9)
+        if cellsize is None:
+            cellsize = 2 * np.sqrt(extent[0] * extent[1] / max(len(self.faces), 1))
+        self.cellsize = max(float(cellsize), 1e-6)
+        self.nx = int(extent[0] // self.cellsize) + 1
+        self.ny = int(extent[1] // self.cellsize) + 1
+
+        # (facet, bucket) pairs:
+        i0, j0 = self._bucket(tmin)
+        i1, j1 = self._bucket(tmax)
+        width = i1 - i0 + 1
+        counts = width * (j1 - j0 + 1)
+        facet = np.repeat(np.arange(len(self.faces)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        bucket = (j0[facet] + local // width[facet]) * self.nx + i0[facet] + local % width[facet]
+
+        order = np.argsort(bucket, kind="stable")
+        self.cellFacets = facet[order]
+        self.cellStart = np.concatenate(([0], np.cumsum(np.bincount(bucket, minlength=self.nx * self.ny))))
+        self._normals = None
+
+    @classmethod
+    def fromMesh(cls, mesh, cellsize=None):
+        return cls(*meshArrays(mesh), cellsize=cellsize)
+
+    def _bucket(self, xy):
+        ij = np.floor((xy - self.origin) / self.cellsize).astype(np.int64)
+        return np.clip(ij[:, 0], 0, self.nx - 1), np.clip(ij[:, 1], 0, self.ny - 1)
+
+    def locate(self, xy, chunk=200000, eps=1e-9):
+        '''
+        Facet under each xy point and its height (barycentric interpolation).
+        Returns (facets, z): -1 / NaN for the points outside the mesh. When several facets are
+        hit (folds), the highest one is kept, as a ray coming from above would do.
+        '''
+        xy = toXY(xy)
+        facets = np.full(len(xy), -1, dtype=np.int64)
+        z = np.full(len(xy), np.nan)
+        for start in range(0, len(xy), chunk):
+            p = xy[start:start + chunk]
+            ij = np.floor((p - self.origin) / self.cellsize).astype(np.int64)
+            inside = (ij[:, 0] >= 0) & (ij[:, 0] < self.nx) & (ij[:, 1] >= 0) & (ij[:, 1] < self.ny)
+            query = np.flatnonzero(inside)
+            bucket = ij[query, 1] * self.nx + ij[query, 0]
+            first = self.cellStart[bucket]
+            counts = self.cellStart[bucket + 1] - first
+            # every (point, candidate facet) pair:
+            pair_point = np.repeat(query, counts)
+            pair_facet = self.cellFacets[np.repeat(first, counts) +
+                                         np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+            tri = self.points[self.faces[pair_facet]]
+            a = tri[:, 0, :2]
+            v0 = tri[:, 1, :2] - a
+            v1 = tri[:, 2, :2] - a
+            v2 = p[pair_point] - a
+            d = v0[:, 0] * v1[:, 1] - v1[:, 0] * v0[:, 1]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                l1 = (v2[:, 0] * v1[:, 1] - v1[:, 0] * v2[:, 1]) / d
+                l2 = (v0[:, 0] * v2[:, 1] - v2[:, 0] * v0[:, 1]) / d
+            l0 = 1 - l1 - l2
+            hit = (d != 0) & (l0 >= -eps) & (l1 >= -eps) & (l2 >= -eps)
+            if not hit.any():
+                continue
+            pz = l0[hit] * tri[hit, 0, 2] + l1[hit] * tri[hit, 1, 2] + l2[hit] * tri[hit, 2, 2]
+            pp = pair_point[hit]
+            pf = pair_facet[hit]
+            # highest hit of each point:
+            order = np.lexsort((-pz, pp))
+            keep = order[np.r_[True, pp[order][1:] != pp[order][:-1]]]
+            facets[start + pp[keep]] = pf[keep]
+            z[start + pp[keep]] = pz[keep]
+        return facets, z
+
+    def facetNormals(self):
+        ''' Unit normals (pointing up) of all the facets '''
+        if self._normals is None:
+            tri = self.points[self.faces]
+            normals = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+            normals /= np.linalg.norm(normals, axis=1)[:, None]
+            normals[normals[:, 2] < 0] *= -1
+            self._normals = normals
+        return self._normals
+
+
+class TerrainSampler:
+    '''
+    Batched terrain queries.
+    Built from a regular grid (DEM: x ascending or descending, y, z (ny, nx) in mm with NaN for
+    nodata) it interpolates bilinearly; built from a Mesh.Mesh (terrains from point groups) it
+    casts vertical rays on the facets through a MeshIndex.
+    All the queries take an (n, 2) xy array (or a list of vectors) and return arrays; points
+    outside the terrain get NaN.
+    '''
+
+    def __init__(self, x=None, y=None, z=None, mesh=None):
+        self.x = self.y = self.z = None
+        self.mesh = None
+        if z is not None:
+            self.x = np.asarray(x, dtype=float)
+            self.y = np.asarray(y, dtype=float)
+            self.z = z
+            self.dx = self.x[1] - self.x[0] if len(self.x) > 1 else 1.0
+            self.dy = self.y[1] - self.y[0] if len(self.y) > 1 else 1.0
+        elif mesh is not None:
+            self.mesh = mesh
+            self.index = MeshIndex.fromMesh(mesh)
+        else:
+            raise ValueError("TerrainSampler needs a grid or a mesh")
+
+    @property
+    def isGrid(self):
+        return self.z is not None
+
+    # -- grid --------------------------------------------------------------------------------------
+    def _cells(self, xy):
+        ''' Cell index (i: column, j: row) and local coordinates (tx, ty) of each point. '''
+        fx = (xy[:, 0] - self.x[0]) / self.dx
+        fy = (xy[:, 1] - self.y[0]) / self.dy
+        nx = len(self.x)
+        ny = len(self.y)
+        outside = (fx < 0) | (fx > nx - 1) | (fy < 0) | (fy > ny - 1) | np.isnan(fx) | np.isnan(fy)
+        i = np.clip(np.floor(np.nan_to_num(fx)).astype(np.int64), 0, max(nx - 2, 0))
+        j = np.clip(np.floor(np.nan_to_num(fy)).astype(np.int64), 0, max(ny - 2, 0))
+        tx = fx - i
+        ty = fy - j
+        return i, j, tx, ty, outside
+
+    def _corners(self, i, j):
+        i1 = np.minimum(i + 1, len(self.x) - 1)
+        j1 = np.minimum(j + 1, len(self.y) - 1)
+        return self.z[j, i], self.z[j, i1], self.z[j1, i], self.z[j1, i1]
+
+    def _gridHeights(self, xy):
+        i, j, tx, ty, outside = self._cells(xy)
+        z00, z10, z01, z11 = self._corners(i, j)
+        z = (z00 * (1 - tx) + z10 * tx) * (1 - ty) + (z01 * (1 - tx) + z11 * tx) * ty
+        z = np.asarray(z, dtype=float)
+        z[outside] = np.nan
+        return z
+
+    def _gridGradient(self, xy):
+        i, j, tx, ty, outside = self._cells(xy)
+        z00, z10, z01, z11 = self._corners(i, j)
+        dzdx = ((z10 - z00) * (1 - ty) + (z11 - z01) * ty) / self.dx
+        dzdy = ((z01 - z00) * (1 - tx) + (z11 - z10) * tx) / self.dy
+        dzdx = np.asarray(dzdx, dtype=float)
+        dzdy = np.asarray(dzdy, dtype=float)
+        dzdx[outside] = np.nan
+        dzdy[outside] = np.nan
+        return dzdx, dzdy
+
+    # -- public --------------------------------------------------------------------------------------
+    def heights(self, xy):
+        ''' Terrain height (mm) at each xy point. '''
+        xy = toXY(xy)
+        if self.isGrid:
+            return self._gridHeights(xy)
+        return self.index.locate(xy)[1]
+
+    def normals(self, xy):
+        ''' Unit normal (pointing up) of the terrain at each xy point: (n, 3) array. '''
+        xy = toXY(xy)
+        if self.isGrid:
+            dzdx, dzdy = self._gridGradient(xy)
+            normals = np.column_stack((-dzdx, -dzdy, np.ones(len(xy))))
+            return normals / np.linalg.norm(normals, axis=1)[:, None]
+        facets = self.index.locate(xy)[0]
+        normals = np.full((len(xy), 3), np.nan)
+        hit = facets >= 0
+        normals[hit] = self.index.facetNormals()[facets[hit]]
+        return normals
+
+    def slopes(self, xy):
+        ''' Slope of the terrain at each xy point, in degrees. '''
+        normals = self.normals(xy)
+        return np.degrees(np.arccos(np.clip(normals[:, 2], -1, 1)))
+
+    def drapePoints(self, points):
+        '''
+        Return the points (FreeCAD.Vector) on the terrain; the points outside the terrain are
+        skipped.
+        '''
+        xy = toXY(points)
+        z = self.heights(xy)
+        ok = ~np.isnan(z)
+        return [FreeCAD.Vector(px, py, pz) for px, py, pz in np.column_stack((xy[ok], z[ok])).tolist()]
+
+    def drapePolyline(self, points, step=1000):
+        '''
+        Sample a polyline on the terrain every "step" mm (the vertexes are kept).
+        Returns a list of sections (lists of FreeCAD.Vector), split where the line leaves the
+        terrain, like MeshPart.projectShapeOnMesh.
+        '''
+        xy = densify(toXY(points), step)
+        z = self.heights(xy)
+        ok = ~np.isnan(z)
+        pts = np.column_stack((xy, z))
+        sections = []
+        breaks = np.flatnonzero(np.diff(ok.astype(np.int8)) != 0) + 1
+        for chunk, valid in zip(np.split(pts, breaks), np.split(ok, breaks)):
+            if valid[0] and len(chunk) > 0:
+                sections.append([FreeCAD.Vector(*p) for p in chunk.tolist()])
+        return sections
+
+    def drapeShape(self, shape, step=1000, deflection=100):
+        ''' Same as drapePolyline for every wire (or loose edge) of a shape. '''
+        sections = []
+        wires = shape.Wires if len(shape.Wires) > 0 else shape.Edges
+        for wire in wires:
+            sections.extend(self.drapePolyline(wire.discretize(Deflection=deflection), step))
+        return sections
+
+
+_meshSamplers = {}
+_samplerObserver = None
+
+
+class _SamplerObserver:
+    ''' Document observer that forgets the cached sampler of an object when its mesh or shape changes '''
+
+    def slotChangedObject(self, obj, prop):
+        if prop in ("Mesh", "Shape"):
+            _meshSamplers.pop((obj.Document.Name, obj.Name), None)
+
+    def slotDeletedObject(self, obj):
+        _meshSamplers.pop((obj.Document.Name, obj.Name), None)
+
+    def slotDeletedDocument(self, doc):
+        for key in [key for key in _meshSamplers if key[0] == doc.Name]:
+            del _meshSamplers[key]
+
+
+def getSampler(terrain=None, tolerance=0):
+    '''
+    Return the TerrainSampler of a terrain (by default the terrain of the Site).
+    "tolerance" (mm) lets PVPlant terrains answer from a coarser level of their pyramid.
+    PVPlant terrains keep their own sampler; plain mesh or part objects get a mesh sampler that
+    is kept here (so the MeshIndex is built once) until a document observer sees their mesh or
+    shape change.
+    '''
+    global _samplerObserver
+
+    if terrain is None:
+        import PVPlantSite
+        terrain = PVPlantSite.get().Terrain
+    if terrain is None:
+        return None
+    if hasattr(terrain, "Proxy") and hasattr(terrain.Proxy, "getSampler"):
+        return terrain.Proxy.getSampler(terrain, tolerance)
+
+    if hasattr(terrain, "Mesh") and terrain.Mesh.CountFacets == 0:
+        return None
+    if _samplerObserver is None:
+        _samplerObserver = _SamplerObserver()
+        FreeCAD.addDocumentObserver(_samplerObserver)
+    key = (terrain.Document.Name, terrain.Name)
+    if key not in _meshSamplers:
+        if hasattr(terrain, "Mesh"):
+            sampler = TerrainSampler(mesh=terrain.Mesh)
+        else:
+            import Mesh
+            sampler = TerrainSampler(mesh=Mesh.Mesh(terrain.Shape.tessellate(100)))
+        _meshSamplers[key] = sampler
+    return _meshSamplers[key]
@@ -30,7 +30,7 @@ class _CommandReload:
             PVPlantRoad, PVPlantTerrain, PVPlantStringing, PVPlantManhole, \
             PVPlantBOQMechanical, PVPlantBOQElectrical, PVPlantArea, GraphProfile, \
             exportDXF, importDXF
-        from Utils import PVPlantUtils
+        from Utils import PVPlantUtils, polygonKernel
         from Utils import PVPlantTrace, m_gui_edit, profile_editor, graphics
         #from  Lib import GoogleMapDownloader
 
@@ -59,6 +59,7 @@ class _CommandReload:
         importlib.reload(PVPlantBOQMechanical)
         importlib.reload(PVPlantBOQElectrical)
         importlib.reload(PVPlantArea)
+        importlib.reload(polygonKernel)
         importlib.reload(PVPlantUtils)
         importlib.reload(PVPlantManhole)
         importlib.reload(GraphProfile)